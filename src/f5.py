@@ -1,3 +1,9 @@
+import cProfile
+import os
+import re
+import tempfile
+import time
+
 from six import PY3
 from stackstate_checks.base import (
     AgentCheck,
@@ -8,7 +14,10 @@ from stackstate_checks.base import (
 )
 from stackstate_etl_check_processor import AgentProcessor
 
+from sts_f5_impl.client import F5Client
+from sts_f5_impl.client.query_schedule import QuerySchedule
 from sts_f5_impl.model.instance import InstanceInfo
+from sts_f5_impl.topology_delta import TopologyDelta
 
 
 class F5Check(AgentCheck):
@@ -16,6 +25,10 @@ class F5Check(AgentCheck):
 
     def __init__(self, name, init_config, agentConfig, instances=None):
         super().__init__(name, init_config, agentConfig, instances)
+        self._schedules = {}
+        self._deltas = {}
+        self._delta = None
+        self._topology_snapshot = True
 
     def get_instance_key(self, instance):
         if "instance_url" not in instance:
@@ -30,7 +43,113 @@ class F5Check(AgentCheck):
         return TopologyInstance(instance_type, instance_url)
 
     def check(self, instance):
-        AgentProcessor(instance, self).process()
+        schedule = self._get_schedule(instance)
+        refs = instance.etl.refs
+        collect_topology = schedule is None or schedule.topology_due()
+        if not collect_topology:
+            instance.etl.refs = schedule.telemetry_refs(refs)
+        client = F5Client.begin_run(instance, self.log)
+        self._delta = self._get_delta(instance) if collect_topology else None
+        # The snapshot the processor sends around every run would delete the components not sent by the run. Runs
+        # without topology templates send no snapshot, and the delta sends the snapshot of full runs itself.
+        self._topology_snapshot = collect_topology and self._delta is None
+        profiler = cProfile.Profile() if instance.slow_run_profile_seconds else None
+        start = time.time()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            if self._delta is not None:
+                self._delta.begin(start)
+            AgentProcessor(instance, self).process()
+            if self._delta is not None:
+                self._send_delta()
+            if schedule is not None and collect_topology:
+                schedule.topology_collected(start)
+        finally:
+            if self._delta is not None:
+                self._send_calls(self._delta.discard())
+                self._delta = None
+            instance.etl.refs = refs
+            self._topology_snapshot = True
+            if profiler is not None:
+                profiler.disable()
+            duration = time.time() - start
+            client.end_run()
+            if profiler is not None and duration > instance.slow_run_profile_seconds:
+                self._dump_profile(instance, profiler, duration)
+            if instance.self_metrics:
+                self._send_self_metrics(instance, client, duration)
+
+    def start_snapshot(self):
+        if self._topology_snapshot:
+            super().start_snapshot()
+
+    def stop_snapshot(self):
+        if self._topology_snapshot:
+            super().stop_snapshot()
+
+    def component(self, id, type, data=None, **kwargs):
+        if self._delta is None:
+            return super().component(id, type, data, **kwargs)
+        self._delta.add("component", id, (id, type, data), kwargs)
+
+    def relation(self, source, target, type, data=None, **kwargs):
+        if self._delta is None:
+            return super().relation(source, target, type, data, **kwargs)
+        self._delta.add("relation", (source, target, type), (source, target, type, data), kwargs)
+
+    def _get_delta(self, instance):
+        key = instance.instance_url
+        delta = self._deltas.get(key)
+        if not instance.delta_topology:
+            self._deltas.pop(key, None)
+            return None
+        if delta is None or delta.full_interval != instance.full_topology_interval:
+            delta = self._deltas[key] = TopologyDelta(instance.full_topology_interval)
+        return delta
+
+    def _send_delta(self):
+        delta, self._delta = self._delta, None
+        calls, removed = delta.finish()
+        if delta.full:
+            super().start_snapshot()
+        self._send_calls(calls)
+        for component_id in removed:
+            self.delete(component_id)
+        if delta.full:
+            super().stop_snapshot()
+        self.log.debug("Sent %d topology elements and removed %d components." % (len(calls), len(removed)))
+
+    def _send_calls(self, calls):
+        for kind, args, kwargs in calls:
+            getattr(super(), kind)(*args, **kwargs)
+
+    def _get_schedule(self, instance):
+        key = instance.instance_url
+        schedule = self._schedules.get(key)
+        if schedule is not None and schedule.topology_interval != instance.topology_collection_interval:
+            schedule.close()
+            schedule = None
+        if schedule is None and instance.topology_collection_interval:
+            schedule = self._schedules[key] = QuerySchedule(instance.topology_collection_interval)
+        elif schedule is None:
+            self._schedules.pop(key, None)
+        return schedule
+
+    def _send_self_metrics(self, instance, client, duration):
+        tags = ["instance:%s" % instance.instance_url]
+        self.gauge("f5.check.run.duration", duration, tags=tags)
+        for device_client in client.clients:
+            device_tags = tags + ["device:%s" % device_client.device_name]
+            for name, value, metric_tags in device_client.run_stats.metrics(device_tags):
+                self.gauge(name, value, tags=metric_tags)
+
+    def _dump_profile(self, instance, profiler, duration):
+        profile_dir = instance.profile_dir or tempfile.gettempdir()
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", instance.instance_url)
+        path = os.path.join(profile_dir, "f5_%s_%d.prof" % (name, int(time.time())))
+        profiler.dump_stats(path)
+        self.log.warning("Run took %.1f seconds. Profile written to %s" % (duration, path))
 
     def get_health_stream(self, instance):
         return HealthStream(HealthStreamUrn(instance.instance_type, "f5_health"), expiry_seconds=0)
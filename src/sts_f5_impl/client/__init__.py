@@ -1,3 +1,4 @@
 from .f5_client import F5Client
+from .f5_fleet_client import F5FleetClient
 
-__all__ = ["F5Client"]
+__all__ = ["F5Client", "F5FleetClient"]
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Any, Dict, List, MutableMapping, Optional, Tuple, Union
+
+from sts_f5_impl.model.instance import F5Spec
+
+try:
+    import aiohttp
+except ImportError:
+    # Only the Python 3 agent with aiohttp installed can use the async transport, see AsyncTransport.
+    aiohttp = None  # type: ignore
+
+
+class TransportResponse(object):
+    """The parts of a `requests.Response` that F5Client uses, for responses received by the async transport."""
+
+    def __init__(self, url: str, status_code: int, content: bytes, retries: int = 0, seconds: float = 0.0):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.retries = retries
+        # Time taken to receive the response, including the retries.
+        self.seconds = seconds
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+class AsyncTransport(object):
+    """
+    Performs the F5 rest calls with aiohttp on an event loop running in a background thread. The blocking `get` and
+    `get_all` methods are the facade used by F5Client, so the templates keep calling the synchronous client methods.
+    Only available on the Python 3 agent with the `aiohttp` package installed.
+    """
+
+    def __init__(self, spec: F5Spec, headers: MutableMapping[str, str]):
+        if aiohttp is None:
+            raise Exception("The async transport requires the 'aiohttp' package to be installed.")
+        self.spec = spec
+        # The session headers of F5Client, so a renewed auth token is used for the next request.
+        self.headers = headers
+        self._session: Optional[Any] = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="f5-async-transport", daemon=True)
+        self._thread.start()
+
+    def get(self, url: str, params: Optional[Dict[str, Any]]) -> TransportResponse:
+        return self._run(self._get(url, params))
+
+    def get_all(
+        self, requests_to_make: List[Tuple[str, Optional[Dict[str, Any]]]]
+    ) -> List[Union[TransportResponse, Exception]]:
+        return self._run(self._get_all(requests_to_make))
+
+    def close(self):
+        self._run(self._close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def _run(self, coroutine) -> Any:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _get_all(self, requests_to_make):
+        return await asyncio.gather(
+            *[self._get(url, params) for url, params in requests_to_make], return_exceptions=True
+        )
+
+    async def _get(self, url: str, params: Optional[Dict[str, Any]]) -> TransportResponse:
+        session = self._get_session()
+        query = {k: str(v) for k, v in params.items()} if params else None
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            try:
+                async with session.get(url, params=query, headers=dict(self.headers)) as response:
+                    content = await response.read()
+                    if response.status not in self.spec.retry_on_status or attempt >= self.spec.max_request_retries:
+                        seconds = time.perf_counter() - start
+                        return TransportResponse(str(response.url), response.status, content, attempt, seconds)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= self.spec.max_request_retries:
+                    raise
+            attempt += 1
+            # Same exponential backoff as the urllib3 Retry of the requests transport.
+            await asyncio.sleep(self.spec.retry_backoff_seconds * (2 ** (attempt - 1)))
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.spec.max_concurrent_requests, ssl=False)
+            timeout = aiohttp.ClientTimeout(total=self.spec.request_timeout_seconds)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def _close(self):
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,12 @@
+import time
+
+from six import PY3
+
+# The check is transpiled to Python 2.7 for the agent, which lacks the clocks added in Python 3.3. The wall clock is
+# the closest replacement there.
+if PY3:
+    perf_counter = time.perf_counter
+    monotonic = time.monotonic
+else:
+    perf_counter = time.time
+    monotonic = time.time
@@ -1,16 +1,46 @@
-import re
+import bisect
+import hashlib
+import json
+import threading
+import time
 from logging import Logger
-from typing import Any, Dict, List, Optional, Tuple
+from multiprocessing.pool import ThreadPool
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
 
 import pydash.strings
 import requests
 from requests.adapters import HTTPAdapter
 from requests.structures import CaseInsensitiveDict
+from six.moves.urllib.parse import urlencode, urlsplit
 from stackstate_etl.model.factory import TopologyFactory
 from stackstate_etl.model.stackstate import Component
 from urllib3.util import Retry
 
-from sts_f5_impl.model.instance import F5Spec
+from sts_f5_impl.client.compat import perf_counter
+from sts_f5_impl.client.generation_cache import GenerationCache
+from sts_f5_impl.client.irule_parser import get_pools_from_switch_statements
+from sts_f5_impl.client.json_decoder import CollectionStream, get_loads
+from sts_f5_impl.client.partition_filter import PartitionFilter
+from sts_f5_impl.client.run_stats import RunStats
+from sts_f5_impl.client.scope import scoped_name
+from sts_f5_impl.client.stats import (
+    StatsMetricMapping,
+    StatsParser,
+    get_subcollection_name,
+    parse_stats_name,
+)
+from sts_f5_impl.client.template_scanner import CollectionRef, TemplateScanner
+from sts_f5_impl.client.throttle import AdaptiveThrottle
+from sts_f5_impl.model.instance import F5Spec, InstanceInfo
+
+# Collections that are fetched object by object with `fetch_rules_on_demand` instead of prefetched.
+ON_DEMAND_COLLECTIONS = [("ltm", "rule"), ("ltm", "data-group/internal")]
+# Collections looked up by name from any partition, so they are not filtered by partition.
+SHARED_COLLECTIONS = [f"{family}/{object_type}" for family, object_type in ON_DEMAND_COLLECTIONS]
+
+# Configuration synchronised within a sync-failover device group, so it is collected from one unit of the group. Other
+# configuration, like interfaces, vlans, self IPs and the devices themselves, is local to every device.
+SYNCED_CONFIG = ["ltm", "cm/device-group", "cm/traffic-group", "cm/trust-domain"]
 
 CM_OBJECTS = ["cert", "device", "device-group", "key", "traffic-group", "trust-domain"]
 
@@ -84,13 +114,192 @@ NET_OBJECTS = [
 
 
 class F5Client(object):
-    def __init__(self, spec: F5Spec, log: Logger):
+    _instance_clients: Dict[str, "F5Client"] = {}
+
+    def __init__(
+        self,
+        spec: F5Spec,
+        log: Logger,
+        template_refs: Optional[List[str]] = None,
+        partitions: Optional[PartitionFilter] = None,
+    ):
         self.log = log
         self.spec = spec
         self.spec.url = pydash.strings.ensure_ends_with(spec.url, "/")
+        self.template_refs = template_refs
+        # The partitions collected by the instance. All partitions when None.
+        self.partitions = partitions
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        # Shared by the device clients of a fleet to limit the requests in flight across all devices.
+        self._request_slots: Optional[threading.BoundedSemaphore] = None
         self._session = self._init_session(spec)
+        self._throttle = (
+            AdaptiveThrottle(spec.max_concurrent_requests, spec.overload_cooldown_seconds)
+            if spec.adaptive_throttling
+            else None
+        )
+        self._transport = self._init_transport(spec)
+        self._loads = get_loads(spec.json_decoder)
         self._rules: Dict[str, str] = {}
         self._data_groups: Dict[str, Tuple[str, Dict[str, str]]] = {}
+        self._data_group_keys: Dict[str, List[str]] = {}
+        # Name and full path to (full path, generation) of the rules and data groups, see `fetch_rules_on_demand`.
+        self._object_indexes: Dict[str, Dict[str, Tuple[str, Any]]] = {}
+        self._rule_cache = GenerationCache(spec.rule_cache_size)
+        self._data_group_cache = GenerationCache(spec.rule_cache_size)
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._prefetched = False
+        self._selected_fields: Optional[Dict[str, Optional[List[str]]]] = None
+        self._stat_keys: Optional[Dict[str, Optional[Set[str]]]] = None
+        self._stats_parser = StatsParser()
+        self._stats_records: Dict[str, List[Dict[str, Any]]] = {}
+        # Kept across runs, with the previous samples of the counters whose rates are sent.
+        self._metric_mappings: Dict[Tuple[Any, ...], StatsMetricMapping] = {}
+        # Kept across runs to detect unchanged collections, see `incremental_collections`.
+        self._previous_collections: Dict[str, Tuple[Any, Dict[str, Any]]] = {}
+        self._unchanged_collections = 0
+        self._irule_pools: Dict[str, Tuple[str, List[Dict[str, Optional[str]]]]] = {}
+        # Scopes whose rules of the virtual servers were fetched this run, see `fetch_rules_on_demand`.
+        self._rule_scopes: Set[Optional[str]] = set()
+        # Scope of the iRules and data groups looked up without one. The seed device of a fleet.
+        self._default_scope: Optional[str] = None
+        self.run_stats = RunStats()
+        self.instance_config_key: Optional[str] = None
+        # Set on the standby units of a fleet, whose synced configuration is collected from the active unit.
+        self.skip_synced_config = False
+
+    @staticmethod
+    def instance_key(conf: InstanceInfo) -> str:
+        return f"{conf.instance_type}:{conf.instance_url}"
+
+    @staticmethod
+    def config_key(conf: InstanceInfo) -> str:
+        primitive = conf.to_primitive()
+        fleet_keys = ["devices", "discover_devices", "max_concurrent_device_requests", "dedupe_sync_groups"]
+        partition_keys = [
+            "partitions",
+            "exclude_partitions",
+            "partition_shard",
+            "partition_shards",
+            "common_partition_shard",
+        ]
+        config = {k: primitive.get(k) for k in ["f5"] + fleet_keys + partition_keys}
+        for spec in [config["f5"]] + (config["devices"] or []):
+            spec["url"] = pydash.strings.ensure_ends_with(spec["url"], "/")
+        return json.dumps(config, sort_keys=True)
+
+    @classmethod
+    def create(cls, conf: InstanceInfo, log: Logger) -> "F5Client":
+        if conf.devices or conf.discover_devices:
+            from sts_f5_impl.client.f5_fleet_client import F5FleetClient
+
+            return F5FleetClient(conf, log)
+        return cls(conf.f5, log, conf.etl.refs, PartitionFilter.from_instance(conf))
+
+    @classmethod
+    def begin_run(cls, conf: InstanceInfo, log: Logger) -> "F5Client":
+        """
+        Returns the client used by the templates for this check run of the instance. The client, with its session,
+        connection pool and auth token, is kept across runs and only recreated when the F5 device config changes.
+        """
+        key = cls.instance_key(conf)
+        config_key = cls.config_key(conf)
+        client = cls._instance_clients.get(key)
+        if client is not None and client.instance_config_key != config_key:
+            client.close()
+            client = None
+        if client is None:
+            client = cls.create(conf, log)
+            client.instance_config_key = config_key
+            cls._instance_clients[key] = client
+        client.log = log
+        client.template_refs = conf.etl.refs
+        client.start_run()
+        return client
+
+    @classmethod
+    def for_instance(cls, conf: InstanceInfo, log: Logger) -> "F5Client":
+        """
+        Returns the client of the current check run of the instance. Used as the `f5` datasource init.
+        """
+        client = cls._instance_clients.get(cls.instance_key(conf))
+        if client is None:
+            client = cls.begin_run(conf, log)
+        return client
+
+    def start_run(self):
+        """
+        Resets all run scoped state, so that the next run fetches fresh data from the F5.
+        """
+        self._cache = {}
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._unchanged_collections = 0
+        self._prefetched = False
+        self._selected_fields = None
+        self._stat_keys = None
+        self._stats_records = {}
+        self._rules = {}
+        self._rule_scopes = set()
+        self._data_groups = {}
+        self._data_group_keys = {}
+        self._object_indexes = {}
+        self.run_stats = RunStats()
+        self._refresh_token()
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+        self._session.close()
+
+    def end_run(self):
+        self.run_stats.finish()
+        self.log.info(
+            f"F5 response cache: {self._cache_hits} hits, {self._cache_misses} misses, {len(self._cache)} responses, "
+            f"{self._unchanged_collections} unchanged collections."
+        )
+        if self._throttle is not None:
+            self.log.info(
+                f"F5 request throttle: concurrency {int(self._throttle.limit)}, delay {self._throttle.delay:.2f}s"
+                f"{', overloaded' if self._throttle.overloaded else ''}."
+            )
+
+    @property
+    def clients(self) -> List["F5Client"]:
+        """The clients of all devices collected by this client."""
+        return [self]
+
+    @property
+    def device_name(self) -> str:
+        return self.spec.name or urlsplit(self.spec.url).hostname
+
+    @staticmethod
+    def scoped(item: Dict[str, Any], name: str) -> str:
+        """
+        Scopes the name of synced configuration, like pools, nodes and traffic groups, by the device the configuration
+        of its sync group is collected from. Use it for the uids of objects that are shared by the units of a group.
+
+        :param item: Dict[str, Any] Item or stats record the name belongs to
+        :param name: str Name or full path of the object
+        :return: str The name suffixed with the `config_device` of the item in a fleet, otherwise the name itself
+        """
+        return scoped_name(name, item.get("config_device"))
+
+    @staticmethod
+    def device_scoped(item: Dict[str, Any], name: str) -> str:
+        """
+        Scopes the name of an object local to a device, like an interface or vlan, or of a health check, by the device
+        the item was collected from.
+
+        :param item: Dict[str, Any] Item or stats record the name belongs to
+        :param name: str Name or full path of the object
+        :return: str The name suffixed with the `device` of the item in a fleet, otherwise the name itself
+        """
+        return scoped_name(name, item.get("device"))
 
     @staticmethod
     def get_ip_from_destination(destination: str) -> str:
@@ -115,121 +324,524 @@ class F5Client(object):
         return name.replace("~", "/")
 
     def get(self, url, params) -> Dict[str, Any]:
-        result = self._handle_failed_call(self._session.get(url, params=params)).json()
+        if not self._prefetched:
+            self.prefetch()
+        if self._is_skipped(url):
+            self.log.warning(f"Skipping [{self._get_endpoint(url)}], device {self.device_name} is overloaded.")
+            return {"entries": {}} if url.endswith("/stats") else {"items": []}
+        response = self._get_cached(url, params)
+        partitions = self.partitions if self._is_partitioned(url) else None
+        if partitions is not None and "items" in response:
+            response = dict(response, items=partitions.filter_items(response["items"]))
+        return response
+
+    def is_synced_config(self, url: str) -> bool:
+        """
+        :param url: str Collection url
+        :return: bool Whether the collection is configuration shared by the units of a sync-failover device group
+        """
+        endpoint = self._get_endpoint(url)
+        if endpoint.endswith("/stats"):
+            return False
+        return any(endpoint == synced or endpoint.startswith(f"{synced}/") for synced in SYNCED_CONFIG)
+
+    def _is_partitioned(self, url: str) -> bool:
+        return self.partitions is not None and self._get_endpoint(url) not in SHARED_COLLECTIONS
+
+    def _is_skipped(self, url: str) -> bool:
+        if self._throttle is None or not self._throttle.overloaded:
+            return False
+        return self._get_endpoint(url) in self.spec.non_critical_collections
+
+    def _get_cached(self, url, params) -> Dict[str, Any]:
+        key = self._request_key(url, params)
+        if key in self._cache:
+            self._cache_hits += 1
+            return self._cache[key]
+        self._cache_misses += 1
+        result = self._fetch_collection(url, params)
+        self._cache[key] = result
+        return result
+
+    def prefetch(self):
+        """
+        Fetches all collections the templates will query in parallel, so that the template queries are served
+        from memory instead of making one blocking call after the other.
+        """
+        self._prefetched = True
+        if not self.spec.prefetch or not self.template_refs:
+            return
+        refs = TemplateScanner(self.template_refs).collections()
+        if self.spec.fetch_rules_on_demand:
+            refs = [ref for ref in refs if (ref.family, ref.object_type) not in ON_DEMAND_COLLECTIONS]
+        requests_to_make = [self.get_collection_request(ref) for ref in refs]
+        if self.skip_synced_config:
+            requests_to_make = [r for r in requests_to_make if not self.is_synced_config(r[0])]
+        requests_to_make = [r for r in requests_to_make if not self._is_skipped(r[0])]
+        fetched = self._fetch_all(requests_to_make)
+        self.log.debug(f"Prefetched {fetched} of {len(requests_to_make)} F5 collections.")
+
+    def get_stats_batch(self, stats_types: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Fetches the stats of several object types in one go, using parallel calls for those not yet fetched this run.
+
+        :param stats_types: List[str] Object types prefixed with their module, e.g. ['ltm/pool', 'net/interface']
+        :return: Dict[str, List[Dict[str, Any]]] The 'nestedstats' objects per requested object type
+        """
+        requests_by_type = {}
+        for stats_type in stats_types:
+            family, _, object_type = stats_type.partition("/")
+            requests_by_type[stats_type] = self.get_collection_request(CollectionRef(family, object_type, True))
+        self._fetch_all(list(requests_by_type.values()))
+        return {
+            stats_type: self._get_object_stats(params, url) for stats_type, (url, params) in requests_by_type.items()
+        }
+
+    def _fetch_all(self, requests_to_make: List[Tuple[str, Optional[Dict[str, Any]]]]) -> int:
+        """
+        Fetches the requests not yet in the run cache in parallel over the worker pool and caches the responses.
+        Failed requests are left out; the caller requesting the endpoint again reports the failure.
+        """
+        missing = [r for r in requests_to_make if self._request_key(*r) not in self._cache]
+        if len(missing) == 0:
+            return 0
+        # Bulk requests would bypass the adaptive throttle and the request slots shared by the devices of a fleet.
+        if self._transport is not None and self._throttle is None and self._request_slots is None:
+            results = self._fetch_all_async(missing)
+        else:
+            pool = ThreadPool(min(self.spec.max_concurrent_requests, len(missing)))
+            try:
+                results = pool.map(self._prefetch_request, missing)
+            finally:
+                pool.close()
+                pool.join()
+        fetched = 0
+        for (url, params), result in zip(missing, results):
+            if result is not None:
+                self._cache[self._request_key(url, params)] = result
+                fetched += 1
+        return fetched
+
+    def _fetch_all_async(self, requests_to_make: List[Tuple[str, Optional[Dict[str, Any]]]]) -> List[Any]:
+        # Incremental collections are probed first, which is left to the synchronous path.
+        bulk = [r for r in requests_to_make if not self._is_incremental(r[0])]
+        responses = dict(zip([self._request_key(*r) for r in bulk], self._transport.get_all(bulk)))  # type: ignore
+        results = []
+        for url, params in requests_to_make:
+            response = responses.get(self._request_key(url, params))
+            if response is None or isinstance(response, Exception) or response.status_code == 401:
+                results.append(self._prefetch_request((url, params)))
+            else:
+                results.append(self._decode_bulk_response(url, response))
+        return results
+
+    def _decode_bulk_response(self, url: str, response: Any) -> Optional[Dict[str, Any]]:
+        decode_start = perf_counter()
+        try:
+            if not response.ok:
+                self.log.warning(f"Failed to prefetch [{url}]. Status code {response.status_code}. {response.text}")
+                return None
+            return self._loads(response.content)
+        finally:
+            decode_seconds = perf_counter() - decode_start
+            self.run_stats.record_request(
+                self._get_endpoint(url), response.seconds, len(response.content), response.retries, decode_seconds
+            )
+
+    def get_collection_request(self, ref: CollectionRef, select: bool = True) -> Tuple[str, Optional[Dict[str, Any]]]:
+        object_type, _, sub_path = ref.object_type.partition("/")
+        if ref.family == "cm":
+            url = self.get_cm_type_url(object_type)
+        elif ref.family == "net":
+            url = self.get_net_type_url(object_type)
+        else:
+            url = self.get_ltm_type_url(object_type)
+        if sub_path:
+            url = f"{url}/{sub_path}"
+        if ref.stats:
+            return f"{url}/stats", {"expandSubcollections": "true"} if ref.expand_subcollections else None
+        params = {"expandSubcollections": "true"} if ref.expand_subcollections else None
+        return url, self._with_select(url, params, None) if select else params
+
+    def get_selected_fields(self, url: str) -> Optional[List[str]]:
+        """
+        :param url: str Collection url
+        :return: Optional[List[str]] Fields the templates read from the collection when `infer_select` is enabled
+        """
+        if not self.spec.infer_select or not self.template_refs:
+            return None
+        if self._selected_fields is None:
+            selected: Dict[str, Optional[List[str]]] = {}
+            for ref, fields in TemplateScanner(self.template_refs).selected_fields().items():
+                collection_url = self.get_collection_request(ref, False)[0]
+                if fields is None or (collection_url in selected and selected[collection_url] is None):
+                    selected[collection_url] = None
+                else:
+                    selected[collection_url] = sorted(fields.union(selected.get(collection_url) or []))
+            self._selected_fields = selected
+        return self._selected_fields.get(url)
+
+    def get_stat_keys(self, url: str) -> Optional[Set[str]]:
+        """
+        :param url: str Stats collection url
+        :return: Optional[Set[str]] Stat keys the templates read from the collection when `compact_stats` is enabled
+        """
+        if not self.spec.compact_stats or not self.template_refs:
+            return None
+        if self._stat_keys is None:
+            stat_keys: Dict[str, Optional[Set[str]]] = {}
+            for ref, keys in TemplateScanner(self.template_refs).stat_keys().items():
+                stats_url = self.get_collection_request(ref)[0]
+                if keys is None or (stats_url in stat_keys and stat_keys[stats_url] is None):
+                    stat_keys[stats_url] = None
+                else:
+                    stat_keys[stats_url] = keys.union(stat_keys.get(stats_url) or set())
+            self._stat_keys = stat_keys
+        return self._stat_keys.get(url)
+
+    def _with_select(
+        self, url: str, params: Optional[Dict[str, Any]], select: Optional[List[str]]
+    ) -> Optional[Dict[str, Any]]:
+        if select is None:
+            select = self.get_selected_fields(url)
+        params = self._with_partition_filter(url, params)
+        if not select:
+            return params
+        params = dict(params) if params is not None else {}
+        params["$select"] = ",".join(select)
+        return params
+
+    def _with_partition_filter(self, url: str, params: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        # Responses are filtered by partition as well, the filter only saves transferring the other partitions.
+        partitions = self.partitions if self._is_partitioned(url) else None
+        server_filter = partitions.server_filter if partitions is not None else None
+        if server_filter is None:
+            return params
+        params = dict(params) if params is not None else {}
+        params["$filter"] = server_filter
+        return params
+
+    def _prefetch_request(self, request: Tuple[str, Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        url, params = request
+        try:
+            return self._fetch_collection(url, params)
+        except Exception as e:
+            # The template query will call the endpoint again and report the failure.
+            self.log.warning(f"Failed to prefetch [{url}]. {e}")
+            return None
+
+    def _fetch_collection(self, url, params) -> Dict[str, Any]:
+        if not self._is_incremental(url):
+            return self._fetch(url, params)
+        key = self._request_key(url, params)
+        previous = self._previous_collections.get(key)
+        if previous is not None:
+            # Only fetch the object identities and generations to find out whether anything changed.
+            probe = self._fetch(url, self._get_probe_params(params, previous[1]))
+            if self._get_generations(probe) == previous[0]:
+                self._unchanged_collections += 1
+                return previous[1]
+        result = self._fetch(url, params)
+        self._previous_collections[key] = (self._get_generations(result), result)
         return result
 
-    def get_pools_from_switch_statement_irule(self, rule_name: str) -> List[Dict[str, Optional[str]]]:
-        return self._get_pools_from_switch_statement_irule(self.get_rule(rule_name))
+    def _is_incremental(self, url: str) -> bool:
+        collection = url[len(f"{self.spec.url}mgmt/tm/") :]
+        return collection in self.spec.incremental_collections
+
+    @staticmethod
+    def _get_probe_params(params: Optional[Dict[str, Any]], previous: Dict[str, Any]) -> Dict[str, Any]:
+        fields = ["name", "fullPath", "generation"]
+        for item in previous.get("items", [])[:1]:
+            fields = [f for f in ["name", "fullPath", "generation", "lastUpdateMicros"] if f in item]
+            fields.extend(k for k, v in item.items() if k.endswith("Reference") and "items" in v)
+        params = dict(params) if params is not None else {}
+        params["$select"] = ",".join(fields)
+        return params
+
+    @classmethod
+    def _get_generations(cls, collection: Dict[str, Any]) -> List[Any]:
+        generations = []
+        for item in collection.get("items", []):
+            references = [
+                cls._get_generations(v) for k, v in sorted(item.items()) if k.endswith("Reference") and "items" in v
+            ]
+            identity = item.get("fullPath", item.get("name"))
+            generations.append((identity, item.get("generation"), item.get("lastUpdateMicros"), references))
+        return generations
+
+    def _fetch(self, url, params, decode: Optional[Callable[[bytes], Any]] = None) -> Any:
+        if self._request_slots is None:
+            return self._fetch_with_token(url, params, decode or self._loads)
+        with self._request_slots:
+            return self._fetch_with_token(url, params, decode or self._loads)
+
+    def _fetch_with_token(self, url, params, decode: Callable[[bytes], Any]) -> Any:
+        token = self._token
+        start = perf_counter()
+        response = self._send_throttled(url, params)
+        if response.status_code == 401:
+            self.log.info(f"Auth token rejected calling [{url}]. Logging in again.")
+            self._relogin(token)
+            response = self._send_throttled(url, params)
+        decode_start = perf_counter()
+        try:
+            return decode(self._handle_failed_call(response).content)
+        finally:
+            decode_end = perf_counter()
+            retries = self._get_retries(response)
+            latency, decode_seconds = decode_start - start, decode_end - decode_start
+            self.run_stats.record_request(
+                self._get_endpoint(url), latency, len(response.content), retries, decode_seconds
+            )
+
+    def _get_endpoint(self, url: str) -> str:
+        # Object names, like ~Common~my_rule, are left out to report per collection.
+        path = url.split("?", 1)[0][len(f"{self.spec.url}mgmt/tm/") :]
+        return "/".join(part for part in path.split("/") if not part.startswith("~"))
+
+    @staticmethod
+    def _get_retries(response: Any) -> int:
+        retry = getattr(getattr(response, "raw", None), "retries", None)
+        if retry is not None and hasattr(retry, "history"):
+            return len(retry.history)
+        return getattr(response, "retries", 0)
+
+    def _send_throttled(self, url, params) -> requests.Response:
+        if self._throttle is None:
+            return self._send(url, params)
+        with self._throttle.slot():
+            start = perf_counter()
+            failed = True
+            try:
+                response = self._send(url, params)
+                failed = response.status_code in self.spec.retry_on_status or self._get_retries(response) > 0
+                return response
+            finally:
+                self._throttle.record(self._get_endpoint(url), perf_counter() - start, failed)
+
+    def _send(self, url, params) -> requests.Response:
+        if self._transport is not None:
+            return self._transport.get(url, params)
+        return self._session.get(url, params=params, timeout=self.spec.request_timeout_seconds)
+
+    @staticmethod
+    def _request_key(url: str, params: Optional[Dict[str, Any]]) -> str:
+        if not params:
+            return url
+        return f"{url}?{urlencode(sorted(params.items()))}"
+
+    def get_pools_from_switch_statement_irule(
+        self, rule_name: str, scope: Optional[str] = None
+    ) -> List[Dict[str, Optional[str]]]:
+        """
+        Parses the switch statements of a rule once per revision. Many virtual servers share the same rules, so the
+        result is cached across runs by rule name and a hash of the rule source.
+        """
+        irule = self.get_rule(rule_name, scope)
+        digest = hashlib.sha1(irule.encode("utf-8")).hexdigest()
+        key = scoped_name(rule_name, self._resolve_scope(scope))
+        cached = self._irule_pools.get(key)
+        if cached is None or cached[0] != digest:
+            cached = (digest, self._get_pools_from_switch_statement_irule(irule))
+            self._irule_pools[key] = cached
+        return cached[1]
 
     @staticmethod
     def _get_pools_from_switch_statement_irule(irule: str) -> List[Dict[str, Optional[str]]]:
-        # strip out key words
-        if "switch" not in irule:
-            return []
-        lines = []
-        for line in irule.split("\n"):
-            line = line.strip()
-
-            if (
-                line == ""
-                or line.startswith("#")  # noqa: W503
-                or line.startswith("if ")  # noqa: W503
-                or line.startswith("elseif ")  # noqa: W503
-                or line.startswith("switch ")  # noqa: W503
-                or line.startswith("when ")  # noqa: W503
-                or line.startswith("HTTP::uri")  # noqa: W503
-                or line.startswith("[HTTP::uri")  # noqa: W503
-                or line.startswith("HTTP::redirect")  # noqa: W503
-                or line.startswith("persist")  # noqa: W503
-                or line.startswith("set ")  # noqa: W503
-                or line.startswith("set ")  # noqa: W503
-            ):
-                continue
-            lines.append(line)
-
-        one_line_block = re.compile('("/[A-Za-z0-9-*/_?]*".*{)(.*)}')
-        one_line_default_block = re.compile("(default.*{)(.*)}")
-        start_block = re.compile('"(/[A-Za-z0-9-*/_?]*)".*{')
-        default_start_block = re.compile("default.*{")
-        blocks = []
-        still_too_parse_lines = []
-        for line in lines:
-            match = one_line_block.match(line)
-            if match:
-                blocks.append([match.group(1).strip(), match.group(2).strip(), "}"])
-            else:
-                match = one_line_default_block.match(line)
-                if match:
-                    blocks.append([match.group(1).strip(), match.group(2).strip(), "}"])
-                else:
-                    still_too_parse_lines.append(line)
-
-        current_block: List[str] = []
-        first_iteration = True
-        while len(still_too_parse_lines) > 0:
-            line = still_too_parse_lines.pop(0)
-            if start_block.match(line) or default_start_block.match(line):
-                first_iteration = False
-                if current_block:
-                    blocks.append(current_block)
-                    current_block = []
-            else:
-                if first_iteration:
-                    if line == "}":
-                        continue
-                    else:
-                        raise Exception(f"No start block found! Fist line was '{line}'")
-            if line.strip() != "":
-                current_block.append(line)
-        pools: List[Dict[str, Optional[str]]] = []
-        host_line = "HTTP::header replace Host "
-        pool_line = "pool "
-        for block in blocks:
-            uri_pattern = None
-            host = None
-            pool = None
-            for line in block:
-                match = start_block.match(line)
-                if match:
-                    uri_pattern = match.group(1)
-                elif line.startswith(host_line):
-                    host = line[len(host_line) :]
-                elif line.startswith(pool_line):
-                    pool = line[len(pool_line) :]
-            if pool:
-                pools.append({"pool": pool, "host": host, "uri_pattern": uri_pattern})
-        return pools
-
-    def get_rule(self, rule_name: str) -> str:
-        if len(self._rules) == 0:
+        return get_pools_from_switch_statements(irule)
+
+    def get_rule(self, rule_name: str, scope: Optional[str] = None) -> str:
+        return self.get_rules([rule_name], scope)[rule_name]
+
+    def get_rules(self, rule_names: List[str], scope: Optional[str] = None) -> Dict[str, str]:
+        """
+        :param rule_names: List[str] Names or full paths, like '/Common/my_rule' or '~Common~my_rule', of iRules
+        :param scope: Optional[str] In a fleet, the `config_device` of the item referring to the rules. Defaults to
+                      the `f5` device
+        :return: Dict[str, str] The source of the rules found per requested name
+        """
+        scope = self._resolve_scope(scope)
+        if not self.spec.fetch_rules_on_demand and len(self._rules) == 0:
             rules_object: Dict[str, Any] = self.get_ltm_object("rule")
             for item in rules_object["items"]:
-                self._rules[item["name"]] = item["apiAnonymous"]
-        return self._rules[rule_name]
+                self._rules[self.scoped(item, item["name"])] = item["apiAnonymous"]
+        elif self.spec.fetch_rules_on_demand:
+            missing = [name for name in rule_names if scoped_name(name, scope) not in self._rules]
+            client = self._get_scope_client(scope)
+            if missing and scope not in self._rule_scopes:
+                # Fetch the rules of all virtual servers together instead of one by one as the templates ask for them.
+                self._rule_scopes.add(scope)
+                missing.extend(path for path in client._get_virtual_rule_paths() if path not in missing)
+            url = client.get_ltm_type_url("rule")
+            for name, item in client._get_named_objects(url, missing, client._rule_cache).items():
+                self._rules[scoped_name(name, scope)] = item["apiAnonymous"]
+        keys = {name: scoped_name(name, scope) for name in rule_names}
+        return {name: self._rules[key] for name, key in keys.items() if key in self._rules}
 
-    def get_data_group(self, dg_name: str) -> Tuple[str, Dict[str, str]]:
-        if len(self._data_groups) == 0:
-            url = self.get_ltm_type_url("data-group")
-            data_groups_object = self._get_f5_object(f"{url}/internal", False, None)  # type: ignore
-            for item in data_groups_object["items"]:
-                records = {}
-                for r in item.get("records", []):
-                    records[r["name"]] = r["data"]
-                self._data_groups[item["name"]] = (item["partition"], records)
-        if dg_name not in self._data_groups:
+    def get_data_group(self, dg_name: str, scope: Optional[str] = None) -> Tuple[str, Dict[str, str]]:
+        data_groups = self.get_data_groups([dg_name], scope)
+        if dg_name not in data_groups:
             self.log.error(f"Datagroup name {dg_name} not found.")
             empty_dict: Tuple[str, Dict[str, str]] = ("Common", {})
             return empty_dict
-        return self._data_groups[dg_name]
+        return data_groups[dg_name]
+
+    def get_data_groups(
+        self, dg_names: List[str], scope: Optional[str] = None
+    ) -> Dict[str, Tuple[str, Dict[str, str]]]:
+        """
+        :param dg_names: List[str] Names or full paths of internal data groups
+        :param scope: Optional[str] In a fleet, the `config_device` of the item referring to the data groups.
+                      Defaults to the `f5` device
+        :return: Dict[str, Tuple[str, Dict[str, str]]] The partition and records of the data groups found per name
+        """
+        scope = self._resolve_scope(scope)
+        if not self.spec.fetch_rules_on_demand and len(self._data_groups) == 0:
+            url = self.get_ltm_type_url("data-group")
+            data_groups_object = self._get_f5_object(f"{url}/internal", False, None)  # type: ignore
+            for item in data_groups_object["items"]:
+                self._data_groups[self.scoped(item, item["name"])] = self._get_data_group_records(item)
+        elif self.spec.fetch_rules_on_demand:
+            missing = [name for name in dg_names if scoped_name(name, scope) not in self._data_groups]
+            client = self._get_scope_client(scope)
+            url = f"{client.get_ltm_type_url('data-group')}/internal"
+            for name, item in client._get_named_objects(url, missing, client._data_group_cache).items():
+                self._data_groups[scoped_name(name, scope)] = self._get_data_group_records(item)
+        keys = {name: scoped_name(name, scope) for name in dg_names}
+        return {name: self._data_groups[key] for name, key in keys.items() if key in self._data_groups}
+
+    def _resolve_scope(self, scope: Optional[str]) -> Optional[str]:
+        return self._default_scope if scope is None else scope
+
+    def _get_scope_client(self, scope: Optional[str]) -> "F5Client":
+        """
+        :return: F5Client The client of the device whose configuration is in the scope. Overridden by a fleet
+        """
+        return self
+
+    @staticmethod
+    def _get_data_group_records(item: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
+        records = {}
+        for r in item.get("records", []):
+            records[r["name"]] = r["data"]
+        return item["partition"], records
+
+    def _get_named_objects(self, url: str, names: List[str], cache: GenerationCache) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetches the objects of a collection by name or full path in parallel. Objects fetched in an earlier run are
+        reused from the cache when their generation is unchanged.
+        """
+        if not names:
+            return {}
+        index = self._get_object_index(url)
+        found: Dict[str, Dict[str, Any]] = {}
+        requests_by_name: Dict[str, Tuple[str, Tuple[str, Optional[Dict[str, Any]]]]] = {}
+        for name in names:
+            entry = index.get(name.replace("~", "/") if name.startswith("~") else name)
+            if entry is None:
+                continue
+            full_path, generation = entry
+            item = cache.get(full_path, generation)
+            if item is not None:
+                found[name] = item
+            else:
+                requests_by_name[name] = (full_path, (f"{url}/{full_path.replace('/', '~')}", None))
+        self._fetch_all(list({request for _, request in requests_by_name.values()}))
+        for name, (full_path, request) in requests_by_name.items():
+            item = self._cache.get(self._request_key(*request))
+            if item is not None:
+                cache.put(full_path, item.get("generation", index[full_path][1]), item)
+                found[name] = item
+        return found
+
+    def _get_object_index(self, url: str) -> Dict[str, Tuple[str, Any]]:
+        index = self._object_indexes.get(url)
+        if index is None:
+            index = {}
+            for item in self._get_cached(url, {"$select": "name,fullPath,generation"}).get("items", []):
+                entry = (item["fullPath"], item.get("generation"))
+                index[item["name"]] = entry
+                index[item["fullPath"]] = entry
+            self._object_indexes[url] = index
+        return index
+
+    def _get_virtual_rule_paths(self) -> List[str]:
+        url = self.get_ltm_type_url("virtual")
+        paths: List[str] = []
+        for key, response in list(self._cache.items()):
+            if key != url and not key.startswith(f"{url}?"):
+                continue
+            items = response.get("items", [])
+            if self.partitions is not None:
+                items = self.partitions.filter_items(items)
+            for item in items:
+                paths.extend(rule for rule in item.get("rules", []) if rule not in paths)
+        return paths
+
+    def get_data_group_records(self, dg_name: str, prefix: str, scope: Optional[str] = None) -> List[Tuple[str, str]]:
+        """
+        :param dg_name: str Name of the internal data group
+        :param prefix: str Prefix of the record keys to find
+        :param scope: Optional[str] In a fleet, the `config_device` of the item referring to the data group
+        :return: List[Tuple[str, str]] The key and data of the records with a key starting with the prefix, found
+                 using a sorted key index that is built once per run for each data group
+        """
+        records = self.get_data_group(dg_name, scope)[1]
+        key = scoped_name(dg_name, self._resolve_scope(scope))
+        keys = self._data_group_keys.get(key)
+        if keys is None:
+            keys = sorted(records)
+            self._data_group_keys[key] = keys
+        result = []
+        index = bisect.bisect_left(keys, prefix)
+        while index < len(keys) and keys[index].startswith(prefix):
+            result.append((keys[index], records[keys[index]]))
+            index += 1
+        return result
 
     def process_data_group_proxypass_details(
         self, dg_name: str, vs_uid: str, host_name: str, rule: str, vip: str, factory: TopologyFactory
     ):
-        dg_tuple = self.get_data_group(dg_name)
-        partition = dg_tuple[0]
-        records = dg_tuple[1]
-        for key, value in records.items():
-            if key.startswith(host_name):
+        virtual = {"dg_name": dg_name, "vs_uid": vs_uid, "host_name": host_name, "rule": rule, "vip": vip}
+        self.process_data_group_proxypass_batch([virtual], factory)
+
+    def process_data_group_proxypass_batch(self, virtuals: List[Dict[str, str]], factory: TopologyFactory):
+        """
+        Relates the virtual servers to the pools and serverside hosts found in their ProxyPass data group in a single
+        pass. Components and relations already handled in the pass are remembered, so they are only checked once.
+
+        :param virtuals: List[Dict[str, str]] The 'dg_name', 'vs_uid', 'host_name', 'rule' and 'vip' of each virtual,
+                         and in a fleet its 'scope', the `config_device` of the virtual server
+        :param factory: TopologyFactory
+        """
+        for scope in {virtual.get("scope") for virtual in virtuals}:
+            dg_names = {virtual["dg_name"] for virtual in virtuals if virtual.get("scope") == scope}
+            self.get_data_groups(sorted(dg_names), scope)
+        components: Set[str] = set()
+        relations: Set[Tuple[str, str]] = set()
+        labels: Set[Tuple[str, str]] = set()
+
+        def component_exists(uid: str) -> bool:
+            if uid in components:
+                return True
+            if factory.component_exists(uid):
+                components.add(uid)
+                return True
+            return False
+
+        def ensure_relation(source_uid: str, target_uid: str):
+            if (source_uid, target_uid) not in relations:
+                relations.add((source_uid, target_uid))
+                if not factory.relation_exists(source_uid, target_uid):
+                    factory.add_relation(source_uid, target_uid)
+
+        for virtual in virtuals:
+            dg_name, vs_uid, host_name = virtual["dg_name"], virtual["vs_uid"], virtual["host_name"]
+            rule, vip = virtual["rule"], virtual["vip"]
+            scope = self._resolve_scope(virtual.get("scope"))
+            partition = self.get_data_group(dg_name, scope)[0]
+            for key, value in self.get_data_group_records(dg_name, host_name, scope):
                 value_parts = value.split(" ")
                 if len(value_parts) != 2:
                     self.log.error(
@@ -239,11 +851,10 @@ class F5Client(object):
                 pool_name = value_parts[1]
                 if not pool_name.startswith("/Common/"):
                     pool_name = pydash.strings.ensure_starts_with(pool_name, "/%s/" % partition)
-                pool_name.replace("//", "/")
-                pool_uid = "urn:f5:pool:/%s" % pool_name
+                pool_uid = "urn:f5:pool:/%s" % scoped_name(pool_name, scope)
                 serverside_name = value_parts[0].split("/")[0]
                 serverside_uid = factory.get_uid("host", "virtual:server", serverside_name)
-                if not factory.component_exists(serverside_uid):
+                if not component_exists(serverside_uid):
                     serverside_component = Component()
                     serverside_component.uid = serverside_uid
                     serverside_component.properties.add_identifier(serverside_uid)
@@ -252,35 +863,96 @@ class F5Client(object):
                     serverside_component.properties.layer = "Virtual Servers"
                     serverside_component.properties.domain = "F5"
                     factory.add_component(serverside_component)
+                    components.add(serverside_uid)
 
-                if not factory.component_exists(pool_uid):
+                if not component_exists(pool_uid):
                     self.log.error(
                         "Expected to find pool %s in rule %s for host %s for vip %s. Ignoring..."
                         % (pool_uid, rule, host_name, vip)
                     )
-                else:
-                    pool_component = factory.get_component(pool_uid)
-                    pool_component.properties.add_label_kv("rule", rule)
-                    # pool_component.properties.add_label_kv("clientside", key)
-                    # pool_component.properties.add_label_kv("serverside", value_parts[0])
-                    if not factory.relation_exists(pool_uid, serverside_uid):
-                        factory.add_relation(pool_uid, serverside_uid)
-
-                    if not factory.component_exists(vs_uid):
-                        self.log.error(
-                            "Expected to find virtual server %s in rule %s for host %s for vip %s. Ignoring..."
-                            % (vs_uid, rule, host_name, vip)
-                        )
-                        return
-                    vs_component = factory.get_component(vs_uid)
-                    if not factory.relation_exists(vs_component.uid, pool_component.uid):
-                        factory.add_relation(vs_component.uid, pool_uid)
+                    continue
+                if (pool_uid, rule) not in labels:
+                    labels.add((pool_uid, rule))
+                    factory.get_component(pool_uid).properties.add_label_kv("rule", rule)
+                ensure_relation(pool_uid, serverside_uid)
+
+                if not component_exists(vs_uid):
+                    self.log.error(
+                        "Expected to find virtual server %s in rule %s for host %s for vip %s. Ignoring..."
+                        % (vs_uid, rule, host_name, vip)
+                    )
+                    break
+                ensure_relation(vs_uid, pool_uid)
+
+    def add_stats_metrics(
+        self,
+        factory: TopologyFactory,
+        stats: List[Dict[str, Any]],
+        target_uid: str,
+        metrics: Dict[str, str],
+        rates: Optional[Dict[str, str]] = None,
+        deltas: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """
+        Sends stat values of all records of a stats collection as metrics in one pass, instead of evaluating a metric
+        template for every record.
+
+        :param factory: TopologyFactory
+        :param stats: List[Dict[str, Any]] Records returned by one of the get_*_object_stats calls
+        :param target_uid: str Format of the uid the metrics are sent to, like 'urn:f5:pool:/{tmName}{scope}', filled
+                           in with the name, partition and device of a record or the value of one of its stats.
+                           `{scope}` and `{device_scope}` add the device like `scoped` and `device_scoped` do
+        :param metrics: Dict[str, str] Metric name per stat key, like {'memberCnt': 'f5.pool.memberCnt'}
+        :param rates: Optional[Dict[str, str]] Metric name of the per second rate per cumulative counter, like
+                      {'serverside.bitsIn': 'f5.pool.serverside.bitsIn.rate'}. Sent from the second run on
+        :param deltas: Optional[Dict[str, str]] Metric name of the increase since the previous run per counter
+        :return: int Number of metric values sent
+        """
+        key = (target_uid,) + tuple(tuple(sorted((m or {}).items())) for m in (metrics, rates, deltas))
+        mapping = self._metric_mappings.get(key)
+        if mapping is None:
+            mapping = self._metric_mappings[key] = StatsMetricMapping(target_uid, metrics, rates, deltas)
+        metric_values = mapping.apply(stats)
+        for name, value, uid in metric_values:
+            factory.add_metric_value(name, value, target_uid=uid)
+        return len(metric_values)
 
     def get_ltm_object(
-        self, object_type: str, expand_subcollections: bool = False, params: Dict[str, Any] = None
+        self,
+        object_type: str,
+        expand_subcollections: bool = False,
+        params: Dict[str, Any] = None,
+        select: Optional[List[str]] = None,
     ) -> Dict[str, Any]:
+        """
+        :param object_type: str Any object in the LTM_OBJECTS list
+        :param expand_subcollections: bool Expand subcollections like pool members
+        :param params: Dict[str, Any] Additional query paramaters
+        :param select: List[str] Fields to return, mapped to `$select`. Inferred from the templates when
+                       `infer_select` is enabled
+        :return: Dict[str, Any] Returns the collection
+        """
+        url = self.get_ltm_type_url(object_type)
+        return self._get_f5_object(url, expand_subcollections, params, select)
+
+    def iter_ltm_object(
+        self,
+        object_type: str,
+        expand_subcollections: bool = False,
+        params: Dict[str, Any] = None,
+        page_size: Optional[int] = None,
+        select: Optional[List[str]] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        :param object_type: str Any object in the LTM_OBJECTS list
+        :param expand_subcollections: bool Expand subcollections like pool members
+        :param params: Dict[str, Any] Additional query paramaters
+        :param page_size: int Items per page. Defaults to the `page_size` of the f5 spec
+        :param select: List[str] Fields to return, mapped to `$select`
+        :return: Iterator[Dict[str, Any]] Yields the items of the collection one page at a time
+        """
         url = self.get_ltm_type_url(object_type)
-        return self._get_f5_object(url, expand_subcollections, params)
+        return self._iter_f5_object(url, expand_subcollections, params, page_size, select)
 
     def get_ltm_object_stats(self, object_type: str, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """
@@ -289,13 +961,50 @@ class F5Client(object):
         :return: List[Dict[str, Any]] Returns the 'nestedstats' object with object name and partition
         """
         url = f"{self.get_ltm_type_url(object_type)}/stats"
-        return self._get_object_stats(params, url)
+        return self._query_object_stats(url, params)
+
+    def get_ltm_pool_member_stats(self, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """
+        Fetches the stats of the members of all pools with one pool stats call that expands the members subcollection,
+        instead of a members/stats call per pool.
+
+        :param params: Dict[str, Any] Additional query paramaters
+        :return: List[Dict[str, Any]] Returns the 'nestedstats' object of every pool member with member name, like
+                 '10.0.0.1:80', partition and the full path of its `pool`
+        """
+        url = f"{self.get_ltm_type_url('pool')}/stats"
+        params = dict(params or {}, expandSubcollections="true")
+        result = []
+        with self.run_stats.query("ltm/pool/members/stats"):
+            for pool in self._get_object_stats(params, url):
+                for member in pool.get("members", []):
+                    member["pool"] = f"/{pool['partition']}/{pool['name']}" if "partition" in pool else pool["name"]
+                    for key in ["device", "config_device"]:
+                        if key in pool:
+                            member[key] = pool[key]
+                    result.append(member)
+        return result
 
     def get_net_object(
-        self, object_type: str, expand_subcollections: bool = False, params: Dict[str, Any] = None
+        self,
+        object_type: str,
+        expand_subcollections: bool = False,
+        params: Dict[str, Any] = None,
+        select: Optional[List[str]] = None,
     ) -> Dict[str, Any]:
         url = self.get_net_type_url(object_type)
-        return self._get_f5_object(url, expand_subcollections, params)
+        return self._get_f5_object(url, expand_subcollections, params, select)
+
+    def iter_net_object(
+        self,
+        object_type: str,
+        expand_subcollections: bool = False,
+        params: Dict[str, Any] = None,
+        page_size: Optional[int] = None,
+        select: Optional[List[str]] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        url = self.get_net_type_url(object_type)
+        return self._iter_f5_object(url, expand_subcollections, params, page_size, select)
 
     def get_net_object_stats(self, object_type: str, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """
@@ -304,13 +1013,28 @@ class F5Client(object):
         :return: List[Dict[str, Any]] Returns the 'nestedstats' object with object name and partition
         """
         url = f"{self.get_net_type_url(object_type)}/stats"
-        return self._get_object_stats(params, url)
+        return self._query_object_stats(url, params)
 
     def get_cm_object(
-        self, object_type: str, expand_subcollections: bool = False, params: Dict[str, Any] = None
+        self,
+        object_type: str,
+        expand_subcollections: bool = False,
+        params: Dict[str, Any] = None,
+        select: Optional[List[str]] = None,
     ) -> Dict[str, Any]:
         url = self.get_cm_type_url(object_type)
-        return self._get_f5_object(url, expand_subcollections, params)
+        return self._get_f5_object(url, expand_subcollections, params, select)
+
+    def iter_cm_object(
+        self,
+        object_type: str,
+        expand_subcollections: bool = False,
+        params: Dict[str, Any] = None,
+        page_size: Optional[int] = None,
+        select: Optional[List[str]] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        url = self.get_cm_type_url(object_type)
+        return self._iter_f5_object(url, expand_subcollections, params, page_size, select)
 
     def get_cm_object_stats(self, object_type: str, params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """
@@ -319,7 +1043,7 @@ class F5Client(object):
         :return: List[Dict[str, Any]] Returns the 'nestedstats' object with object name and partition
         """
         url = f"{self.get_cm_type_url(object_type)}/stats"
-        return self._get_object_stats(params, url)
+        return self._query_object_stats(url, params)
 
     def get_cm_type_url(self, object_type: str) -> str:
         if object_type not in CM_OBJECTS:
@@ -336,24 +1060,87 @@ class F5Client(object):
             raise Exception(f'Object type "{object_type}" is unknown.  Valid types are {NET_OBJECTS}')
         return f"{self.spec.url}mgmt/tm/net/{object_type}"
 
-    def _get_f5_object(self, url, expand_subcollections, params) -> Dict[str, Any]:
+    def _get_f5_object(self, url, expand_subcollections, params, select=None) -> Dict[str, Any]:
         if expand_subcollections:
             params = params if params is not None else {}
             params["expandSubcollections"] = "true"
-        return self.get(url, params)
+        query = (
+            f"{self._get_endpoint(url)}?expandSubcollections=true" if expand_subcollections else self._get_endpoint(url)
+        )
+        with self.run_stats.query(query):
+            return self.get(url, self._with_select(url, params, select))
+
+    def _iter_f5_object(self, url, expand_subcollections, params, page_size, select) -> Iterator[Dict[str, Any]]:
+        # Pages are streamed and not kept in the run cache, so memory is bounded by the page size.
+        if self._is_skipped(url):
+            self.log.warning(f"Skipping [{self._get_endpoint(url)}], device {self.device_name} is overloaded.")
+            return
+        params = dict(self._with_select(url, params, select) or {})
+        if expand_subcollections:
+            params["expandSubcollections"] = "true"
+        params["$top"] = page_size or self.spec.page_size
+        params.setdefault("$skip", 0)
+        partitions = self.partitions if self._is_partitioned(url) else None
+        while url:
+            if self._loads is json.loads:
+                # Without a faster decoder the items of a page are decoded one at a time as they are consumed.
+                stream = self._fetch(url, params, CollectionStream)
+                items, fields = iter(stream), stream.fields
+            else:
+                page = self._fetch(url, params)
+                items, fields = iter(page.get("items", [])), page
+            count = 0
+            for item in items:
+                count += 1
+                if partitions is not None and not partitions.includes(item.get("partition")):
+                    continue
+                yield item
+            next_link = fields.get("nextLink")
+            if not next_link or count == 0:
+                break
+            url, params = self._get_local_link(next_link), None
+
+    def _get_local_link(self, link: str) -> str:
+        # Links returned by the F5 refer to https://localhost/...
+        parts = urlsplit(link)
+        url = f"{self.spec.url}{parts.path.lstrip('/')}"
+        return f"{url}?{parts.query}" if parts.query else url
+
+    def _query_object_stats(self, url, params) -> List[Dict[str, Any]]:
+        with self.run_stats.query(self._get_endpoint(url)):
+            return self._get_object_stats(params, url)
 
     def _get_object_stats(self, params, url) -> List[Dict[str, Any]]:
-        response = self.get(url, params)
+        return self._get_stats_records(url, params, lambda: self.get(url, params))
+
+    def _get_stats_records(self, url, params, fetch: Callable[[], Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not self.spec.compact_stats:
+            return self._filter_stats(self._parse_object_stats(fetch()))
+        key = self._request_key(url, params)
+        records = self._stats_records.get(key)
+        if records is None:
+            records = self._filter_stats(self._stats_parser.parse(fetch(), self.get_stat_keys(url)))
+            self._stats_records[key] = records
+            # The records replace the response for the rest of the run.
+            self._cache.pop(key, None)
+        return records
+
+    def _filter_stats(self, records: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Expanded subcollections, like pool members, belong to the partition of their parent object.
+        return list(records) if self.partitions is None else self.partitions.filter_items(records)
+
+    @classmethod
+    def _parse_object_stats(cls, response: Dict[str, Any]) -> List[Dict[str, Any]]:
         result = []
         for key, stats in response["entries"].items():
             nested_stats = stats["nestedStats"]
-            # https://localhost/mgmt/tm/cm/traffic-group/~Common~traffic-group-1:~Common~bigip1.local.net/stats
-            name = key.split("/")[-2]
-            if name.startswith("~"):
-                parts = name[1:].split("~")
-                nested_stats["partition"] = parts[0]
-                name = parts[1].split(":")[0]
+            partition, name = parse_stats_name(key)
+            if partition is not None:
+                nested_stats["partition"] = partition
             nested_stats["name"] = name
+            for entry_key, entry in nested_stats["entries"].items():
+                if "nestedStats" in entry:
+                    nested_stats[get_subcollection_name(entry_key)] = cls._parse_object_stats(entry["nestedStats"])
             result.append(nested_stats)
         return result
 
@@ -372,15 +1159,53 @@ class F5Client(object):
                 "cache-control": "no-cache",
             }
         )
-        session.mount(spec.url, HTTPAdapter(max_retries=retry))
+        pool_size = max(spec.max_concurrent_requests, 10)
+        session.mount(spec.url, HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size))
         self._setup_session_token(session, spec)
         return session
 
+    def _init_transport(self, spec: F5Spec) -> Optional[Any]:
+        if spec.transport != "async":
+            return None
+        # Imported on demand, the async transport is only available on the Python 3 agent.
+        from sts_f5_impl.client.async_transport import AsyncTransport
+
+        return AsyncTransport(spec, self._session.headers)
+
     def _setup_session_token(self, session: requests.Session, spec: F5Spec):
         url = f"{spec.url}mgmt/shared/authn/login"
         body = {"username": spec.username, "password": spec.password, "loginProviderName": "tmos"}
         result = self._handle_failed_call(session.post(url, json=body)).json()
-        session.headers["X-F5-Auth-Token"] = result["token"]["token"]
+        self._set_token(session, result["token"])
+
+    def _set_token(self, session: requests.Session, token: Dict[str, Any]):
+        self._token = value = token["token"]
+        if "expirationMicros" in token:
+            # BIG-IP counts the timeout from the start time of the token, the expiry it reports is the real one.
+            self._token_expires_at = token["expirationMicros"] / 1e6
+        else:
+            self._token_expires_at = time.time() + int(token.get("timeout", 1200))
+        session.headers["X-F5-Auth-Token"] = value
+
+    def _relogin(self, stale_token: Optional[str]):
+        with self._token_lock:
+            # Another thread could already have logged in again after the same 401.
+            if self._token == stale_token:
+                self._setup_session_token(self._session, self.spec)
+
+    def _refresh_token(self):
+        """
+        Extends the lifetime of the auth token when it is about to expire, logging in again when that fails.
+        """
+        if self._token_expires_at - time.time() > self.spec.token_refresh_seconds:
+            return
+        url = f"{self.spec.url}mgmt/shared/authz/tokens/{self._token}"
+        try:
+            response = self._session.patch(url, json={"timeout": self.spec.token_timeout_seconds})
+            self._set_token(self._session, self._handle_failed_call(response).json())
+        except Exception as e:
+            self.log.info(f"Failed to extend auth token. Logging in again. {e}")
+            self._relogin(self._token)
 
     @staticmethod
     def _handle_failed_call(response: requests.Response) -> requests.Response:
@@ -0,0 +1,213 @@
+import threading
+from logging import Logger
+from multiprocessing.pool import ThreadPool
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from six.moves.urllib.parse import urlsplit
+
+from sts_f5_impl.client.f5_client import F5Client
+from sts_f5_impl.client.partition_filter import PartitionFilter
+from sts_f5_impl.model.instance import F5Spec, InstanceInfo
+
+
+class F5FleetClient(F5Client):
+    """
+    Collects the same collections from the `f5` device and all other `devices` of an instance concurrently.
+    The results are merged as if they came from one device, with every item and stats entry tagged with the
+    name of its `device` and of its `config_device`, the unit the configuration of its sync group is collected
+    from, so templates can scope components per device with `scoped` and `device_scoped`.
+    """
+
+    def __init__(self, conf: InstanceInfo, log: Logger):
+        partitions = PartitionFilter.from_instance(conf)
+        super().__init__(conf.f5, log, conf.etl.refs, partitions)
+        self._request_slots = threading.BoundedSemaphore(conf.max_concurrent_device_requests)
+        self._max_concurrent_devices = conf.max_concurrent_device_requests
+        self._dedupe_sync_groups = conf.dedupe_sync_groups
+        self._config_clients: List[F5Client] = []
+        # Name of the device the synced configuration is collected from per device name.
+        self._config_devices: Dict[str, str] = {}
+        device_specs = list(conf.devices)
+        if conf.discover_devices:
+            device_specs.extend(self._discover_device_specs(device_specs))
+        self.devices: List[F5Client] = self._map(
+            lambda spec: F5Client(spec, log, conf.etl.refs, partitions), device_specs
+        )
+        for device in self.devices:
+            device._request_slots = self._request_slots
+
+    @property
+    def clients(self) -> List[F5Client]:
+        clients: List[F5Client] = [self]
+        return clients + self.devices
+
+    def start_run(self):
+        super().start_run()
+        for device in self.devices:
+            device.log = self.log
+            device.template_refs = self.template_refs
+        self._map(lambda device: device.start_run(), self.devices)
+
+    def end_run(self):
+        for client in self.clients:
+            self.log.info(f"Device {client.device_name}:")
+            F5Client.end_run(client)
+
+    def close(self):
+        for client in self.clients:
+            F5Client.close(client)
+
+    def prefetch(self):
+        self._prefetched = True
+        self._config_devices = {client.device_name: client.device_name for client in self.clients}
+        self._config_clients = self._get_config_clients() if self._dedupe_sync_groups else self.clients
+        self._default_scope = self._config_devices[self.device_name]
+        for client in self.clients:
+            client.skip_synced_config = client not in self._config_clients
+        self._map(lambda client: F5Client.prefetch(client), self.clients)
+
+    def get(self, url, params) -> Dict[str, Any]:
+        if not self._prefetched:
+            self.prefetch()
+        clients = self._get_clients(url)
+        responses = self._map(lambda client: self._get_from(client, url, params), clients)
+        merged = dict(responses[0])
+        merged["items"] = []
+        for client, response in zip(clients, responses):
+            for item in response.get("items", []):
+                merged["items"].append(self._tag(item, client))
+        return merged
+
+    def _get_object_stats(self, params, url) -> List[Dict[str, Any]]:
+        if not self._prefetched:
+            self.prefetch()
+
+        def get_device_stats(client: F5Client) -> List[Dict[str, Any]]:
+            device_url = self._get_device_url(client, url)
+            return client._get_stats_records(device_url, params, lambda: self._get_from(client, url, params))
+
+        result = []
+        for client, device_stats in zip(self.clients, self._map(get_device_stats, self.clients)):
+            for nested_stats in device_stats:
+                result.append(self._tag(nested_stats, client))
+        return result
+
+    def _iter_f5_object(self, url, expand_subcollections, params, page_size, select) -> Iterator[Dict[str, Any]]:
+        if not self._prefetched:
+            self.prefetch()
+        for client in self._get_clients(url):
+            device_url = self._get_device_url(client, url)
+            items = F5Client._iter_f5_object(client, device_url, expand_subcollections, params, page_size, select)
+            for item in items:
+                yield self._tag(item, client)
+
+    def _tag(self, item: Dict[str, Any], client: F5Client) -> Dict[str, Any]:
+        item["device"] = client.device_name
+        item["config_device"] = self._config_devices[client.device_name]
+        return item
+
+    def _resolve_scope(self, scope: Optional[str]) -> Optional[str]:
+        if not self._prefetched:
+            self.prefetch()
+        return super()._resolve_scope(scope)
+
+    def _get_scope_client(self, scope: Optional[str]) -> F5Client:
+        return next((client for client in self.clients if client.device_name == scope), self)
+
+    def _get_clients(self, url: str) -> List[F5Client]:
+        # Synced configuration is shared within a sync group, so it is only collected from one unit of every group.
+        return self._config_clients if self.is_synced_config(url) else self.clients
+
+    def _get_from(self, client: F5Client, url: str, params) -> Dict[str, Any]:
+        # Bypass the fleet override of `get` for the seed device itself.
+        return F5Client.get(client, self._get_device_url(client, url), params)
+
+    def _get_device_url(self, client: F5Client, url: str) -> str:
+        return f"{client.spec.url}{url[len(self.spec.url):]}"
+
+    def _get_config_clients(self) -> List[F5Client]:
+        """
+        Selects one unit, preferably an active one, of every sync-failover device group, plus all devices that are
+        not part of a sync-failover group.
+        """
+        roles = self._map(self._get_sync_role, self.clients)
+        # Active units first, so they are selected above their standby peers.
+        ordered = sorted(zip(self.clients, roles), key=lambda client_role: not client_role[1][1])
+        selected = []
+        # Name of the selected unit per sync group.
+        covered_groups: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+        for client, (sync_groups, _) in ordered:
+            if sync_groups and all(group in covered_groups for group in sync_groups):
+                self._config_devices[client.device_name] = covered_groups[sync_groups[0]]
+                continue
+            selected.append(client)
+            for group in sync_groups:
+                covered_groups.setdefault(group, client.device_name)
+        config_clients = [client for client in self.clients if client in selected]
+        standby = [client.device_name for client in self.clients if client not in selected]
+        if standby:
+            self.log.debug(f"Only collecting stats from sync group peers {standby}.")
+        return config_clients
+
+    def _get_sync_role(self, client: F5Client) -> Tuple[List[Tuple[str, Tuple[str, ...]]], bool]:
+        """
+        :return: The sync-failover groups the device is a member of and whether it is active for a traffic group
+        """
+        try:
+            return self._read_sync_role(client)
+        except Exception as e:
+            # Collecting the configuration of the device as well is the safe fallback.
+            self.log.warning(f"Failed to determine sync group of device {client.device_name}. {e}")
+            return [], False
+
+    @staticmethod
+    def _read_sync_role(client: F5Client) -> Tuple[List[Tuple[str, Tuple[str, ...]]], bool]:
+        devices = client._get_cached(client.get_cm_type_url("device"), None)
+        names = [d["name"] for d in devices.get("items", []) if d.get("selfDevice") == "true"]
+        if not names:
+            return [], False
+        device_name = names[0]
+        url = client.get_cm_type_url("device-group")
+        device_groups = client._get_cached(url, {"expandSubcollections": "true"})
+        sync_groups = []
+        for group in device_groups.get("items", []):
+            members = tuple(sorted(d["name"] for d in group.get("devicesReference", {}).get("items", [])))
+            if group.get("type") == "sync-failover" and device_name in members:
+                sync_groups.append((group["name"], members))
+        stats = client._parse_object_stats(client._get_cached(f"{client.get_cm_type_url('traffic-group')}/stats", None))
+        active = any(
+            s["entries"]["deviceName"]["description"].rsplit("/", 1)[-1] == device_name
+            and s["entries"]["failoverState"]["description"] == "active"  # noqa: W503
+            for s in stats
+        )
+        return sync_groups, active
+
+    def _discover_device_specs(self, configured: List[F5Spec]) -> List[F5Spec]:
+        # Configured devices are known by their name and the host of their url, a hostname or management address.
+        known: Set[str] = set()
+        for spec in [self.spec] + configured:
+            known.update(name.lower() for name in [spec.name, urlsplit(spec.url).hostname] if name)
+        discovered = []
+        for device in self._fetch(self.get_cm_type_url("device"), None).get("items", []):
+            if device.get("selfDevice") == "true" or "managementIp" not in device:
+                continue
+            address = device["managementIp"]
+            names = {name.lower() for name in [device.get("name"), device.get("hostname"), address] if name}
+            if names & known:
+                continue
+            primitive = self.spec.to_primitive()
+            primitive["name"] = device["name"]
+            primitive["url"] = f"https://[{address}]/" if ":" in address else f"https://{address}/"
+            discovered.append(F5Spec(primitive))
+        self.log.info(f"Discovered devices {[spec.name for spec in discovered]} from {self.device_name}.")
+        return discovered
+
+    def _map(self, fn: Callable[[Any], Any], values: List[Any]) -> List[Any]:
+        if len(values) <= 1:
+            return [fn(v) for v in values]
+        pool = ThreadPool(min(self._max_concurrent_devices, len(values)))
+        try:
+            return pool.map(fn, values)
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,30 @@
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+
+class GenerationCache(object):
+    """
+    Keeps the most recently used F5 objects by full path across runs. A cached object is only returned while its
+    `generation` on the device is unchanged, so a modified object is fetched again.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[Any, Any]]" = OrderedDict()
+
+    def get(self, full_path: str, generation: Any) -> Optional[Any]:
+        entry = self._entries.get(full_path)
+        if entry is None or entry[0] != generation:
+            return None
+        # Moved to the end by inserting it again, OrderedDict.move_to_end is not available on Python 2.7.
+        self._entries[full_path] = self._entries.pop(full_path)
+        return entry[1]
+
+    def put(self, full_path: str, generation: Any, value: Any):
+        self._entries.pop(full_path, None)
+        self._entries[full_path] = (generation, value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,199 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Whitespace separating words, including backslash-newline line continuations.
+WORD_SEPARATOR = re.compile(r"(?:[ \t\r\f]|\\\n)+")
+# Characters ending a bare word, or that need matching within one.
+BARE_WORD_SPECIAL = re.compile(r"[ \t\r\f\n;\[\\]")
+LIST_SEPARATOR = re.compile(r"\s+")
+COMMENT_END = re.compile(r"(?<!\\)\n")
+
+Command = List[str]
+
+
+def get_pools_from_switch_statements(irule: str) -> List[Dict[str, Optional[str]]]:
+    """
+    Finds the pools selected per case of the `switch` statements in an iRule, together with the case pattern and
+    the value of a `HTTP::header replace Host` in the same case.
+
+    :param irule: str Tcl source of the iRule
+    :return: List[Dict[str, Optional[str]]] Dicts with the 'pool', 'host' and 'uri_pattern' (None for default)
+    """
+    if "switch" not in irule:
+        return []
+    pools: List[Dict[str, Optional[str]]] = []
+    _collect_switch_pools(split_commands(irule), pools)
+    return pools
+
+
+def split_commands(script: str) -> List[Command]:
+    """
+    Splits a Tcl script into commands of words. Braces, quotes and brackets are kept together as one word, with the
+    outer braces or quotes removed. Comments are skipped.
+    """
+    commands: List[Command] = []
+    words: Command = []
+    pos, end = 0, len(script)
+    while pos < end:
+        match = WORD_SEPARATOR.match(script, pos)
+        if match:
+            pos = match.end()
+            continue
+        char = script[pos]
+        if char == "\n" or char == ";":
+            if words:
+                commands.append(words)
+                words = []
+            pos += 1
+        elif char == "#" and not words:
+            comment_end = COMMENT_END.search(script, pos)
+            pos = comment_end.end() if comment_end else end
+        else:
+            word, pos = _read_word(script, pos)
+            words.append(word)
+    if words:
+        commands.append(words)
+    return commands
+
+
+def split_words(text: str) -> List[str]:
+    """Splits a Tcl list, like the body of a `switch`, into its words ignoring line breaks."""
+    words: List[str] = []
+    pos, end = 0, len(text)
+    while pos < end:
+        match = LIST_SEPARATOR.match(text, pos)
+        if match:
+            pos = match.end()
+            continue
+        word, pos = _read_word(text, pos)
+        words.append(word)
+    return words
+
+
+def _read_word(script: str, pos: int) -> Tuple[str, int]:
+    char = script[pos]
+    if char == "{":
+        close = _find_close(script, pos, "{", "}")
+        return script[pos + 1 : close], close + 1
+    if char == '"':
+        close = pos + 1
+        while close < len(script) and script[close] != '"':
+            close += 2 if script[close] == "\\" else 1
+        return script[pos + 1 : close], close + 1
+    start = pos
+    while pos < len(script):
+        match = BARE_WORD_SPECIAL.search(script, pos)
+        if match is None:
+            pos = len(script)
+        elif match.group() == "[":
+            pos = _find_close(script, match.start(), "[", "]") + 1
+            continue
+        elif match.group() == "\\":
+            pos = match.start() + 2
+            continue
+        else:
+            pos = match.start()
+        break
+    if pos == start:
+        # A separator that does not end a word in this context, like ';' in a list.
+        pos += 1
+    return script[start:pos], pos
+
+
+def _find_close(script: str, pos: int, open_char: str, close_char: str) -> int:
+    """Returns the index of the bracket closing the one at pos, or the end of the script when unbalanced."""
+    depth = 0
+    index = pos
+    while index < len(script):
+        char = script[index]
+        if char == "\\":
+            index += 2
+            continue
+        if char == open_char:
+            depth += 1
+        elif char == close_char:
+            depth -= 1
+            if depth == 0:
+                return index
+        index += 1
+    return len(script)
+
+
+def _collect_switch_pools(commands: List[Command], pools: List[Dict[str, Optional[str]]]):
+    for command in commands:
+        if command[0] == "switch":
+            for pattern, body in _get_switch_cases(command[1:]):
+                uri_pattern = None if pattern == "default" else pattern
+                host, case_pools = _get_case_pools(split_commands(body))
+                for pool in case_pools:
+                    pools.append({"pool": pool, "host": host, "uri_pattern": uri_pattern})
+        else:
+            for body in _get_nested_bodies(command):
+                _collect_switch_pools(split_commands(body), pools)
+
+
+def _get_switch_cases(args: List[str]) -> List[Tuple[str, str]]:
+    # switch ?options? string {pattern body ?pattern body ...?} or switch ?options? string pattern body ...
+    while args and args[0].startswith("-"):
+        option = args.pop(0)
+        if option == "--":
+            break
+    if len(args) < 2:
+        return []
+    pairs = split_words(args[1]) if len(args) == 2 else args[1:]
+    cases: List[Tuple[str, str]] = []
+    pending_patterns: List[str] = []
+    for index in range(0, len(pairs) - 1, 2):
+        pattern, body = pairs[index], pairs[index + 1]
+        pending_patterns.append(pattern)
+        if body == "-":
+            # Fall through, the pattern shares the body of the next case.
+            continue
+        cases.extend((p, body) for p in pending_patterns)
+        pending_patterns = []
+    return cases
+
+
+def _get_case_pools(commands: List[Command]) -> Tuple[Optional[str], List[str]]:
+    host = None
+    pools: List[str] = []
+    for command in commands:
+        if command[0] == "pool" and len(command) > 1:
+            if command[1] not in pools:
+                pools.append(command[1])
+        elif command[0] == "HTTP::header" and len(command) > 3 and command[1] == "replace":
+            if command[2].lower() == "host":
+                host = command[3]
+        else:
+            for body in _get_nested_bodies(command):
+                nested_host, nested_pools = _get_case_pools(split_commands(body))
+                host = host or nested_host
+                pools.extend(p for p in nested_pools if p not in pools)
+    return host, pools
+
+
+def _get_nested_bodies(command: Command) -> List[str]:
+    """Returns the script bodies of control commands like `when`, `if`, `foreach` and `while`."""
+    name = command[0]
+    if name == "when":
+        return command[-1:]
+    if name == "if":
+        bodies = []
+        index = 2
+        while index < len(command):
+            word = command[index]
+            if word == "then":
+                index += 1
+                continue
+            if word == "elseif":
+                index += 2
+                continue
+            if word != "else":
+                bodies.append(word)
+            index += 1
+        return bodies
+    if name in ("foreach", "while", "for"):
+        return command[-1:]
+    if name == "catch":
+        return command[1:2]
+    return []
@@ -0,0 +1,66 @@
+import json
+import re
+from typing import Any, Callable, Dict, Iterator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+ITEMS_KEY = "items"
+
+_decoder = json.JSONDecoder()
+
+
+def get_loads(name: str) -> Callable[[bytes], Any]:
+    """
+    :param name: str 'auto' for orjson when installed, 'orjson' or 'json'
+    :return: Callable[[bytes], Any] Decodes a response body directly from its bytes
+    """
+    if name == "orjson" and orjson is None:
+        raise Exception("The orjson decoder requires the 'orjson' package to be installed.")
+    if name != "json" and orjson is not None:
+        return orjson.loads
+    return json.loads
+
+
+class CollectionStream(object):
+    """
+    Decodes the `items` of a collection response one at a time as they are consumed, so the items of a page are not
+    all held as dicts at the same time. The other fields of the response, like `nextLink`, are available in `fields`
+    once the items are consumed.
+    """
+
+    def __init__(self, content: bytes):
+        self.fields: Dict[str, Any] = {}
+        self._text = content.decode("utf-8")
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        text, self._text = self._text, ""
+        pos = self._expect(text, 0, "{")
+        while text[pos] != "}":
+            key, pos = _decoder.raw_decode(text, pos)
+            pos = self._expect(text, pos, ":")
+            if key == ITEMS_KEY:
+                pos = self._expect(text, pos, "[")
+                while text[pos] != "]":
+                    item, pos = _decoder.raw_decode(text, pos)
+                    yield item
+                    pos = self._skip_separator(text, pos, "]")
+                pos = self._expect(text, pos, "]")
+            else:
+                self.fields[key], pos = _decoder.raw_decode(text, pos)
+            pos = self._skip_separator(text, pos, "}")
+
+    @staticmethod
+    def _expect(text: str, pos: int, char: str) -> int:
+        pos = WHITESPACE.match(text, pos).end()  # type: ignore
+        if text[pos] != char:
+            raise ValueError(f"Expected '{char}' at position {pos} of the F5 response.")
+        return WHITESPACE.match(text, pos + 1).end()  # type: ignore
+
+    @classmethod
+    def _skip_separator(cls, text: str, pos: int, close: str) -> int:
+        pos = WHITESPACE.match(text, pos).end()  # type: ignore
+        return pos if text[pos] == close else cls._expect(text, pos, ",")
@@ -0,0 +1,85 @@
+import hashlib
+from typing import Any, Dict, List, Optional, Sequence
+
+from sts_f5_impl.model.instance import InstanceInfo
+
+# Shared objects, like the nodes and profiles used across partitions, and device level objects without a partition.
+COMMON_PARTITION = "Common"
+
+
+class PartitionFilter(object):
+    """
+    Selects the administrative partitions an instance collects, so several agents can split the work of one device.
+    Partitions are selected by an include and exclude list and, with `shards` > 1, by hashing their name to one of
+    the shards. `/Common`, and the objects without a partition, are only collected by `common_shard`.
+    """
+
+    def __init__(
+        self,
+        include: List[str],
+        exclude: List[str],
+        shard: int = 1,
+        shards: int = 1,
+        common_shard: int = 1,
+    ):
+        if not 1 <= shard <= shards or not 1 <= common_shard <= shards:
+            raise Exception(f"Partition shard {shard} and common shard {common_shard} must be between 1 and {shards}.")
+        self.include = [partition.strip("/") for partition in include]
+        self.exclude = [partition.strip("/") for partition in exclude]
+        self.shard = shard
+        self.shards = shards
+        self.common_shard = common_shard
+        self._included: Dict[str, bool] = {}
+
+    @classmethod
+    def from_instance(cls, conf: InstanceInfo) -> Optional["PartitionFilter"]:
+        """
+        :return: Optional[PartitionFilter] The partitions collected by the instance. None when it collects all
+        """
+        if not conf.partitions and not conf.exclude_partitions and conf.partition_shards <= 1:
+            return None
+        return cls(
+            conf.partitions,
+            conf.exclude_partitions,
+            conf.partition_shard,
+            conf.partition_shards,
+            conf.common_partition_shard,
+        )
+
+    @staticmethod
+    def get_shard(partition: str, shards: int) -> int:
+        """
+        :return: int The shard, from 1 to `shards`, of the partition. Stable across processes and agents
+        """
+        # The first 8 bytes of the digest as a big-endian number.
+        return 1 + int(hashlib.sha1(partition.encode("utf-8")).hexdigest()[:16], 16) % shards
+
+    def includes(self, partition: Optional[str]) -> bool:
+        partition = partition or COMMON_PARTITION
+        included = self._included.get(partition)
+        if included is None:
+            if (self.include and partition not in self.include) or partition in self.exclude:
+                included = False
+            elif partition == COMMON_PARTITION:
+                included = self.shard == self.common_shard
+            else:
+                included = self.get_shard(partition, self.shards) == self.shard
+            self._included[partition] = included
+        return included
+
+    @property
+    def server_filter(self) -> Optional[str]:
+        """
+        :return: Optional[str] The iControl `$filter` selecting the partition, when the instance collects only one.
+                 iControl REST filters on a single partition, so other selections are applied to the responses
+        """
+        if len(self.include) == 1 and self.includes(self.include[0]):
+            return f"partition eq {self.include[0]}"
+        return None
+
+    def filter_items(self, items: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        :param items: Sequence[Dict[str, Any]] Items of a collection or stats records, with their `partition`
+        :return: List[Dict[str, Any]] The items in the partitions collected by the instance
+        """
+        return [item for item in items if self.includes(item.get("partition"))]
@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+import yaml
+
+from sts_f5_impl.client.template_scanner import FILE_PREFIX, TemplateScanner
+
+
+class _TemplateDumper(yaml.SafeDumper):
+    """
+    Writes the code of the templates as literal blocks and quoted expressions in double quotes without wrapping
+    lines, so the copies keep the text the TemplateScanner looks for, like `f5.get_ltm_object_stats('virtual')`.
+    """
+
+    def represent_str(self, data: str) -> yaml.ScalarNode:
+        if "\n" in data:
+            return self.represent_scalar("tag:yaml.org,2002:str", data, style="|")
+        if "'" in data and '"' not in data:
+            return self.represent_scalar("tag:yaml.org,2002:str", data, style='"')
+        return super().represent_str(data)
+
+
+_TemplateDumper.add_representer(str, _TemplateDumper.represent_str)
+
+
+class QuerySchedule(object):
+    """
+    Schedules the topology queries of an instance at `topology_collection_interval`, while the health and metric
+    queries run every check run. Runs in between a topology refresh use copies of the templates without the topology
+    queries and templates. The copies are written once and only written again when a template file changed.
+    """
+
+    def __init__(self, topology_interval: int):
+        self.topology_interval = topology_interval
+        self._topology_due_at = 0.0
+        self._template_dir: Optional[str] = None
+        self._template_signature: Optional[List[Tuple[str, float]]] = None
+
+    def topology_due(self, now: Optional[float] = None) -> bool:
+        return (time.time() if now is None else now) >= self._topology_due_at
+
+    def topology_collected(self, now: Optional[float] = None):
+        self._topology_due_at = (time.time() if now is None else now) + self.topology_interval
+
+    def telemetry_refs(self, refs: List[str]) -> List[str]:
+        """
+        :param refs: List[str] The template refs of the instance
+        :return: List[str] Refs to the copies of the templates that only send health states, metrics and events
+        """
+        scanner = TemplateScanner(refs)
+        signature = [(file_name, os.path.getmtime(file_name)) for file_name in scanner.template_files()]
+        if self._template_dir is None or signature != self._template_signature:
+            self.close()
+            self._template_dir = tempfile.mkdtemp(prefix="f5_telemetry_templates_")
+            # Prefixed with their position, so the copies are processed in the same order as the templates.
+            for position, (file_name, document) in enumerate(scanner.without_topology()):
+                if not any((document.get("etl") or {}).values()):
+                    continue
+                copy_name = "%04d_%s" % (position, os.path.basename(file_name))
+                with open(os.path.join(self._template_dir, copy_name), "w") as f:
+                    yaml.dump(document, f, Dumper=_TemplateDumper, sort_keys=False, width=float("inf"))
+            self._template_signature = signature
+        return [f"{FILE_PREFIX}{self._template_dir}"]
+
+    def close(self):
+        if self._template_dir is not None:
+            shutil.rmtree(self._template_dir, ignore_errors=True)
+            self._template_dir = None
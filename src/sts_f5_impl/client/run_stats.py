@@ -0,0 +1,104 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sts_f5_impl.client.compat import perf_counter
+
+
+class RequestStats(object):
+    """Totals of the requests made to one F5 endpoint during a run."""
+
+    __slots__ = ("requests", "seconds", "bytes", "retries", "decode_seconds")
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.retries = 0
+        self.decode_seconds = 0.0
+
+
+class QueryStats(object):
+    """Time spent fetching the collection of a template query and processing its result."""
+
+    __slots__ = ("calls", "fetch_seconds", "processing_seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.fetch_seconds = 0.0
+        self.processing_seconds = 0.0
+
+
+class RunStats(object):
+    """
+    Timing of the F5 calls and template queries of one check run, reported as `f5.check.*` metrics.
+
+    The ETL queries run one after the other, so the time between the end of a query and the start of the next query,
+    or the end of the run, is accounted as the processing time of the templates of that query.
+    """
+
+    def __init__(self):
+        self.endpoints: Dict[str, RequestStats] = {}
+        self.queries: Dict[str, QueryStats] = {}
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._last_query: Optional[str] = None
+        self._last_query_end = 0.0
+
+    def record_request(self, endpoint: str, seconds: float, size: int, retries: int, decode_seconds: float):
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = RequestStats()
+            stats.requests += 1
+            stats.seconds += seconds
+            stats.bytes += size
+            stats.retries += retries
+            stats.decode_seconds += decode_seconds
+
+    @contextmanager
+    def query(self, name: str) -> Iterator[None]:
+        """Times a collection query of the templates. Queries made while fetching another query are not counted."""
+        self._depth += 1
+        start = perf_counter()
+        if self._depth == 1:
+            self._close_query(start)
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                end = perf_counter()
+                stats = self.queries.get(name)
+                if stats is None:
+                    stats = self.queries[name] = QueryStats()
+                stats.calls += 1
+                stats.fetch_seconds += end - start
+                self._last_query, self._last_query_end = name, end
+
+    def finish(self):
+        self._close_query(perf_counter())
+
+    def metrics(self, tags: List[str]) -> List[Tuple[str, float, List[str]]]:
+        """
+        :param tags: List[str] Tags added to all metrics
+        :return: List[Tuple[str, float, List[str]]] The name, value and tags of the metrics of the run
+        """
+        result = []
+        for endpoint, request_stats in sorted(self.endpoints.items()):
+            endpoint_tags = tags + [f"endpoint:{endpoint}"]
+            result.append(("f5.check.request.count", float(request_stats.requests), endpoint_tags))
+            result.append(("f5.check.request.latency", request_stats.seconds, endpoint_tags))
+            result.append(("f5.check.request.bytes", float(request_stats.bytes), endpoint_tags))
+            result.append(("f5.check.request.retries", float(request_stats.retries), endpoint_tags))
+            result.append(("f5.check.request.decode_time", request_stats.decode_seconds, endpoint_tags))
+        for query, query_stats in sorted(self.queries.items()):
+            query_tags = tags + [f"query:{query}"]
+            result.append(("f5.check.query.fetch_time", query_stats.fetch_seconds, query_tags))
+            result.append(("f5.check.query.processing_time", query_stats.processing_seconds, query_tags))
+        return result
+
+    def _close_query(self, now: float):
+        if self._last_query is not None:
+            self.queries[self._last_query].processing_seconds += now - self._last_query_end
+            self._last_query = None
@@ -0,0 +1,11 @@
+from typing import Optional
+
+
+def scoped_name(name: str, scope: Optional[str]) -> str:
+    """
+    :param name: str Name or full path of an F5 object, like '/Common/pool1' or '1.1'
+    :param scope: Optional[str] Device the object belongs to in a fleet. None when collecting a single device
+    :return: str The name suffixed with the device, like '/Common/pool1@bigip1', so objects with the same name on
+             unrelated devices get their own components and health states. The name itself without a scope
+    """
+    return name if not scope else f"{name}@{scope}"
@@ -0,0 +1,269 @@
+from string import Formatter
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from six.moves import intern
+from six.moves.collections_abc import Mapping
+
+from sts_f5_impl.client.compat import monotonic
+from sts_f5_impl.client.scope import scoped_name
+
+# Formats the target uids of stats metrics, `str.format_map` is not available on Python 2.7.
+_FORMATTER = Formatter()
+
+
+def parse_stats_name(link: str) -> Tuple[Optional[str], str]:
+    """
+    :param link: str Key of a stats entry, like
+                 https://localhost/mgmt/tm/cm/traffic-group/~Common~traffic-group-1:~Common~bigip1.local.net/stats
+    :return: Tuple[Optional[str], str] The partition, when part of the link, and the name of the object
+    """
+    name = link.split("/")[-2]
+    if name.startswith("~"):
+        parts = name[1:].split("~")
+        # Only the traffic group part of ~Common~traffic-group-1:~Common~bigip1, pool members keep their port.
+        return parts[0], parts[1].split(":")[0] if len(parts) > 2 else parts[1]
+    return None, name
+
+
+def get_subcollection_name(link: str) -> str:
+    """
+    :param link: str Key of the stats of a subcollection, like
+                 https://localhost/mgmt/tm/ltm/pool/~Common~WebServers_Pool/members/stats
+    :return: str The name of the subcollection, like 'members'
+    """
+    return link.split("/")[-2]
+
+
+class StatsSchema(object):
+    """The stat keys of a stats entry and whether each holds a 'value' or a 'description'."""
+
+    __slots__ = ("keys", "kinds", "index")
+
+    def __init__(self, keys: Tuple[str, ...], kinds: Tuple[str, ...]):
+        self.keys = keys
+        self.kinds = kinds
+        self.index = {key: position for position, key in enumerate(keys)}
+
+
+class StatsEntries(Mapping):
+    """
+    The `entries` of a stats record, with the stat values in a tuple aligned to a schema shared by all records with
+    the same stat keys. Reading a key returns `{'value': ...}` or `{'description': ...}` like the F5 response does.
+    """
+
+    __slots__ = ("_schema", "_values")
+
+    def __init__(self, schema: StatsSchema, values: Tuple[Any, ...]):
+        self._schema = schema
+        self._values = values
+
+    def __getitem__(self, key: str) -> Dict[str, Any]:
+        position = self._schema.index[key]
+        return {self._schema.kinds[position]: self._values[position]}
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._schema.keys)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def value(self, key: str, default: Any = None) -> Any:
+        position = self._schema.index.get(key)
+        return default if position is None else self._values[position]
+
+
+class StatsRecord(dict):
+    """The name, partition and compact `entries` of the stats of one object."""
+
+    def value(self, key: str, default: Any = None) -> Any:
+        """
+        :param key: str Stat key, like 'activeMemberCnt' or 'status.availabilityState'
+        :return: Any The value or description of the stat
+        """
+        return self["entries"].value(key, default)
+
+
+class StatsParser(object):
+    """
+    Parses stats responses into StatsRecords. Schemas are shared across records and runs, and descriptions, which
+    mostly are a few states like 'available', are interned.
+    """
+
+    def __init__(self):
+        self._schemas: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], StatsSchema] = {}
+
+    def parse(self, response: Dict[str, Any], keys: Optional[Set[str]] = None) -> List[StatsRecord]:
+        """
+        :param response: Dict[str, Any] Stats collection response
+        :param keys: Optional[Set[str]] Stat keys to keep. All keys are kept when None
+        :return: List[StatsRecord] A record per object, with the records of its expanded subcollections, like `members`
+        """
+        result = []
+        for link, stats in response["entries"].items():
+            entries = stats["nestedStats"]["entries"]
+            stat_keys, kinds, values = [], [], []
+            subcollections = {}
+            for key, entry in entries.items():
+                if "nestedStats" in entry:
+                    subcollections[get_subcollection_name(key)] = self.parse(entry["nestedStats"], keys)
+                    continue
+                if keys is not None and key not in keys:
+                    continue
+                if "value" in entry:
+                    kinds.append("value")
+                    values.append(entry["value"])
+                else:
+                    description = entry.get("description")
+                    kinds.append("description")
+                    values.append(intern(description) if isinstance(description, str) else description)
+                stat_keys.append(key)
+            record = StatsRecord(entries=StatsEntries(self._get_schema(stat_keys, kinds), tuple(values)))
+            partition, record["name"] = parse_stats_name(link)
+            if partition is not None:
+                record["partition"] = partition
+            record.update(subcollections)
+            result.append(record)
+        return result
+
+    def _get_schema(self, keys: List[str], kinds: List[str]) -> StatsSchema:
+        schema_key = (tuple(keys), tuple(kinds))
+        schema = self._schemas.get(schema_key)
+        if schema is None:
+            schema = self._schemas[schema_key] = StatsSchema(*schema_key)
+        return schema
+
+
+class CounterStore(object):
+    """
+    The previous samples of the cumulative counters of a stats collection, kept across runs. Every run replaces all
+    samples, so objects that disappeared are evicted.
+    """
+
+    def __init__(self):
+        self._samples: Dict[Any, Tuple[float, Any]] = {}
+
+    def changes(self, samples: List[Tuple[Any, Any]], now: float) -> List[Tuple[Any, Any, float]]:
+        """
+        :param samples: List[Tuple[Any, Any]] The key of the object and counter, and the current value of the counter
+        :param now: float Monotonic time of the samples
+        :return: List[Tuple[Any, Any, float]] The key, increase and seconds since the previous sample of the counters
+                 that were sampled before. A counter that decreased was reset and is skipped until its next sample
+        """
+        result = []
+        previous = self._samples
+        self._samples = {}
+        for key, value in samples:
+            self._samples[key] = (now, value)
+            last = previous.get(key)
+            if last is None or value < last[1] or now <= last[0]:
+                continue
+            result.append((key, value - last[1], now - last[0]))
+        return result
+
+
+class StatsMetricMapping(object):
+    """
+    Maps stat keys to metric names for all records of a stats collection. The positions of the stat keys are looked
+    up once per schema, so the values of compact records are read straight from their value tuples.
+    """
+
+    def __init__(
+        self,
+        target_uid: str,
+        metrics: Dict[str, str],
+        rates: Optional[Dict[str, str]] = None,
+        deltas: Optional[Dict[str, str]] = None,
+    ):
+        """
+        :param target_uid: str Format of the uid the metrics are sent to, like 'urn:f5:pool:/{tmName}{scope}',
+                           filled in with the name, partition and device of a record or the value of one of its stats
+        :param metrics: Dict[str, str] Metric name per stat key, like {'memberCnt': 'f5.pool.memberCnt'}
+        :param rates: Optional[Dict[str, str]] Metric name of the per second rate per cumulative counter
+        :param deltas: Optional[Dict[str, str]] Metric name of the increase since the previous run per counter
+        """
+        self.target_uid = target_uid
+        self.metrics = metrics
+        self.rates = rates or {}
+        self.deltas = deltas or {}
+        self._keys = list(dict.fromkeys(list(metrics) + list(self.rates) + list(self.deltas)))
+        self._positions: Dict[StatsSchema, List[Tuple[int, str]]] = {}
+        self._counters = CounterStore()
+
+    def apply(self, records: List[Dict[str, Any]], now: Optional[float] = None) -> List[Tuple[str, Any, str]]:
+        """
+        :param records: List[Dict[str, Any]] Stats records, compact or as returned by the F5
+        :param now: Optional[float] Monotonic time the records were sampled. Defaults to the current time
+        :return: List[Tuple[str, Any, str]] The metric name, value and target uid of every mapped stat value
+        """
+        result = []
+        samples = []
+        for record in records:
+            target_uid = _FORMATTER.vformat(self.target_uid, (), _RecordFields(record))
+            object_key = (record.get("device"), record.get("partition"), record["name"], target_uid)
+            for key, value in self._get_values(record["entries"]):
+                if key in self.metrics:
+                    result.append((self.metrics[key], value, target_uid))
+                if key in self.rates or key in self.deltas:
+                    samples.append(((object_key, key), value))
+        now = monotonic() if now is None else now
+        for ((_, _, _, target_uid), key), increase, seconds in self._counters.changes(samples, now):
+            if key in self.rates:
+                result.append((self.rates[key], increase / seconds, target_uid))
+            if key in self.deltas:
+                result.append((self.deltas[key], increase, target_uid))
+        return result
+
+    def _get_values(self, entries: Mapping) -> List[Tuple[str, Any]]:
+        if isinstance(entries, StatsEntries):
+            values = entries._values
+            return [(key, values[position]) for position, key in self._get_positions(entries._schema)]
+        result = []
+        for key in self._keys:
+            value = entries.get(key, {}).get("value")
+            if value is not None:
+                result.append((key, value))
+        return result
+
+    def _get_positions(self, schema: StatsSchema) -> List[Tuple[int, str]]:
+        positions = self._positions.get(schema)
+        if positions is None:
+            positions = [
+                (schema.index[key], key)
+                for key in self._keys
+                if key in schema.index and schema.kinds[schema.index[key]] == "value"
+            ]
+            self._positions[schema] = positions
+        return positions
+
+
+# Format fields of a target uid that scope it, and the record field with the device they scope it by.
+SCOPE_FIELDS = {"scope": "config_device", "device_scope": "device"}
+
+
+class _RecordFields(Mapping):
+    """
+    The fields of a stats record for `Formatter.vformat`, falling back to the value of a stat. `scope` and
+    `device_scope` are the suffix that scopes a name by the `config_device` or `device` of the record in a fleet.
+    """
+
+    __slots__ = ("_record",)
+
+    def __init__(self, record: Dict[str, Any]):
+        self._record = record
+
+    def __getitem__(self, key: str) -> Any:
+        if key in SCOPE_FIELDS:
+            return scoped_name("", self._record.get(SCOPE_FIELDS[key]))
+        if key != "entries" and key in self._record:
+            return self._record[key]
+        entries = self._record["entries"]
+        if isinstance(entries, StatsEntries):
+            return entries.value(key)
+        entry = entries[key]
+        return entry.get("value", entry.get("description"))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._record)
+
+    def __len__(self) -> int:
+        return len(self._record)
@@ -0,0 +1,295 @@
+import copy
+import importlib
+import os
+import re
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import yaml
+
+MODULE_DIR_PREFIX = "module_dir://"
+FILE_PREFIX = "file://"
+TEMPLATE_EXTENSIONS = (".yaml", ".yml")
+
+# f5.get_ltm_object('pool', expand_subcollections=True) / f5.get_net_object_stats("interface")
+F5_OBJECT_CALL = re.compile(r"\.get_(ltm|net|cm)_object(_stats)?\(\s*[\"']([A-Za-z0-9_-]+)[\"']([^)]*)\)")
+POOL_MEMBER_STATS_CALL = re.compile(r"\.get_ltm_pool_member_stats\(")
+EXPAND_ARGUMENT = re.compile(r"(expand_subcollections\s*=\s*True|^\s*,\s*True)")
+RULE_CALL = re.compile(r"\.(get_rules?|get_pools_from_switch_statement_irule)\(")
+DATA_GROUP_CALL = re.compile(r"\.(get_data_groups?(_records)?|process_data_group_proxypass_(details|batch))\(")
+
+# The text and document of every template file, and the results derived from the template files of a list of refs.
+# Kept for the lifetime of the process and parsed again when the modification time or size of a file changed.
+_file_cache: Dict[str, Tuple[Tuple[float, int], str, Dict[str, Any]]] = {}
+_result_cache: Dict[Tuple[str, Tuple[str, ...]], Tuple[Tuple[Any, ...], Any]] = {}
+
+# Template types that send topology. All other types, like health and metrics, send telemetry.
+TOPOLOGY_TEMPLATE_TYPES = ("components", "relations")
+
+# Fields always selected, so objects can still be identified and linked when templates do not reference them.
+ALWAYS_SELECTED_FIELDS = {"name", "partition", "fullPath", "generation", "selfLink"}
+JSON_PATH_FIELD = re.compile(r"\$\.([A-Za-z_][A-Za-z0-9_-]*)")
+ITEM_KEY_FIELD = re.compile(r"\bitem\[\s*[\"']([^\"']+)[\"']\s*\]")
+ITEM_GET_FIELD = re.compile(r"\bitem\.get\(\s*[\"']([^\"']+)[\"']")
+ITEM_PASSED_ON = re.compile(r"\bitem\b(?!\s*(\[|\.get\())")
+# item['entries']['status.availabilityState'] / item.value('activeMemberCnt')
+STAT_ENTRY_KEY = re.compile(r"\[\s*[\"']entries[\"']\s*\]\s*\[\s*[\"']([^\"']+)[\"']\s*\]")
+STAT_VALUE_KEY = re.compile(r"\bitem\.value\(\s*[\"']([^\"']+)[\"']")
+STATS_ITEM_PASSED_ON = re.compile(r"\bitem\b(?!\s*(\[|\.get\(|\.value\())")
+# f5.add_stats_metrics(factory, item, "urn:f5:pool:/{tmName}", {"memberCnt": "f5.pool.memberCnt"})
+STATS_METRICS_CALL = re.compile(r"\.add_stats_metrics\(\s*factory\s*,\s*item\s*,")
+STATS_METRICS_KEY = re.compile(r"([\"']([^\"']+)[\"']\s*:|\{([A-Za-z0-9_]+)\})")
+# f5.scoped(item, item['fullPath']) only reads the device tags a fleet adds to the item.
+SCOPED_CALL = re.compile(r"\.(device_)?scoped\(\s*item\s*,")
+# Stat keys can contain dots, so the key read by a json path like $.entries.status.description is ambiguous.
+STAT_ENTRIES_PASSED_ON = re.compile(r"([\"']entries[\"']\s*(\](?!\s*\[)|\))|\$\.entries\b)")
+
+
+class CollectionRef(object):
+    """A F5 collection that a template query reads, e.g. ltm pool with expanded subcollections."""
+
+    def __init__(self, family: str, object_type: str, stats: bool = False, expand_subcollections: bool = False):
+        self.family = family
+        self.object_type = object_type
+        self.stats = stats
+        self.expand_subcollections = expand_subcollections
+
+    def key(self) -> Tuple[str, str, bool, bool]:
+        return self.family, self.object_type, self.stats, self.expand_subcollections
+
+    def __eq__(self, other):
+        return isinstance(other, CollectionRef) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        suffix = "/stats" if self.stats else ""
+        expand = "?expandSubcollections=true" if self.expand_subcollections else ""
+        return f"{self.family}/{self.object_type}{suffix}{expand}"
+
+
+class TemplateScanner(object):
+    """
+    Reads the ETL template files referenced by an instance and discovers which F5 collections they will request.
+    """
+
+    def __init__(self, refs: Optional[List[str]]):
+        self.refs = refs or []
+
+    def template_files(self) -> List[str]:
+        files: List[str] = []
+        for ref in self.refs:
+            files.extend(self._resolve_ref(ref))
+        return files
+
+    def collections(self) -> List[CollectionRef]:
+        return self._cached("collections", self._collections)
+
+    def _collections(self) -> List[CollectionRef]:
+        found: List[CollectionRef] = []
+        for file_name in self.template_files():
+            text = self._read(file_name)[0]
+            for ref in self.collections_in_text(text):
+                if ref not in found:
+                    found.append(ref)
+        return found
+
+    @staticmethod
+    def collections_in_text(text: str) -> List[CollectionRef]:
+        found = []
+        for match in F5_OBJECT_CALL.finditer(text):
+            family, stats, object_type, arguments = match.groups()
+            expand = EXPAND_ARGUMENT.search(arguments) is not None
+            found.append(CollectionRef(family, object_type, stats is not None, expand))
+        if POOL_MEMBER_STATS_CALL.search(text):
+            found.append(CollectionRef("ltm", "pool", True, True))
+        if RULE_CALL.search(text):
+            found.append(CollectionRef("ltm", "rule"))
+        if DATA_GROUP_CALL.search(text):
+            found.append(CollectionRef("ltm", "data-group/internal"))
+        return found
+
+    def without_topology(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        :return: List[Tuple[str, Dict[str, Any]]] The file name and document of every template file, keeping only the
+                 queries and templates that send health states, metrics or events. Queries without templates, like
+                 processors relating components, are considered topology
+        """
+        result = []
+        for file_name in self.template_files():
+            document = copy.deepcopy(self._read(file_name)[1])
+            etl = document.get("etl") or {}
+            templates = etl.get("template") or {}
+            topology_templates: Set[str] = set()
+            for template_type in TOPOLOGY_TEMPLATE_TYPES:
+                topology_templates.update(t.get("name") for t in templates.pop(template_type, None) or [])
+            if "queries" in etl:
+                queries = etl["queries"] or []
+                kept = []
+                for query in [queries] if isinstance(queries, dict) else queries:
+                    refs = [name for name in query.get("template_refs") or [] if name not in topology_templates]
+                    if refs:
+                        kept.append(dict(query, template_refs=refs))
+                etl["queries"] = kept
+            result.append((file_name, document))
+        return result
+
+    def selected_fields(self) -> Dict[CollectionRef, Optional[Set[str]]]:
+        """
+        Infers the fields each collection query needs from the `$.field`, `item['field']` and `item.get('field')`
+        references of the templates and processor consuming the query. A collection maps to None when a consumer uses
+        the item in a way that can not be followed, in which case all fields are required.
+        """
+        return self._cached("selected_fields", self._selected_fields)
+
+    def _selected_fields(self) -> Dict[CollectionRef, Optional[Set[str]]]:
+        documents = [self._load_etl(file_name) for file_name in self.template_files()]
+        templates: Dict[str, Any] = {}
+        pre_processor_fields: Set[str] = set()
+        for etl in documents:
+            for template_list in (etl.get("template") or {}).values():
+                for template in template_list or []:
+                    templates[template.get("name")] = template
+            for pre_processor in etl.get("pre_processors") or []:
+                pre_processor_fields.update(self.fields_in_text(pre_processor.get("code", "")))
+
+        selected: Dict[CollectionRef, Optional[Set[str]]] = {}
+        for etl in documents:
+            queries = etl.get("queries") or []
+            for query in [queries] if isinstance(queries, dict) else queries:
+                fields: Optional[Set[str]] = set(ALWAYS_SELECTED_FIELDS)
+                processor = query.get("processor") or ""
+                fields.update(self.fields_in_text(processor))  # type: ignore
+                if ITEM_PASSED_ON.search(processor):
+                    fields.update(pre_processor_fields)  # type: ignore
+                for template_name in query.get("template_refs") or []:
+                    text = SCOPED_CALL.sub(".scoped(", self._flatten(templates.get(template_name)))
+                    if template_name not in templates or ITEM_PASSED_ON.search(text):
+                        fields = None
+                        break
+                    fields.update(self.fields_in_text(text))  # type: ignore
+                for ref in self.collections_in_text(query.get("query", "")):
+                    if ref.stats:
+                        continue
+                    ref = CollectionRef(ref.family, ref.object_type, False, ref.expand_subcollections)
+                    if ref in selected and (selected[ref] is None or fields is None):
+                        selected[ref] = None
+                    elif ref in selected:
+                        selected[ref].update(fields)  # type: ignore
+                    else:
+                        selected[ref] = None if fields is None else set(fields)
+        return selected
+
+    def stat_keys(self) -> Dict[CollectionRef, Optional[Set[str]]]:
+        """
+        Infers the stat keys each stats query needs from the `item['entries']['key']` and `item.value('key')`
+        references of the templates and processor consuming the query. A stats collection maps to None when a consumer
+        uses the item or its entries in a way that can not be followed, in which case all stat keys are required.
+        """
+        return self._cached("stat_keys", self._stat_keys)
+
+    def _stat_keys(self) -> Dict[CollectionRef, Optional[Set[str]]]:
+        documents = [self._load_etl(file_name) for file_name in self.template_files()]
+        templates: Dict[str, Any] = {}
+        for etl in documents:
+            for template_list in (etl.get("template") or {}).values():
+                for template in template_list or []:
+                    templates[template.get("name")] = template
+
+        stat_keys: Dict[CollectionRef, Optional[Set[str]]] = {}
+        for etl in documents:
+            queries = etl.get("queries") or []
+            for query in [queries] if isinstance(queries, dict) else queries:
+                texts = [query.get("processor") or ""]
+                texts.extend(self._flatten(templates.get(name)) for name in query.get("template_refs") or [])
+                keys: Optional[Set[str]] = self.stat_keys_in_text("\n".join(texts))
+                if any(name not in templates for name in query.get("template_refs") or []):
+                    keys = None
+                for ref in self.collections_in_text(query.get("query", "")):
+                    if not ref.stats:
+                        continue
+                    if ref in stat_keys and (stat_keys[ref] is None or keys is None):
+                        stat_keys[ref] = None
+                    elif ref in stat_keys:
+                        stat_keys[ref].update(keys)  # type: ignore
+                    else:
+                        stat_keys[ref] = None if keys is None else set(keys)
+        return stat_keys
+
+    @staticmethod
+    def stat_keys_in_text(text: str) -> Optional[Set[str]]:
+        keys: Set[str] = set()
+        text = SCOPED_CALL.sub(".scoped(", text)
+        if STATS_METRICS_CALL.search(text):
+            # The stat keys of metric mappings and uid formats. Also matching other dict keys keeps a few keys too many.
+            keys.update(key or field for _, key, field in STATS_METRICS_KEY.findall(text))
+            text = STATS_METRICS_CALL.sub(".add_stats_metrics(", text)
+        if STATS_ITEM_PASSED_ON.search(text) or STAT_ENTRIES_PASSED_ON.search(text):
+            return None
+        keys.update(STAT_ENTRY_KEY.findall(text))
+        keys.update(STAT_VALUE_KEY.findall(text))
+        return keys
+
+    @staticmethod
+    def fields_in_text(text: str) -> Set[str]:
+        fields = set(JSON_PATH_FIELD.findall(text))
+        fields.update(ITEM_KEY_FIELD.findall(text))
+        fields.update(ITEM_GET_FIELD.findall(text))
+        return fields
+
+    @classmethod
+    def _flatten(cls, value: Any) -> str:
+        if isinstance(value, dict):
+            return "\n".join(cls._flatten(v) for v in value.values())
+        if isinstance(value, list):
+            return "\n".join(cls._flatten(v) for v in value)
+        return value if isinstance(value, str) else ""
+
+    def _cached(self, name: str, compute: Callable[[], Any]) -> Any:
+        """Returns a copy of the result computed for the refs, computing it again when a template file changed."""
+        key = (name, tuple(self.refs))
+        signature = tuple((file_name, self._file_signature(file_name)) for file_name in self.template_files())
+        cached = _result_cache.get(key)
+        if cached is None or cached[0] != signature:
+            cached = _result_cache[key] = (signature, compute())
+        return copy.deepcopy(cached[1])
+
+    @classmethod
+    def _load_etl(cls, file_name: str) -> Dict[str, Any]:
+        return cls._read(file_name)[1].get("etl") or {}
+
+    @classmethod
+    def _read(cls, file_name: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        :return: Tuple[str, Dict[str, Any]] The text and parsed document of a template file. Not to be modified
+        """
+        signature = cls._file_signature(file_name)
+        cached = _file_cache.get(file_name)
+        if cached is None or cached[0] != signature:
+            with open(file_name) as f:
+                text = f.read()
+            cached = _file_cache[file_name] = (signature, text, yaml.safe_load(text) or {})
+        return cached[1], cached[2]
+
+    @staticmethod
+    def _file_signature(file_name: str) -> Tuple[float, int]:
+        stat = os.stat(file_name)
+        return stat.st_mtime, stat.st_size
+
+    @staticmethod
+    def _resolve_ref(ref: str) -> List[str]:
+        if ref.startswith(MODULE_DIR_PREFIX):
+            module = importlib.import_module(ref[len(MODULE_DIR_PREFIX) :])
+            if module.__file__ is None:
+                raise Exception(f"Template module of {ref} is a namespace package, add an __init__.py to it.")
+            path = os.path.dirname(module.__file__)
+        elif ref.startswith(FILE_PREFIX):
+            path = ref[len(FILE_PREFIX) :]
+        else:
+            path = ref
+        if os.path.isdir(path):
+            names = sorted(n for n in os.listdir(path) if n.endswith(TEMPLATE_EXTENSIONS))
+            return [os.path.join(path, n) for n in names]
+        if os.path.isfile(path):
+            return [path]
+        return []
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator
+
+from sts_f5_impl.client.compat import monotonic
+
+# Pacing between request starts once a device is overloaded, doubled on every overload up to MAX_DELAY_SECONDS.
+MIN_DELAY_SECONDS = 0.05
+MAX_DELAY_SECONDS = 2.0
+# A response slower than this factor times the fastest recent response of the same endpoint signals overload.
+LATENCY_FACTOR = 3.0
+# The fastest response of an endpoint slowly moves towards the latest responses, to follow lasting changes.
+BASELINE_DRIFT = 0.05
+# The circuit opens when this share of the last WINDOW requests signalled overload.
+WINDOW = 20
+OVERLOAD_RATE = 0.5
+
+
+class AdaptiveThrottle(object):
+    """
+    Limits the requests in flight to a device and paces their start using additive increase, multiplicative decrease.
+    Every request that completes in time adds 1/limit to the concurrency limit, up to `max_concurrency`, and halves the
+    pacing delay. A failed, retried or slow request halves the limit, at most once per response time, and doubles the
+    delay. When most recent requests signalled overload the circuit opens for `cooldown_seconds`, during which
+    non-critical queries are skipped.
+    """
+
+    def __init__(self, max_concurrency: int, cooldown_seconds: int):
+        self.max_concurrency = max(1, max_concurrency)
+        self.cooldown_seconds = cooldown_seconds
+        self.limit = float(self.max_concurrency)
+        self.delay = 0.0
+        self._in_flight = 0
+        self._next_start = 0.0
+        self._last_decrease = 0.0
+        self._open_until = 0.0
+        self._baselines: Dict[str, float] = {}
+        self._results: Deque[bool] = deque(maxlen=WINDOW)
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+            now = monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify()
+
+    def record(self, endpoint: str, seconds: float, failed: bool):
+        """
+        :param endpoint: str Endpoint of the request, like 'ltm/pool/stats'
+        :param seconds: float Response time of the request
+        :param failed: bool Whether the request failed or was retried
+        """
+        with self._condition:
+            baseline = self._baselines.get(endpoint, seconds)
+            overloaded = failed or seconds > LATENCY_FACTOR * baseline
+            self._baselines[endpoint] = min(seconds, baseline + (seconds - baseline) * BASELINE_DRIFT)
+            now = monotonic()
+            if overloaded:
+                if now - self._last_decrease >= seconds:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.delay = min(MAX_DELAY_SECONDS, max(MIN_DELAY_SECONDS, self.delay * 2))
+                    self._last_decrease = now
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+                self.delay = self.delay / 2 if self.delay > MIN_DELAY_SECONDS else 0.0
+            self._results.append(overloaded)
+            if len(self._results) == WINDOW and sum(self._results) >= OVERLOAD_RATE * WINDOW:
+                self._open_until = now + self.cooldown_seconds
+                self._results.clear()
+            self._condition.notify_all()
+
+    @property
+    def overloaded(self) -> bool:
+        """Whether the circuit is open and non-critical queries are to be skipped."""
+        return monotonic() < self._open_until
@@ -1,21 +1,66 @@
 from typing import List
 
 from schematics import Model
-from schematics.types import IntType, ListType, ModelType, StringType, URLType
+from schematics.types import (
+    BooleanType,
+    IntType,
+    ListType,
+    ModelType,
+    StringType,
+    URLType,
+)
 from stackstate_etl.model.instance import InstanceInfo as EtlInstanceInfo
 
 
 class F5Spec(Model):
+    name: str = StringType()  # Device name used to tag items when collecting several devices. Defaults to url host
     url: str = URLType(required=True)
     username: str = StringType(required=True)
     password: str = StringType(required=True)
     max_request_retries: int = IntType(default=3)  # In case of a connection failure try 2 more times
     retry_backoff_seconds: int = IntType(default=2)  # wait 1 second before retrying in case of an error
     retry_on_status: List[int] = ListType(IntType, default=[408, 429, 500, 502, 503, 504])
+    request_timeout_seconds: int = IntType()  # Timeout of a single rest call. No timeout when not set
+    transport: str = StringType(default="requests", choices=["requests", "async"])  # 'async' requires aiohttp
+    json_decoder: str = StringType(
+        default="auto", choices=["auto", "orjson", "json"]
+    )  # 'auto' uses orjson if installed
+    prefetch: bool = BooleanType(default=True)  # Fetch the collections used by the templates in parallel
+    max_concurrent_requests: int = IntType(default=4)  # Worker pool size used when prefetching collections
+    infer_select: bool = BooleanType(default=False)  # Only fetch the fields the templates read using $select
+    # Collections like 'ltm/virtual' that are only fetched again when the generation of one of its objects changed.
+    incremental_collections: List[str] = ListType(StringType, default=[])
+    page_size: int = IntType(default=500)  # Items per page for the paged iter_*_object calls
+    token_timeout_seconds: int = IntType(default=3600)  # Lifetime requested when extending the auth token
+    token_refresh_seconds: int = IntType(default=300)  # Extend the auth token when it expires within this period
+    fetch_rules_on_demand: bool = BooleanType(default=False)  # Fetch only the iRules and data groups that are used
+    rule_cache_size: int = IntType(default=1000)  # iRules and data groups fetched on demand kept across runs
+    adaptive_throttling: bool = BooleanType(default=False)  # Adapt concurrency and pacing to the device latency
+    # Collections like 'net/interface/stats' that are skipped while the device is overloaded, see adaptive_throttling.
+    non_critical_collections: List[str] = ListType(StringType, default=[])
+    overload_cooldown_seconds: int = IntType(default=300)  # Time non-critical collections are skipped when overloaded
+    compact_stats: bool = BooleanType(default=False)  # Keep stats as compact records of the stat keys templates read
 
 
 class InstanceInfo(EtlInstanceInfo):
     instance_url: str = StringType(required=True)
     instance_type: str = StringType(default="f5check")
     collection_interval: int = IntType(default=120)
+    # Seconds between topology refreshes. Health and metrics are collected every run. Topology every run when not set
+    topology_collection_interval: int = IntType()
     f5: F5Spec = ModelType(F5Spec, required=True)
+    devices: List[F5Spec] = ListType(ModelType(F5Spec), default=[])  # Additional devices collected with `f5`
+    discover_devices: bool = BooleanType(default=False)  # Also collect the peers of `f5` found in cm/device
+    max_concurrent_device_requests: int = IntType(default=16)  # Requests in flight across all devices
+    dedupe_sync_groups: bool = BooleanType(default=True)  # Collect config of a sync-failover group from one unit
+    partitions: List[str] = ListType(StringType, default=[])  # Only collect these partitions. All when empty
+    exclude_partitions: List[str] = ListType(StringType, default=[])  # Partitions that are not collected
+    # Collect the partitions hashed to shard `partition_shard` of `partition_shards`, to split a device across agents.
+    partition_shard: int = IntType(default=1, min_value=1)
+    partition_shards: int = IntType(default=1, min_value=1)
+    common_partition_shard: int = IntType(default=1, min_value=1)  # Shard collecting /Common and device level objects
+    self_metrics: bool = BooleanType(default=False)  # Send f5.check.* metrics on the timing of the run and F5 calls
+    delta_topology: bool = BooleanType(default=False)  # Only send the components and relations that changed
+    full_topology_interval: int = IntType(default=3600)  # Seconds between full topology snapshots with delta_topology
+    slow_run_profile_seconds: int = IntType()  # Profile runs and dump the profile of runs taking longer than this
+    profile_dir: str = StringType()  # Directory of the slow run profiles. Defaults to the temp directory
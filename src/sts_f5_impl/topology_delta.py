@@ -0,0 +1,69 @@
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# The kind, either 'component' or 'relation', the positional and the keyword arguments of an AgentCheck call.
+TopologyCall = Tuple[str, Tuple[Any, ...], Dict[str, Any]]
+
+
+class TopologyDelta(object):
+    """
+    Keeps the fingerprints of the components and relations sent by the previous topology run of an instance, so a run
+    only sends the elements that were added or changed and reports the components that were removed. Every
+    `full_interval` seconds all elements are sent, as a snapshot that also removes the elements the deltas missed.
+
+    The calls of a run are buffered until the end of the run, because templates can send the same element more than
+    once, e.g. mergeable components, and the element is only unchanged when all of its calls are.
+    """
+
+    def __init__(self, full_interval: int):
+        self.full_interval = full_interval
+        self.full = True
+        self._next_full_at = 0.0
+        self._fingerprints: Dict[Tuple[str, Any], bytes] = {}
+        self._calls: Dict[Tuple[str, Any], List[TopologyCall]] = {}
+
+    def begin(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        self.full = now >= self._next_full_at
+        if self.full:
+            self._next_full_at = now + self.full_interval
+        self._calls = {}
+
+    def add(self, kind: str, key: Any, args: Tuple[Any, ...], kwargs: Dict[str, Any]):
+        """
+        :param kind: str 'component' or 'relation'
+        :param key: Any The id of a component or the source, target and type of a relation
+        """
+        self._calls.setdefault((kind, key), []).append((kind, args, kwargs))
+
+    def finish(self) -> Tuple[List[TopologyCall], List[Any]]:
+        """
+        :return: Tuple[List[TopologyCall], List[Any]] The calls to send and the ids of the removed components
+        """
+        fingerprints = {key: self._fingerprint(calls) for key, calls in self._calls.items()}
+        send = []
+        for key, calls in self._calls.items():
+            if self.full or self._fingerprints.get(key) != fingerprints[key]:
+                send.extend(calls)
+        removed = [key for kind, key in self._fingerprints if kind == "component" and (kind, key) not in fingerprints]
+        self._fingerprints = fingerprints
+        self._calls = {}
+        return send, [] if self.full else removed
+
+    def discard(self) -> List[TopologyCall]:
+        """
+        Ends a failed run. Returns all buffered calls and sends everything in the next run, as the elements the failed
+        run did not produce are unknown.
+        """
+        send = [call for calls in self._calls.values() for call in calls]
+        self._fingerprints = {}
+        self._next_full_at = 0.0
+        self._calls = {}
+        return send
+
+    @staticmethod
+    def _fingerprint(calls: List[TopologyCall]) -> bytes:
+        encoded = json.dumps([[args, kwargs] for _, args, kwargs in calls], sort_keys=True, default=str)
+        return hashlib.sha1(encoded.encode("utf-8")).digest()
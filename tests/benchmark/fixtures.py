@@ -0,0 +1,341 @@
+from typing import Any, Dict, List
+
+LOCAL_URL = "https://localhost/"
+VERSION = "ver=16.1.3"
+HTTPS_REDIRECT = 'when HTTP_REQUEST {\n  HTTP::redirect https://[getfield [HTTP::host] ":" 1][HTTP::uri]\n}'
+
+
+class SyntheticBigIp(object):
+    """
+    Generates referentially consistent iControl REST responses for a BIG-IP of configurable size. Pools have members
+    referring to existing nodes, virtual servers refer to existing pools, rules and data groups, and every collection
+    has a matching stats response, so the templates resolve all relations like they would on a real device.
+    """
+
+    def __init__(
+        self,
+        nodes: int = 100,
+        pools: int = 50,
+        members_per_pool: int = 4,
+        virtuals: int = 50,
+        partitions: int = 1,
+        interfaces: int = 8,
+        vlans: int = 4,
+        rule_every: int = 5,
+        device_name: str = "bigip1.bench.local",
+    ):
+        """
+        :param nodes: int Number of ltm nodes
+        :param pools: int Number of ltm pools
+        :param members_per_pool: int Pool members per pool, assigned round robin over the nodes
+        :param virtuals: int Number of ltm virtual servers, each with its own virtual address
+        :param partitions: int Number of partitions the ltm objects are spread over, including Common
+        :param interfaces: int Number of net interfaces, spread over the vlans
+        :param vlans: int Number of net vlans, each with one self ip
+        :param rule_every: int Every n-th virtual server gets a ReverseProxy iRule and a ProxyPass data group
+        :param device_name: str Name of the device
+        """
+        self.nodes = nodes
+        self.pools = pools
+        self.members_per_pool = members_per_pool
+        self.virtuals = virtuals
+        self.partitions = ["Common"] + [f"Tenant{i}" for i in range(1, partitions)]
+        self.interfaces = interfaces
+        self.vlans = vlans
+        self.rule_every = rule_every
+        self.device_name = device_name
+
+    def responses(self) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: Dict[str, Dict[str, Any]] The response per request path, like 'mgmt/tm/ltm/pool'. Collections with
+                 subcollections are returned expanded.
+        """
+        node_items = [self._node(i) for i in range(self.nodes)]
+        pool_items = [self._pool(i, node_items) for i in range(self.pools)]
+        virtual_items = [self._virtual(i, pool_items) for i in range(self.virtuals)]
+        rule_items = [self._object("ltm/rule", "Common", "_sys_https_redirect", apiAnonymous=HTTPS_REDIRECT)]
+        rule_items.extend(self._rule(i, v, pool_items) for i, v in enumerate(virtual_items) if "rules" in v)
+        data_group_items = [self._data_group(virtual) for virtual in virtual_items if "rules" in virtual]
+        interface_items = [self._interface(i) for i in range(self.interfaces)]
+        vlan_items = [self._vlan(i, interface_items) for i in range(self.vlans)]
+        traffic_groups = ["traffic-group-1", "traffic-group-local-only"]
+        return {
+            "mgmt/tm/ltm/node": self._collection("ltm/node", node_items),
+            "mgmt/tm/ltm/node/stats": self._stats("ltm/node", node_items, self._node_stats),
+            "mgmt/tm/ltm/pool": self._collection("ltm/pool", pool_items),
+            "mgmt/tm/ltm/pool/stats": self._stats("ltm/pool", pool_items, self._pool_stats),
+            "mgmt/tm/ltm/virtual": self._collection("ltm/virtual", virtual_items),
+            "mgmt/tm/ltm/virtual/stats": self._stats("ltm/virtual", virtual_items, self._virtual_stats),
+            "mgmt/tm/ltm/virtual-address": self._collection(
+                "ltm/virtual-address", [self._virtual_address(v) for v in virtual_items]
+            ),
+            "mgmt/tm/ltm/rule": self._collection("ltm/rule", rule_items),
+            "mgmt/tm/ltm/data-group/internal": self._collection("ltm/data-group/internal", data_group_items),
+            "mgmt/tm/net/interface": self._collection("net/interface", interface_items),
+            "mgmt/tm/net/interface/stats": self._stats("net/interface", interface_items, self._interface_stats),
+            "mgmt/tm/net/vlan": self._collection("net/vlan", vlan_items),
+            "mgmt/tm/net/self": self._collection("net/self", [self._self_ip(v) for v in vlan_items]),
+            "mgmt/tm/cm/device": self._collection("cm/device", [self._device()]),
+            "mgmt/tm/cm/device-group": self._collection("cm/device-group", [self._device_group()]),
+            "mgmt/tm/cm/traffic-group": self._collection(
+                "cm/traffic-group", [self._object("cm/traffic-group", "Common", n) for n in traffic_groups]
+            ),
+            "mgmt/tm/cm/traffic-group/stats": self._traffic_group_stats(traffic_groups),
+        }
+
+    def _partition(self, index: int) -> str:
+        return self.partitions[index % len(self.partitions)]
+
+    @staticmethod
+    def _address(prefix: int, index: int) -> str:
+        return f"{prefix}.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+
+    @staticmethod
+    def _link(path: str) -> str:
+        return f"{LOCAL_URL}mgmt/tm/{path}?{VERSION}"
+
+    def _object(self, collection: str, partition: str, name: str, **fields) -> Dict[str, Any]:
+        full_path = f"/{partition}/{name}" if partition else name
+        item = {
+            "kind": f"tm:{collection.replace('/', ':')}:{collection.rsplit('/', 1)[-1]}state",
+            "name": name,
+            "fullPath": full_path,
+            "generation": 1,
+            "selfLink": self._link(f"{collection}/{full_path.replace('/', '~')}"),
+        }
+        if partition:
+            item["partition"] = partition
+        item.update(fields)
+        return item
+
+    def _collection(self, collection: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        kind = f"tm:{collection.replace('/', ':')}:{collection.rsplit('/', 1)[-1]}collectionstate"
+        return {"kind": kind, "selfLink": self._link(collection), "items": items}
+
+    def _stats(self, collection: str, items: List[Dict[str, Any]], entries_fn) -> Dict[str, Any]:
+        entries = {}
+        for item in items:
+            link = item["selfLink"].split("?")[0]
+            entries[f"{link}/stats"] = {
+                "nestedStats": {"selfLink": f"{link}/stats?{VERSION}", "entries": entries_fn(item)}
+            }
+        return {
+            "kind": f"tm:{collection.replace('/', ':')}collectionstats",
+            "selfLink": self._link(collection),
+            "entries": entries,
+        }
+
+    def _node(self, index: int) -> Dict[str, Any]:
+        name = f"srv{index:06d}_node"
+        address = self._address(10, index)
+        state = "down" if index % 50 == 49 else "up"
+        return self._object("ltm/node", self._partition(index), name, address=address, description="", state=state)
+
+    def _node_stats(self, node: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "tmName": {"description": node["fullPath"]},
+            "monitorStatus": {"description": node["state"]},
+            "status.availabilityState": {"description": "available" if node["state"] == "up" else "offline"},
+            "serverside.bitsIn": {"value": 1024},
+            "serverside.bitsOut": {"value": 2048},
+            "serverside.curConns": {"value": 1},
+            "serverside.totConns": {"value": 10},
+        }
+
+    def _pool(self, index: int, nodes: List[Dict[str, Any]]) -> Dict[str, Any]:
+        pool = self._object("ltm/pool", self._partition(index), f"pool{index:06d}", allowNat="yes", allowSnat="yes")
+        link = pool["selfLink"].split("?")[0]
+        members = []
+        for offset in range(min(self.members_per_pool, len(nodes))):
+            node = nodes[(index * self.members_per_pool + offset) % len(nodes)]
+            member = self._object("ltm/pool/members", node["partition"], f"{node['name']}:80")
+            member["selfLink"] = f"{link}/members/{member['fullPath'].replace('/', '~')}?{VERSION}"
+            member.update({"address": node["address"], "state": node["state"], "session": "monitor-enabled"})
+            members.append(member)
+        pool["membersReference"] = {"link": f"{link}/members?{VERSION}", "isSubcollection": True, "items": members}
+        return pool
+
+    def _pool_stats(self, pool: Dict[str, Any]) -> Dict[str, Any]:
+        members = pool["membersReference"]["items"]
+        active = len([m for m in members if m["state"] == "up"])
+        return {
+            "activeMemberCnt": {"value": active},
+            "availableMemberCnt": {"value": active},
+            "memberCnt": {"value": len(members)},
+            "tmName": {"description": pool["fullPath"]},
+            "status.availabilityState": {"description": "available" if active else "offline"},
+            "status.enabledState": {"description": "enabled"},
+            "status.statusReason": {"description": "The pool is available" if active else "No members available"},
+            "serverside.bitsIn": {"value": 128640},
+            "serverside.bitsOut": {"value": 64320},
+            "serverside.curConns": {"value": 0},
+            "serverside.pktsIn": {"value": 300},
+            "serverside.pktsOut": {"value": 200},
+            "serverside.totConns": {"value": 60},
+            "totRequests": {"value": 60},
+            f"{pool['selfLink'].split('?')[0]}/members/stats": {
+                "nestedStats": {"entries": {self._member_stats_link(m): self._member_stats(m) for m in members}}
+            },
+        }
+
+    @staticmethod
+    def _member_stats_link(member: Dict[str, Any]) -> str:
+        return f"{member['selfLink'].split('?')[0]}/stats"
+
+    def _member_stats(self, member: Dict[str, Any]) -> Dict[str, Any]:
+        up = member["state"] == "up"
+        return {
+            "nestedStats": {
+                "entries": {
+                    "addr": {"description": member["address"]},
+                    "nodeName": {"description": member["fullPath"].rsplit(":", 1)[0]},
+                    "poolName": {
+                        "description": member["selfLink"].split("/members/")[0].rsplit("/", 1)[1].replace("~", "/")
+                    },
+                    "port": {"value": 80},
+                    "status.availabilityState": {"description": "available" if up else "offline"},
+                    "status.enabledState": {"description": "enabled"},
+                    "status.statusReason": {"description": "Pool member is available" if up else "Monitor is down"},
+                    "serverside.bitsIn": {"value": 32160},
+                    "serverside.bitsOut": {"value": 16080},
+                    "serverside.curConns": {"value": 0},
+                    "serverside.totConns": {"value": 15},
+                }
+            }
+        }
+
+    def _virtual(self, index: int, pools: List[Dict[str, Any]]) -> Dict[str, Any]:
+        partition = self._partition(index)
+        name = f"app{index:06d}.bench.local_{index:06d}"
+        destination = f"/{partition}/{self._address(192, index)}:443"
+        virtual = self._object("ltm/virtual", partition, name, destination=destination, source="0.0.0.0/0")
+        virtual["ipProtocol"] = "tcp"
+        if pools:
+            virtual["pool"] = pools[index % len(pools)]["fullPath"]
+        if self.rule_every and index % self.rule_every == 0:
+            virtual["rules"] = [f"/{partition}/{name}_ReverseProxy", "/Common/_sys_https_redirect"]
+        return virtual
+
+    def _virtual_stats(self, virtual: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "tmName": {"description": virtual["fullPath"]},
+            "status.availabilityState": {"description": "available"},
+            "clientside.bitsIn": {"value": 4096},
+            "clientside.bitsOut": {"value": 8192},
+            "clientside.curConns": {"value": 2},
+            "clientside.totConns": {"value": 20},
+        }
+
+    def _virtual_address(self, virtual: Dict[str, Any]) -> Dict[str, Any]:
+        name = virtual["destination"].rsplit("/", 1)[1].rsplit(":", 1)[0]
+        return self._object(
+            "ltm/virtual-address",
+            virtual["partition"],
+            name,
+            address=name,
+            trafficGroup="/Common/traffic-group-1",
+            trafficGroupReference={"link": self._link("cm/traffic-group/~Common~traffic-group-1")},
+        )
+
+    def _rule(self, index: int, virtual: Dict[str, Any], pools: List[Dict[str, Any]]) -> Dict[str, Any]:
+        cases = []
+        for offset in range(3):
+            pool = pools[(index + offset) % len(pools)]["fullPath"]
+            cases.append(f'    "/path{offset}/*" {{ HTTP::header replace Host "backend{offset}.local"; pool {pool} }}')
+        header = ["when HTTP_REQUEST {", "  switch -glob -- [string tolower [HTTP::uri]] {"]
+        footer = [f"    default {{ pool {virtual['pool']} }}", "  }", "}"]
+        source = "\n".join([*header, *cases, *footer])
+        name = virtual["rules"][0].rsplit("/", 1)[1]
+        return self._object("ltm/rule", virtual["partition"], name, apiAnonymous=source)
+
+    def _data_group(self, virtual: Dict[str, Any]) -> Dict[str, Any]:
+        host = virtual["name"].split("_")[0]
+        records = [
+            {"name": f"{host}/path{offset}", "data": f"backend{offset}.local/path{offset} {virtual['pool']}"}
+            for offset in range(3)
+        ]
+        name = f"ProxyPass{virtual['name']}"
+        return self._object("ltm/data-group/internal", virtual["partition"], name, type="string", records=records)
+
+    def _interface(self, index: int) -> Dict[str, Any]:
+        name = f"1.{index + 1}"
+        mac = f"00:0c:29:00:{(index >> 8) & 255:02x}:{index & 255:02x}"
+        return self._object("net/interface", "", name, enabled=True, macAddress=mac, mediaActive="10000T-FD")
+
+    def _interface_stats(self, interface: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "counters.bitsIn": {"value": 632096},
+            "counters.bitsOut": {"value": 142112},
+            "counters.dropsAll": {"value": 0},
+            "counters.errorsAll": {"value": 0},
+            "counters.pktsIn": {"value": 386},
+            "counters.pktsOut": {"value": 282},
+            "tmName": {"description": interface["name"]},
+            "status": {"description": "up"},
+        }
+
+    def _vlan(self, index: int, interfaces: List[Dict[str, Any]]) -> Dict[str, Any]:
+        vlan = self._object("net/vlan", "Common", f"vlan{index}", tag=100 + index, mtu=1500)
+        members = [
+            {"name": i["name"], "fullPath": i["name"], "tagMode": "none", "untagged": True}
+            for position, i in enumerate(interfaces)
+            if position % max(self.vlans, 1) == index
+        ]
+        link = vlan["selfLink"].split("?")[0]
+        vlan["interfacesReference"] = {
+            "link": f"{link}/interfaces?{VERSION}",
+            "isSubcollection": True,
+            "items": members,
+        }
+        return vlan
+
+    def _self_ip(self, vlan: Dict[str, Any]) -> Dict[str, Any]:
+        index = vlan["tag"] - 100
+        return self._object(
+            "net/self",
+            "Common",
+            f"self_{vlan['name']}",
+            address=f"{self._address(172, index)}/24",
+            trafficGroup="/Common/traffic-group-1",
+            trafficGroupReference={"link": self._link("cm/traffic-group/~Common~traffic-group-1")},
+            vlan=vlan["fullPath"],
+            vlanReference={"link": self._link(f"net/vlan/~Common~{vlan['name']}")},
+            type="self",
+        )
+
+    def _device(self) -> Dict[str, Any]:
+        return self._object(
+            "cm/device",
+            "Common",
+            self.device_name,
+            activeModules=["BIG-IP, VE"],
+            build="0.0.12",
+            cert="/Common/dtdi.crt",
+            failoverState="active",
+            hostname=self.device_name,
+            managementIp="172.16.0.1",
+            marketingName="BIG-IP Virtual Edition",
+            product="BIG-IP",
+            selfDevice="true",
+            timeZone="UTC",
+            version="16.1.3",
+        )
+
+    def _device_group(self) -> Dict[str, Any]:
+        group = self._object("cm/device-group", "Common", "device_trust_group", type="sync-only")
+        device = self._object("cm/device-group/devices", "Common", self.device_name)
+        link = group["selfLink"].split("?")[0]
+        group["devicesReference"] = {"link": f"{link}/devices?{VERSION}", "isSubcollection": True, "items": [device]}
+        return group
+
+    def _traffic_group_stats(self, traffic_groups: List[str]) -> Dict[str, Any]:
+        entries = {}
+        for name in traffic_groups:
+            link = f"{LOCAL_URL}mgmt/tm/cm/traffic-group/~Common~{name}:~Common~{self.device_name}/stats"
+            stats = {
+                "deviceName": {"description": f"/Common/{self.device_name}"},
+                "failoverState": {"description": "active"},
+                "trafficGroup": {"description": f"/Common/{name}"},
+            }
+            entries[link] = {"nestedStats": {"selfLink": f"{link}?{VERSION}", "entries": stats}}
+        return {"kind": "tm:cm:traffic-group:traffic-groupcollectionstats", "entries": entries}
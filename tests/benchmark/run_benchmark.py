@@ -0,0 +1,162 @@
+"""
+Runs F5Check.check against a stand-in BIG-IP serving synthetic responses and reports the wall time, the time spent
+per F5 endpoint and template query, the peak RSS and the request counts of every run.
+
+    python tests/benchmark/run_benchmark.py --nodes 50000 --pools 20000 --virtuals 20000 --latency-ms 50
+    python tests/benchmark/run_benchmark.py --f5 transport=async --f5 infer_select=true --runs 3
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+PROJECT_DIR = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(PROJECT_DIR / "src"))
+sys.path.insert(0, str(PROJECT_DIR / "tests"))
+
+import requests  # noqa: E402
+import yaml  # noqa: E402
+
+from benchmark.server import CONTROL_PREFIX, serve  # noqa: E402
+
+
+def main(argv: List[str] = None):
+    args = parse_args(argv)
+    fixture_args = {
+        "nodes": args.nodes,
+        "pools": args.pools,
+        "members_per_pool": args.members_per_pool,
+        "virtuals": args.virtuals,
+        "partitions": args.partitions,
+        "interfaces": args.interfaces,
+        "vlans": args.vlans,
+        "rule_every": args.rule_every,
+    }
+    url_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=serve, args=(fixture_args, args.latency_ms / 1000.0, args.jitter_ms / 1000.0, url_queue), daemon=True
+    )
+    server.start()
+    try:
+        url = url_queue.get(timeout=600)
+        print(f"Stand-in BIG-IP at {url} with {json.dumps(fixture_args)}, latency {args.latency_ms}ms")
+        results = [run_check(url, args.f5, run) for run in range(1, args.runs + 1)]
+    finally:
+        server.terminate()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+def run_check(url: str, f5_options: List[str], run: int) -> Dict[str, Any]:
+    from stackstate_checks.stubs import aggregator, topology
+
+    from f5 import F5Check
+    from sts_f5_impl.client import F5Client
+    from sts_f5_impl.model.instance import InstanceInfo
+
+    topology.reset()
+    aggregator.reset()
+    requests.get(f"{url}{CONTROL_PREFIX}reset")
+    instance_dict = benchmark_instance(url, f5_options)
+    check = F5Check("f5", {}, {}, instances=[instance_dict])
+    check._init_health_api()
+    instance = InstanceInfo(instance_dict)
+    instance.validate()
+
+    start = time.perf_counter()
+    check.check(instance)
+    wall_seconds = time.perf_counter() - start
+    client = F5Client.for_instance(instance, check.log)
+
+    counts = requests.get(f"{url}{CONTROL_PREFIX}counts").json()
+    snapshot = topology.get_snapshot("")
+    result = {
+        "run": run,
+        "wall_seconds": round(wall_seconds, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "requests": sum(counts["requests"].values()),
+        "response_mb": round(sum(counts["bytes"].values()) / 1024 / 1024, 2),
+        "components": len(snapshot["components"]),
+        "relations": len(snapshot["relations"]),
+        "metrics": len(aggregator.metric_names),
+        "endpoints": {
+            endpoint: {
+                "requests": stats.requests,
+                "seconds": round(stats.seconds, 3),
+                "decode_seconds": round(stats.decode_seconds, 3),
+                "kb": round(stats.bytes / 1024, 1),
+            }
+            for endpoint, stats in client.run_stats.endpoints.items()
+        },
+        "queries": {
+            query: {
+                "fetch_seconds": round(stats.fetch_seconds, 3),
+                "processing_seconds": round(stats.processing_seconds, 3),
+            }
+            for query, stats in client.run_stats.queries.items()
+        },
+    }
+    report(result)
+    return result
+
+
+def benchmark_instance(url: str, f5_options: List[str]) -> Dict[str, Any]:
+    with open(PROJECT_DIR / "src/data/conf.d/f5.d/conf.yaml.example") as f:
+        instance_dict = yaml.safe_load(f)["instances"][0]
+    instance_dict["instance_url"] = "benchmark"
+    instance_dict["f5"]["url"] = url
+    for option in f5_options:
+        key, _, value = option.partition("=")
+        instance_dict["f5"][key] = yaml.safe_load(value)
+    return instance_dict
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1024 / 1024 if sys.platform == "darwin" else max_rss / 1024
+
+
+def report(result: Dict[str, Any]):
+    print(
+        f"Run {result['run']}: {result['wall_seconds']}s, peak RSS {result['peak_rss_mb']}MB, "
+        f"{result['requests']} requests, {result['response_mb']}MB received, {result['components']} components, "
+        f"{result['relations']} relations, {result['metrics']} metric names"
+    )
+    for name, endpoint in sorted(result["endpoints"].items(), key=lambda e: -e[1]["seconds"]):
+        print(
+            f"  {name:<40} {endpoint['requests']:>5} requests {endpoint['seconds']:>9.3f}s "
+            f"decode {endpoint['decode_seconds']:>8.3f}s {endpoint['kb']:>12.1f}KB"
+        )
+    for name, query in sorted(result["queries"].items(), key=lambda q: -q[1]["processing_seconds"]):
+        print(
+            f"  query {name:<34} fetch {query['fetch_seconds']:>9.3f}s processing {query['processing_seconds']:>9.3f}s"
+        )
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark F5Check.check against a synthetic BIG-IP.")
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--pools", type=int, default=500)
+    parser.add_argument("--members-per-pool", type=int, default=4)
+    parser.add_argument("--virtuals", type=int, default=500)
+    parser.add_argument("--partitions", type=int, default=1)
+    parser.add_argument("--interfaces", type=int, default=8)
+    parser.add_argument("--vlans", type=int, default=4)
+    parser.add_argument("--rule-every", type=int, default=5, help="Every n-th virtual server has an iRule")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latency added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random latency added on top of --latency-ms")
+    parser.add_argument("--runs", type=int, default=2, help="Consecutive check runs, to include warm runs")
+    parser.add_argument("--f5", action="append", default=[], help="Override an f5 option, e.g. prefetch=false")
+    parser.add_argument("--json", help="Also write the results to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from benchmark.fixtures import LOCAL_URL, SyntheticBigIp
+
+TOKEN = "BENCHMARKTOKEN"
+# Requests to these paths are not counted and report or reset the counts of a stand-in running in another process.
+CONTROL_PREFIX = "_benchmark/"
+
+
+class StandInBigIp(object):
+    """
+    Serves synthetic iControl REST responses over http on localhost, with an injectable latency per request.
+    Supports the login and token endpoints, single objects by full path, `$select`, `$top`/`$skip` paging with a
+    `nextLink` and `expandSubcollections`. Counts the requests and response bytes per path, and the most requests
+    in flight at once. Failures can be injected per path with `fail`.
+    """
+
+    def __init__(self, responses: Dict[str, Dict[str, Any]], latency_seconds: float = 0.0, jitter_seconds: float = 0.0):
+        self.responses = responses
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.request_counts: Counter = Counter()
+        self.response_bytes: Counter = Counter()
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._failures: Dict[str, List[int]] = {}
+        self._objects = self._index_objects(responses)
+        self._encoded: Dict[Tuple[str, str], bytes] = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/"
+
+    def start(self) -> "StandInBigIp":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stand-in-bigip", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def fail(self, path: str, *statuses: int):
+        """Replies to the next requests to the path with the statuses, one per request, like 503 or 401."""
+        with self._lock:
+            self._failures.setdefault(path, []).extend(statuses)
+
+    def reset_counts(self):
+        with self._lock:
+            self.request_counts.clear()
+            self.response_bytes.clear()
+
+    def __enter__(self) -> "StandInBigIp":
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @staticmethod
+    def _index_objects(responses: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        objects = {}
+        for response in responses.values():
+            for item in response.get("items", []):
+                objects[urlsplit(item["selfLink"]).path.lstrip("/")] = item
+        return objects
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                stand_in._reply(self, "mgmt/shared/authn/login", lambda: {"token": {"token": TOKEN, "timeout": 1200}})
+
+            def do_PATCH(self):
+                path = urlsplit(self.path).path.lstrip("/")
+                stand_in._reply(self, path, lambda: {"token": TOKEN, "timeout": 3600})
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                path = parts.path.lstrip("/")
+                if path.startswith(CONTROL_PREFIX):
+                    return stand_in._control(self, path[len(CONTROL_PREFIX) :])
+                stand_in._reply(self, path, lambda: stand_in._get(path, parts.query), parts.query)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _reply(self, handler: BaseHTTPRequestHandler, path: str, body_fn, query: str = ""):
+        with self._lock:
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            failures = self._failures.get(path)
+            status = failures.pop(0) if failures else None
+        try:
+            delay = self.latency_seconds + random.uniform(0, self.jitter_seconds)
+            if delay > 0:
+                time.sleep(delay)
+            if status is None:
+                self._reply_body(handler, path, body_fn, query)
+            else:
+                self._send(handler, path, status, json.dumps({"code": status}).encode("utf-8"))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _reply_body(self, handler: BaseHTTPRequestHandler, path: str, body_fn, query: str):
+        body = self._encoded.get((path, query))
+        if body is None:
+            result = body_fn()
+            body = json.dumps(result).encode("utf-8") if result is not None else b""
+            if handler.command == "GET" and result is not None:
+                self._encoded[(path, query)] = body
+        self._send(handler, path, 200 if body else 404, body)
+
+    def _send(self, handler: BaseHTTPRequestHandler, path: str, status: int, body: bytes):
+        with self._lock:
+            self.request_counts[path] += 1
+            self.response_bytes[path] += len(body)
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _control(self, handler: BaseHTTPRequestHandler, command: str):
+        with self._lock:
+            body = json.dumps({"requests": self.request_counts, "bytes": self.response_bytes}).encode("utf-8")
+            if command == "reset":
+                self.request_counts.clear()
+                self.response_bytes.clear()
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _get(self, path: str, query: str) -> Optional[Dict[str, Any]]:
+        params = {k: v[0] for k, v in parse_qs(query).items()}
+        response = self.responses.get(path)
+        if response is None:
+            item = self._objects.get(path)
+            return self._select(self._collapse(item, params), params) if item is not None else None
+        if "items" not in response:
+            return self._collapse_stats(response, params)
+        items = [self._select(self._collapse(item, params), params) for item in response["items"]]
+        result = dict(response)
+        if "$top" in params:
+            skip, top = int(params.get("$skip", 0)), int(params["$top"])
+            if skip + top < len(items):
+                next_params = "&".join(f"{k}={v}" for k, v in {**params, "$skip": skip + top}.items())
+                result["nextLink"] = f"{LOCAL_URL}{path}?{next_params}"
+            items = items[skip : skip + top]
+        result["items"] = items
+        return result
+
+    @staticmethod
+    def _collapse(item: Dict[str, Any], params: Dict[str, str]) -> Dict[str, Any]:
+        if params.get("expandSubcollections") == "true":
+            return item
+        # Without expandSubcollections only the link of a subcollection is returned.
+        return {
+            k: {"link": v["link"], "isSubcollection": True} if isinstance(v, dict) and v.get("isSubcollection") else v
+            for k, v in item.items()
+        }
+
+    @staticmethod
+    def _collapse_stats(response: Dict[str, Any], params: Dict[str, str]) -> Dict[str, Any]:
+        if params.get("expandSubcollections") == "true" or "entries" not in response:
+            return response
+        # Without expandSubcollections the stats of subcollections, like pool members, are left out.
+        entries = {}
+        for link, stats in response["entries"].items():
+            nested = stats["nestedStats"]
+            nested_entries = {k: v for k, v in nested["entries"].items() if "nestedStats" not in v}
+            entries[link] = {"nestedStats": dict(nested, entries=nested_entries)}
+        return dict(response, entries=entries)
+
+    @staticmethod
+    def _select(item: Dict[str, Any], params: Dict[str, str]) -> Dict[str, Any]:
+        if "$select" not in params:
+            return item
+        fields = set(params["$select"].split(","))
+        return {k: v for k, v in item.items() if k in fields}
+
+
+def serve(fixture_args: Dict[str, Any], latency_seconds: float, jitter_seconds: float, url_queue):
+    """
+    Runs a stand-in for a synthetic BIG-IP until the process is terminated, so generating and serving the responses
+    does not add to the time and memory measured in the benchmark process. Puts the url on the queue when ready.
+    """
+    stand_in = StandInBigIp(SyntheticBigIp(**fixture_args).responses(), latency_seconds, jitter_seconds)
+    url_queue.put(stand_in.url)
+    stand_in.serve_forever()
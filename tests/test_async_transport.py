@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import threading
+
+import pytest
+from benchmark.fixtures import SyntheticBigIp
+from benchmark.server import StandInBigIp
+
+from sts_f5_impl.client import F5Client, async_transport
+from sts_f5_impl.model.instance import F5Spec
+
+pytest.importorskip("aiohttp")
+
+logger = logging.getLogger("stackstate_checks.base.checks.base.f5async")
+
+
+@pytest.fixture
+def stand_in():
+    with StandInBigIp(SyntheticBigIp(nodes=10, pools=5, virtuals=5).responses()) as server:
+        yield server
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    delays = []
+    sleep = asyncio.sleep
+
+    async def record_sleep(delay):
+        delays.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(async_transport.asyncio, "sleep", record_sleep)
+    return delays
+
+
+def setup_client(server: StandInBigIp, **spec_overrides) -> F5Client:
+    spec = F5Spec({"url": server.url, "username": "admin", "password": "admin", "transport": "async", **spec_overrides})
+    spec.validate()
+    client = F5Client(spec, logger)
+    client.start_run()
+    return client
+
+
+def test_retries_on_status_with_exponential_backoff(stand_in, backoffs):
+    client = setup_client(stand_in, retry_backoff_seconds=1, max_request_retries=3)
+    stand_in.fail("mgmt/tm/ltm/node", 503, 502)
+    try:
+        assert len(client.get_ltm_object("node")["items"]) == 10
+    finally:
+        client.close()
+
+    assert backoffs == [1, 2]
+    assert stand_in.request_counts["mgmt/tm/ltm/node"] == 3
+    assert client.run_stats.endpoints["ltm/node"].retries == 2
+
+
+def test_gives_up_after_max_request_retries(stand_in, backoffs):
+    client = setup_client(stand_in, retry_backoff_seconds=1, max_request_retries=2)
+    stand_in.fail("mgmt/tm/ltm/node", 503, 503, 503)
+    try:
+        with pytest.raises(Exception, match="503"):
+            client.get_ltm_object("node")
+    finally:
+        client.close()
+
+    assert backoffs == [1, 2]
+    assert stand_in.request_counts["mgmt/tm/ltm/node"] == 3
+
+
+def test_get_all_keeps_request_order_within_connector_limit():
+    responses = SyntheticBigIp(nodes=10, pools=5, virtuals=5).responses()
+    with StandInBigIp(responses, latency_seconds=0.02, jitter_seconds=0.05) as server:
+        client = setup_client(server, max_concurrent_requests=2)
+        paths = ["mgmt/tm/ltm/node", "mgmt/tm/ltm/pool", "mgmt/tm/ltm/virtual", "mgmt/tm/ltm/rule"] * 2
+        try:
+            results = client._transport.get_all([(f"{server.url}{path}", None) for path in paths])
+        finally:
+            client.close()
+
+    assert [result.url for result in results] == [f"{server.url}{path}" for path in paths]
+    assert [len(result.json()["items"]) for result in results[:3]] == [10, 5, 5]
+    assert 1 < server.max_in_flight <= 2
+
+
+def test_prefetch_logs_in_again_on_401_with_the_sync_path(stand_in):
+    client = setup_client(stand_in)
+    # The bulk request and the first synchronous retry are rejected, the retry after the new login succeeds.
+    stand_in.fail("mgmt/tm/ltm/pool/stats", 401, 401)
+    try:
+        stats = client.get_stats_batch(["ltm/pool", "ltm/virtual"])
+    finally:
+        client.close()
+
+    assert len(stats["ltm/pool"]) == 5
+    assert len(stats["ltm/virtual"]) == 5
+    assert stand_in.request_counts["mgmt/shared/authn/login"] == 2
+    assert stand_in.request_counts["mgmt/tm/ltm/pool/stats"] == 3
+    assert stand_in.request_counts["mgmt/tm/ltm/virtual/stats"] == 1
+
+
+def test_prefetch_records_the_bulk_requests_in_run_stats(stand_in, backoffs):
+    client = setup_client(stand_in)
+    stand_in.fail("mgmt/tm/ltm/virtual/stats", 503)
+    try:
+        client.get_stats_batch(["ltm/pool", "ltm/virtual"])
+    finally:
+        client.close()
+
+    pool_stats = client.run_stats.endpoints["ltm/pool/stats"]
+    assert pool_stats.requests == 1
+    assert pool_stats.bytes == stand_in.response_bytes["mgmt/tm/ltm/pool/stats"]
+    assert pool_stats.seconds > 0
+    assert client.run_stats.endpoints["ltm/virtual/stats"].retries == 1
+
+
+def test_prefetch_goes_through_the_throttle(stand_in):
+    client = setup_client(stand_in, adaptive_throttling=True)
+    recorded = []
+    record = client._throttle.record
+
+    def record_endpoint(endpoint, seconds, failed):
+        recorded.append(endpoint)
+        record(endpoint, seconds, failed)
+
+    client._throttle.record = record_endpoint
+    client._transport.get_all = pytest.fail
+    try:
+        client.get_stats_batch(["ltm/pool", "ltm/virtual"])
+    finally:
+        client.close()
+
+    assert sorted(recorded) == ["ltm/pool/stats", "ltm/virtual/stats"]
+
+
+def test_prefetch_waits_for_the_request_slots_of_a_fleet(stand_in):
+    client = setup_client(stand_in)
+    client._request_slots = threading.BoundedSemaphore(1)
+    client._transport.get_all = pytest.fail
+    try:
+        stats = client.get_stats_batch(["ltm/pool", "ltm/virtual"])
+    finally:
+        client.close()
+
+    assert len(stats["ltm/pool"]) == 5
+    assert stand_in.max_in_flight == 1
@@ -0,0 +1,45 @@
+import logging
+
+from benchmark.fixtures import SyntheticBigIp
+from benchmark.server import StandInBigIp
+
+from sts_f5_impl.client import F5Client
+from sts_f5_impl.model.instance import F5Spec
+
+logger = logging.getLogger("stackstate_checks.base.checks.base.f5benchmark")
+
+
+def test_synthetic_responses_are_referentially_consistent():
+    responses = SyntheticBigIp(nodes=20, pools=10, members_per_pool=3, virtuals=10, partitions=3).responses()
+
+    nodes = {node["fullPath"] for node in responses["mgmt/tm/ltm/node"]["items"]}
+    pools = {pool["fullPath"] for pool in responses["mgmt/tm/ltm/pool"]["items"]}
+    rules = {rule["fullPath"] for rule in responses["mgmt/tm/ltm/rule"]["items"]}
+    for pool in responses["mgmt/tm/ltm/pool"]["items"]:
+        assert {m["fullPath"].rsplit(":", 1)[0] for m in pool["membersReference"]["items"]}.issubset(nodes)
+    for virtual in responses["mgmt/tm/ltm/virtual"]["items"]:
+        assert virtual["pool"] in pools
+        assert set(virtual.get("rules", [])).issubset(rules)
+    assert len(responses["mgmt/tm/ltm/pool/stats"]["entries"]) == 10
+    assert {n["partition"] for n in responses["mgmt/tm/ltm/node"]["items"]} == {"Common", "Tenant1", "Tenant2"}
+
+
+def test_stand_in_serves_pages_objects_and_counts_requests():
+    responses = SyntheticBigIp(nodes=25, pools=5, virtuals=5).responses()
+    with StandInBigIp(responses) as stand_in:
+        spec = F5Spec({"url": stand_in.url, "username": "admin", "password": "admin", "page_size": 10})
+        spec.validate()
+        client = F5Client(spec, logger)
+        client.start_run()
+
+        assert len(list(client.iter_ltm_object("node"))) == 25
+        pools = client.get_ltm_object("pool", expand_subcollections=True, select=["fullPath", "membersReference"])
+        assert set(pools["items"][0]) == {"fullPath", "membersReference"}
+        assert len(pools["items"][0]["membersReference"]["items"]) == 4
+        assert "items" not in client.get_ltm_object("pool")["items"][0]["membersReference"]
+        assert client.get_rule("_sys_https_redirect").startswith("when HTTP_REQUEST")
+        assert "members" not in client.get_ltm_object_stats("pool")[0]
+        assert len(client.get_ltm_pool_member_stats()) == 20
+
+    assert stand_in.request_counts["mgmt/tm/ltm/node"] == 3
+    assert stand_in.request_counts["mgmt/tm/ltm/pool"] == 2
@@ -4,8 +4,10 @@ from typing import List, Dict, Any
 
 from sts_f5_impl.model.instance import InstanceInfo
 from sts_f5_impl.client import F5Client
+import f5
 from f5 import F5Check
 
+from stackstate_checks.base import AgentCheck
 from stackstate_checks.stubs import topology, health, aggregator
 import yaml
 import logging
@@ -43,7 +45,50 @@ def test_check(m: requests_mock.Mocker = None):
     assert len(components) == 23, "Number of Components does not match"
     assert len(relations) == 20, "Number of Relations does not match"
     assert len(health_check_states) == 7, "Number of Health does not match"
-    assert len(metric_names) == 3, "Number of Metrics does not match"
+    assert len(metric_names) == 4, "Number of Metrics does not match"
+
+
+class SnapshotProcessor(object):
+    """Stands in for the AgentProcessor, sending the same component in a snapshot every run."""
+
+    def __init__(self, instance, check):
+        self.check = check
+
+    def process(self):
+        self.check.start_snapshot()
+        self.check.component("urn:f5:node:/Common/10.0.0.1", "f5-node", {"name": "10.0.0.1"})
+        self.check.stop_snapshot()
+
+
+def run_snapshot_checks(monkeypatch, m: requests_mock.Mocker, runs: int, **instance_overrides) -> List[List[str]]:
+    instance_dict = dict(setup_test_instance(), **instance_overrides)
+    instance = InstanceInfo(instance_dict)
+    instance.validate()
+    with open("tests/resources/responses/authn_login.json") as f:
+        m.register_uri("POST", f"{instance.f5.url}/mgmt/shared/authn/login", json=json.load(f))
+    check = F5Check("f5", {}, {}, instances=[instance_dict])
+    snapshots: List[str] = []
+    monkeypatch.setattr(f5, "AgentProcessor", SnapshotProcessor)
+    monkeypatch.setattr(AgentCheck, "start_snapshot", lambda self: snapshots.append("start"))
+    monkeypatch.setattr(AgentCheck, "stop_snapshot", lambda self: snapshots.append("stop"))
+    result = []
+    for _ in range(runs):
+        check.check(instance)
+        result.append(list(snapshots))
+        snapshots.clear()
+    return result
+
+
+@requests_mock.Mocker(kw="m")
+def test_incremental_delta_runs_send_no_snapshot(monkeypatch, m: requests_mock.Mocker = None):
+    runs = run_snapshot_checks(monkeypatch, m, 3, delta_topology=True, full_topology_interval=3600)
+    assert runs == [["start", "stop"], [], []], "Only the full run sends a snapshot, only once"
+
+
+@requests_mock.Mocker(kw="m")
+def test_telemetry_runs_send_no_topology_snapshot(monkeypatch, m: requests_mock.Mocker = None):
+    runs = run_snapshot_checks(monkeypatch, m, 3, topology_collection_interval=600)
+    assert runs == [["start", "stop"], [], []], "Runs between topology refreshes keep the topology"
 
 
 def _setup_request_mocks(instance, m):
@@ -0,0 +1,917 @@
+import json
+import logging
+import os
+import time
+
+import pytest
+import requests_mock
+import yaml
+
+from sts_f5_impl.client import F5Client, F5FleetClient
+from sts_f5_impl.client.generation_cache import GenerationCache
+from sts_f5_impl.client.json_decoder import CollectionStream
+from sts_f5_impl.client.partition_filter import PartitionFilter
+from sts_f5_impl.client.query_schedule import QuerySchedule
+from sts_f5_impl.client.template_scanner import CollectionRef, TemplateScanner
+from sts_f5_impl.model.instance import F5Spec, InstanceInfo
+from sts_f5_impl.topology_delta import TopologyDelta
+
+logging.basicConfig()
+logger = logging.getLogger("stackstate_checks.base.checks.base.f5client")
+logger.setLevel(logging.INFO)
+
+F5_URL = "https://f5.local/"
+
+
+def response(file_name):
+    with open(f"tests/resources/responses/{file_name}.json") as f:
+        return json.load(f)
+
+
+def setup_client(m: requests_mock.Mocker, template_refs=None, **spec_overrides) -> F5Client:
+    spec = F5Spec({"url": F5_URL, "username": "admin", "password": "admin", **spec_overrides})
+    spec.validate()
+    m.register_uri("POST", f"{F5_URL}mgmt/shared/authn/login", json=response("authn_login"))
+    return F5Client(spec, logger, template_refs)
+
+
+@requests_mock.Mocker(kw="m")
+def test_duplicate_collection_fetches_are_served_from_run_cache(m: requests_mock.Mocker = None):
+    client = setup_client(m)
+    pools = m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool", json=response("pool"))
+
+    client.start_run()
+    first = client.get_ltm_object("pool")
+    second = client.get_ltm_object("pool")
+    assert first is second
+    assert pools.call_count == 1
+    client.get_ltm_object("pool", expand_subcollections=True)
+    assert pools.call_count == 2, "Expanded collection is cached under its own key"
+
+    client.start_run()
+    client.get_ltm_object("pool")
+    assert pools.call_count == 3, "Cache is reset at the start of each run"
+
+
+@requests_mock.Mocker(kw="m")
+def test_prefetch_collections_used_by_templates(tmp_path, m: requests_mock.Mocker = None):
+    template = tmp_path / "010_pools.yaml"
+    template.write_text("""
+etl:
+  queries:
+    - name: f5_pools
+      query: "f5.get_ltm_object('pool', expand_subcollections=True)['items']"
+    - name: f5_pool_status
+      query: "f5.get_ltm_object_stats('pool')"
+""")
+    client = setup_client(m, [str(tmp_path)])
+    pools = m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool", json=response("pool"))
+    pool_stats = m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool/stats", json=response("pool_stats"))
+
+    client.start_run()
+    client.get_ltm_object_stats("pool")
+    assert pools.call_count == 1
+    assert pools.last_request.qs == {"expandsubcollections": ["true"]}
+    assert pool_stats.call_count == 1
+    client.get_ltm_object("pool", expand_subcollections=True)
+    assert pools.call_count == 1
+
+
+@requests_mock.Mocker(kw="m")
+def test_relogin_when_token_is_rejected(m: requests_mock.Mocker = None):
+    client = setup_client(m)
+    login = m.register_uri("POST", f"{F5_URL}mgmt/shared/authn/login", json=response("authn_login"))
+    pools = m.register_uri(
+        "GET", f"{F5_URL}mgmt/tm/ltm/pool", [{"status_code": 401, "json": {}}, {"json": response("pool")}]
+    )
+
+    client.start_run()
+    assert len(client.get_ltm_object("pool")["items"]) > 0
+    assert pools.call_count == 2
+    assert login.call_count == 1
+
+
+@requests_mock.Mocker(kw="m")
+def test_token_is_extended_before_it_expires(m: requests_mock.Mocker = None):
+    client = setup_client(m)
+    token = response("authn_login")["token"]
+    extend = m.register_uri("PATCH", f"{F5_URL}mgmt/shared/authz/tokens/{token['token']}", json=token)
+
+    client.start_run()
+    assert extend.call_count == 0
+    client._token_expires_at = 0
+    client.start_run()
+    assert extend.call_count == 1
+    assert extend.last_request.json() == {"timeout": client.spec.token_timeout_seconds}
+
+
+@requests_mock.Mocker(kw="m")
+def test_token_expiry_is_taken_from_the_token(m: requests_mock.Mocker = None):
+    client = setup_client(m)
+    token = response("authn_login")["token"]
+    extended = dict(token, expirationMicros=int((time.time() + 60) * 1e6))
+    extend = m.register_uri("PATCH", f"{F5_URL}mgmt/shared/authz/tokens/{token['token']}", json=extended)
+
+    client.start_run()
+    assert client._token_expires_at == token["expirationMicros"] / 1e6
+    client._token_expires_at = 0
+    client.start_run()
+    assert client._token_expires_at == extended["expirationMicros"] / 1e6
+    client.start_run()
+    assert extend.call_count == 2, "The token expires within the refresh window, so it is extended again"
+
+
+@requests_mock.Mocker(kw="m")
+def test_iterate_collection_one_page_at_a_time(m: requests_mock.Mocker = None):
+    client = setup_client(m, page_size=2)
+    items = [{"name": f"node{i}"} for i in range(5)]
+
+    def page(request, context):
+        top, skip = int(request.qs["$top"][0]), int(request.qs["$skip"][0])
+        result = {"items": items[skip : skip + top]}
+        if skip + top < len(items):
+            result["nextLink"] = f"https://localhost/mgmt/tm/ltm/node?$top={top}&$skip={skip + top}&ver=16.1.3"
+        return result
+
+    nodes = m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/node", json=page)
+
+    client.start_run()
+    result = client.iter_ltm_object("node")
+    assert nodes.call_count == 0, "Pages are only fetched when iterated"
+    assert [item["name"] for item in result] == [item["name"] for item in items]
+    assert nodes.call_count == 3
+
+
+def test_collection_stream_decodes_items_one_at_a_time():
+    content = b"""{"kind": "tm:ltm:pool:poolcollectionstate", "items" : [
+        {"name": "a", "membersReference": {"items": [{"name": "m"}]}} ,
+        {"name": "b, ]}"}
+      ], "nextLink": "https://localhost/mgmt/tm/ltm/pool?$skip=2"}"""
+    stream = CollectionStream(content)
+    items = iter(stream)
+
+    assert next(items)["membersReference"]["items"] == [{"name": "m"}]
+    assert "nextLink" not in stream.fields, "Fields after the items are decoded when the items are consumed"
+    assert [item["name"] for item in items] == ["b, ]}"]
+    assert stream.fields == {
+        "kind": "tm:ltm:pool:poolcollectionstate",
+        "nextLink": "https://localhost/mgmt/tm/ltm/pool?$skip=2",
+    }
+    assert list(CollectionStream(b'{"items": []}')) == []
+
+
+@requests_mock.Mocker(kw="m")
+def test_select_fields_inferred_from_templates(tmp_path, m: requests_mock.Mocker = None):
+    template = tmp_path / "030_nodes.yaml"
+    template.write_text("""
+etl:
+  queries:
+    - name: f5_hosts
+      query: "f5.get_ltm_object('node')['items']"
+      template_refs:
+        - f5_node_template
+  template:
+    components:
+      - name: f5_node_template
+        spec:
+          name: "$.name"
+          uid: "|uid('f5', 'node', item['fullPath'])"
+          labels:
+            - "|'address:%s' % item.get('address')"
+""")
+    client = setup_client(m, [str(tmp_path)], infer_select=True, prefetch=False)
+    nodes = m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/node", json=response("node"))
+
+    client.start_run()
+    client.get_ltm_object("node")
+    assert nodes.last_request.qs["$select"] == ["address,fullpath,generation,name,partition,selflink"]
+    client.get_ltm_object("node", select=["name", "state"])
+    assert nodes.last_request.qs["$select"] == ["name,state"]
+
+
+@requests_mock.Mocker(kw="m")
+def test_unchanged_incremental_collection_is_not_fetched_again(m: requests_mock.Mocker = None):
+    client = setup_client(m, incremental_collections=["ltm/virtual"])
+    virtuals = response("virtual")
+    virtual = m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/virtual", json=virtuals)
+
+    client.start_run()
+    client.get_ltm_object("virtual")
+    assert virtual.call_count == 1
+
+    client.start_run()
+    assert client.get_ltm_object("virtual") == virtuals
+    assert virtual.call_count == 2
+    assert "$select" in virtual.last_request.qs, "Only the generations are probed"
+
+    virtuals["items"][0]["generation"] += 1
+    client.start_run()
+    client.get_ltm_object("virtual")
+    assert virtual.call_count == 4
+    assert "$select" not in virtual.last_request.qs
+
+
+@requests_mock.Mocker(kw="m")
+def test_stats_batch(m: requests_mock.Mocker = None):
+    client = setup_client(m)
+    pool_stats = m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool/stats", json=response("pool_stats"))
+    interface_stats = m.register_uri("GET", f"{F5_URL}mgmt/tm/net/interface/stats", json=response("interface_stats"))
+
+    client.start_run()
+    stats = client.get_stats_batch(["ltm/pool", "net/interface"])
+    assert len(stats["ltm/pool"]) > 0
+    assert len(stats["net/interface"]) > 0
+    client.get_ltm_object_stats("pool")
+    assert pool_stats.call_count == 1
+    assert interface_stats.call_count == 1
+
+
+@requests_mock.Mocker(kw="m")
+def test_compact_stats_keep_the_stat_keys_read_by_templates(m: requests_mock.Mocker = None):
+    client = setup_client(m, ["module_dir://sts_f5_impl.templates"], compact_stats=True, prefetch=False)
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool/stats", json=response("pool_stats"))
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/net/interface/stats", json=response("interface_stats"))
+
+    client.start_run()
+    pool = client.get_ltm_object_stats("pool")[0]
+    assert pool["name"] == "WebServers_Pool"
+    assert pool["partition"] == "Common"
+    assert pool.value("activeMemberCnt") == 1
+    assert pool["entries"]["status.availabilityState"] == {"description": "available"}
+    assert "connqAll.ageEdm" not in pool["entries"]
+    assert client.get_ltm_object_stats("pool")[0] is pool
+
+    other_pool = client._stats_parser.parse(
+        response("pool_stats"), client.get_stat_keys(f"{F5_URL}mgmt/tm/ltm/pool/stats")
+    )[0]
+    assert other_pool["entries"]._schema is pool["entries"]._schema
+    interface = client.get_net_object_stats("interface")[0]
+    assert sorted(interface["entries"]) == [
+        "counters.bitsIn",
+        "counters.bitsOut",
+        "counters.pktsIn",
+        "counters.pktsOut",
+        "status",
+    ]
+
+
+@requests_mock.Mocker(kw="m")
+def test_pool_member_stats_from_one_expanded_call(m: requests_mock.Mocker = None):
+    pool_stats = m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool/stats", json=response("pool_stats_expanded"))
+    for compact_stats in [False, True]:
+        client = setup_client(m, ["module_dir://sts_f5_impl.templates"], compact_stats=compact_stats, prefetch=False)
+        client.start_run()
+        members = client.get_ltm_pool_member_stats()
+        assert pool_stats.last_request.qs["expandsubcollections"] == ["true"]
+        assert [(m["name"], m["partition"], m["pool"]) for m in members] == [
+            ("10.0.0.1:80", "Common", "/Common/WebServers_Pool"),
+            ("10.0.0.2:80", "Common", "/Common/WebServers_Pool"),
+        ]
+        assert members[1]["entries"]["status.availabilityState"] == {"description": "offline"}
+        assert members[0]["entries"]["nodeName"] == {"description": "/Common/10.0.0.1"}
+        factory = RecordingFactory([])
+        client.add_stats_metrics(factory, members, "urn:f5:node:{nodeName}", {"serverside.curConns": "conns"})
+        assert [uid for _, _, uid in factory.metrics] == [
+            "urn:f5:node:/Common/10.0.0.1",
+            "urn:f5:node:/Common/10.0.0.2",
+        ]
+    assert "totRequests" not in members[0]["entries"], "Compact stats keep the stat keys read by the member templates"
+
+
+@requests_mock.Mocker(kw="m")
+def test_fleet_merges_items_of_all_devices(m: requests_mock.Mocker = None):
+    seed_url = "https://bigip1.local/"
+    peer_url = "https://bigip2.local/"
+    instance = InstanceInfo(
+        {
+            "instance_url": "fleet",
+            "f5": {"url": seed_url, "username": "admin", "password": "admin", "name": "bigip1"},
+            "devices": [{"url": peer_url, "username": "admin", "password": "admin", "name": "bigip2"}],
+            "dedupe_sync_groups": False,
+            "etl": {"refs": []},
+        }
+    )
+    for url in [seed_url, peer_url]:
+        m.register_uri("POST", f"{url}mgmt/shared/authn/login", json=response("authn_login"))
+        m.register_uri("GET", f"{url}mgmt/tm/ltm/node", json=response("node"))
+        m.register_uri("GET", f"{url}mgmt/tm/ltm/pool/stats", json=response("pool_stats"))
+
+    client = F5Client.begin_run(instance, logger)
+    assert isinstance(client, F5FleetClient)
+    node_count = len(response("node")["items"])
+    nodes = client.get_ltm_object("node")["items"]
+    assert len(nodes) == 2 * node_count
+    assert {node["device"] for node in nodes} == {"bigip1", "bigip2"}
+    pool_stats = client.get_ltm_object_stats("pool")
+    assert {stats["device"] for stats in pool_stats} == {"bigip1", "bigip2"}
+    assert F5Client.begin_run(instance, logger) is client
+
+
+@requests_mock.Mocker(kw="m")
+def test_fleet_discovers_devices_not_configured_by_name_or_address(m: requests_mock.Mocker = None):
+    seed_url = "https://bigip1.local/"
+    instance = InstanceInfo(
+        {
+            "instance_url": "discovered",
+            "f5": {"url": seed_url, "username": "admin", "password": "admin"},
+            "devices": [{"url": "https://BIGIP2.local/", "username": "admin", "password": "admin"}],
+            "discover_devices": True,
+            "etl": {"refs": []},
+        }
+    )
+    devices = [
+        {"name": "bigip1.local", "hostname": "bigip1.local", "managementIp": "10.0.0.1", "selfDevice": "true"},
+        {"name": "bigip2.local", "hostname": "bigip2.local", "managementIp": "10.0.0.2", "selfDevice": "false"},
+        {"name": "bigip3.local", "hostname": "bigip3.local", "managementIp": "10.0.0.3", "selfDevice": "false"},
+        {"name": "bigip4.local", "hostname": "bigip4.local", "managementIp": "fd00::4", "selfDevice": "false"},
+    ]
+    m.register_uri("POST", f"{seed_url}mgmt/shared/authn/login", json=response("authn_login"))
+    m.register_uri("GET", f"{seed_url}mgmt/tm/cm/device", json={"items": devices})
+    for url in ["https://bigip2.local/", "https://10.0.0.3/", "https://[fd00::4]/"]:
+        m.register_uri("POST", f"{url}mgmt/shared/authn/login", json=response("authn_login"))
+
+    client = F5FleetClient(instance, logger)
+    assert [(device.device_name, device.spec.url) for device in client.devices] == [
+        ("bigip2.local", "https://BIGIP2.local/"),
+        ("bigip3.local", "https://10.0.0.3/"),
+        ("bigip4.local", "https://[fd00::4]/"),
+    ]
+
+
+@requests_mock.Mocker(kw="m")
+def test_fleet_scopes_same_named_objects_by_device(m: requests_mock.Mocker = None):
+    devices = {"https://bigip1.local/": "bigip1", "https://bigip2.local/": "bigip2"}
+    specs = [{"url": url, "username": "admin", "password": "admin", "name": name} for url, name in devices.items()]
+    for fetch_rules_on_demand in [False, True]:
+        F5Client._instance_clients.clear()
+        instance = InstanceInfo(
+            {
+                "instance_url": "unrelated",
+                "f5": dict(specs[0], fetch_rules_on_demand=fetch_rules_on_demand),
+                "devices": [dict(specs[1], fetch_rules_on_demand=fetch_rules_on_demand)],
+                "dedupe_sync_groups": False,
+                "etl": {"refs": []},
+            }
+        )
+        for url, name in devices.items():
+            rule = {"name": "app_rule", "fullPath": "/Common/app_rule", "generation": 1, "apiAnonymous": name}
+            m.register_uri("POST", f"{url}mgmt/shared/authn/login", json=response("authn_login"))
+            m.register_uri("GET", f"{url}mgmt/tm/ltm/pool", json=response("pool"))
+            m.register_uri("GET", f"{url}mgmt/tm/ltm/pool/stats", json=response("pool_stats"))
+            m.register_uri("GET", f"{url}mgmt/tm/net/interface", json=response("interface"))
+            m.register_uri("GET", f"{url}mgmt/tm/ltm/rule", json={"items": [rule]})
+            m.register_uri("GET", f"{url}mgmt/tm/ltm/rule/~Common~app_rule", json=rule)
+
+        client = F5Client.begin_run(instance, logger)
+        pool_uids = {client.scoped(pool, pool["fullPath"]) for pool in client.get_ltm_object("pool")["items"]}
+        assert pool_uids == {"/Common/WebServers_Pool@bigip1", "/Common/WebServers_Pool@bigip2"}
+        interfaces = client.get_net_object("interface")["items"]
+        assert len({client.device_scoped(interface, interface["name"]) for interface in interfaces}) == 8
+        factory = RecordingFactory([])
+        client.add_stats_metrics(
+            factory, client.get_ltm_object_stats("pool"), "urn:f5:pool:/{tmName}{scope}", {"memberCnt": "cnt"}
+        )
+        assert sorted(uid for _, _, uid in factory.metrics) == [
+            "urn:f5:pool://Common/WebServers_Pool@bigip1",
+            "urn:f5:pool://Common/WebServers_Pool@bigip2",
+        ]
+        assert client.get_rule("app_rule", "bigip2") == "bigip2"
+        assert client.get_rule("/Common/app_rule" if fetch_rules_on_demand else "app_rule") == "bigip1"
+        assert client.get_rules(["app_rule"], "bigip1") == {"app_rule": "bigip1"}
+    F5Client._instance_clients.clear()
+
+
+@requests_mock.Mocker(kw="m")
+def test_fleet_collects_sync_group_config_from_active_unit(m: requests_mock.Mocker = None):
+    units = {"https://bigip1.local/": "bigip1.local.net", "https://bigip2.local/": "bigip2.local.net"}
+    instance = InstanceInfo(
+        {
+            "instance_url": "ha-pair",
+            "f5": {"url": "https://bigip1.local/", "username": "admin", "password": "admin"},
+            "devices": [{"url": "https://bigip2.local/", "username": "admin", "password": "admin"}],
+            "etl": {"refs": []},
+        }
+    )
+    nodes = {}
+    for url, device_name in units.items():
+        devices = {"items": [{"name": n, "selfDevice": str(n == device_name).lower()} for n in units.values()]}
+        device_groups = {
+            "items": [
+                {
+                    "name": "failover-group",
+                    "type": "sync-failover",
+                    "devicesReference": {"items": [{"name": n} for n in units.values()]},
+                }
+            ]
+        }
+        # bigip2 is the active unit of the pair.
+        traffic_groups = response("traffic_group_stats")
+        for entry in traffic_groups["entries"].values():
+            entry["nestedStats"]["entries"]["deviceName"]["description"] = f"/Common/{device_name}"
+            if device_name == "bigip1.local.net":
+                entry["nestedStats"]["entries"]["failoverState"]["description"] = "standby"
+        m.register_uri("POST", f"{url}mgmt/shared/authn/login", json=response("authn_login"))
+        m.register_uri("GET", f"{url}mgmt/tm/cm/device", json=devices)
+        m.register_uri("GET", f"{url}mgmt/tm/cm/device-group", json=device_groups)
+        m.register_uri("GET", f"{url}mgmt/tm/cm/traffic-group/stats", json=traffic_groups)
+        m.register_uri("GET", f"{url}mgmt/tm/ltm/pool/stats", json=response("pool_stats"))
+        m.register_uri("GET", f"{url}mgmt/tm/net/interface", json=response("interface"))
+        m.register_uri("GET", f"{url}mgmt/tm/net/self", json={"items": [{"name": "self_1", "partition": "Common"}]})
+        nodes[url] = m.register_uri("GET", f"{url}mgmt/tm/ltm/node", json=response("node"))
+        # The monitor of the standby unit sees the nodes down.
+        node_stats = response("node_stats")
+        for entry in node_stats["entries"].values():
+            if device_name == "bigip1.local.net":
+                entry["nestedStats"]["entries"]["monitorStatus"]["description"] = "down"
+        m.register_uri("GET", f"{url}mgmt/tm/ltm/node/stats", json=node_stats)
+
+    client = F5Client.begin_run(instance, logger)
+    assert {node["device"] for node in client.get_ltm_object("node")["items"]} == {"bigip2.local"}
+    assert nodes["https://bigip1.local/"].call_count == 0
+    both_units = {"bigip1.local", "bigip2.local"}
+    assert {item["device"] for item in client.get_net_object("interface")["items"]} == both_units, "Device local"
+    assert {item["device"] for item in client.iter_net_object("self")} == both_units
+    assert {item["device"] for item in client.get_cm_object("device")["items"]} == both_units
+    assert {item["device"] for item in client.get_cm_object("device-group")["items"]} == {"bigip2.local"}
+    assert {stats["device"] for stats in client.get_ltm_object_stats("pool")} == {"bigip1.local", "bigip2.local"}
+    node_states = {
+        (stats["device"], stats["entries"]["tmName"]["description"], stats["entries"]["monitorStatus"]["description"])
+        for stats in client.get_ltm_object_stats("node")
+    }
+    assert ("bigip1.local", "/Common/server1", "down") in node_states, "Node health of the standby unit is kept"
+    assert ("bigip2.local", "/Common/server1", "up") in node_states
+
+
+@requests_mock.Mocker(kw="m")
+def test_irule_switch_pools_are_parsed_once_per_revision(m: requests_mock.Mocker = None):
+    client = setup_client(m)
+    rule = """
+        when HTTP_REQUEST {
+          # switch on the uri
+          switch -glob -- [string tolower [HTTP::uri]] {
+            "/api/*" -
+            "/v1/*" { HTTP::header replace Host "api.local"; pool /Common/api_pool }
+            default {
+              if { [HTTP::uri] equals "/" } {
+                HTTP::redirect "http://[HTTP::host]/app"
+              }
+              pool /Common/app_pool
+            }
+          }
+        }
+    """
+    rules = {"items": [{"name": "app_ReverseProxy", "apiAnonymous": rule}]}
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/rule", json=rules)
+
+    client.start_run()
+    pools = client.get_pools_from_switch_statement_irule("app_ReverseProxy")
+    assert pools == [
+        {"pool": "/Common/api_pool", "host": "api.local", "uri_pattern": "/api/*"},
+        {"pool": "/Common/api_pool", "host": "api.local", "uri_pattern": "/v1/*"},
+        {"pool": "/Common/app_pool", "host": None, "uri_pattern": None},
+    ]
+    client.start_run()
+    assert client.get_pools_from_switch_statement_irule("app_ReverseProxy") is pools
+
+
+class RecordingFactory(object):
+    def __init__(self, component_uids):
+        self.components = {uid: ComponentStub() for uid in component_uids}
+        self.relations = []
+        self.metrics = []
+        self.component_checks = 0
+
+    def get_uid(self, *parts):
+        return "urn:%s" % ":".join(parts)
+
+    def component_exists(self, uid):
+        self.component_checks += 1
+        return uid in self.components
+
+    def add_component(self, component):
+        self.components[component.uid] = component
+
+    def get_component(self, uid):
+        return self.components[uid]
+
+    def relation_exists(self, source_uid, target_uid):
+        return (source_uid, target_uid) in self.relations
+
+    def add_relation(self, source_uid, target_uid):
+        self.relations.append((source_uid, target_uid))
+
+    def add_metric_value(self, name, value, target_uid):
+        self.metrics.append((name, value, target_uid))
+
+
+class ComponentStub(object):
+    def __init__(self):
+        self.properties = self
+        self.labels = []
+
+    def add_label_kv(self, key, value):
+        self.labels.append(f"{key}:{value}")
+
+
+@requests_mock.Mocker(kw="m")
+def test_proxypass_virtuals_are_resolved_from_indexed_data_group(m: requests_mock.Mocker = None):
+    client = setup_client(m)
+    data_groups = {
+        "items": [
+            {
+                "name": "ProxyPassVS",
+                "partition": "Tenant",
+                "records": [
+                    {"name": "api.local/v1", "data": "backend1/v1 api_pool"},
+                    {"name": "app.local/", "data": "backend2/ app_pool"},
+                    {"name": "app.local/admin", "data": "backend2/admin /Common/admin_pool"},
+                    {"name": "apps.local/", "data": "invalid"},
+                ],
+            }
+        ]
+    }
+    data_group_calls = m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/data-group/internal", json=data_groups)
+    factory = RecordingFactory(
+        [
+            "urn:vs:app",
+            "urn:vs:api",
+            "urn:host:virtual:server:backend1",
+            "urn:host:virtual:server:backend2",
+            "urn:f5:pool://Tenant/app_pool",
+            "urn:f5:pool://Common/admin_pool",
+        ]
+    )
+
+    client.start_run()
+    assert client.get_data_group_records("ProxyPassVS", "app.local/") == [
+        ("app.local/", "backend2/ app_pool"),
+        ("app.local/admin", "backend2/admin /Common/admin_pool"),
+    ]
+    virtuals = [
+        {"dg_name": "ProxyPassVS", "vs_uid": "urn:vs:app", "host_name": "app.local", "rule": "ProxyPass", "vip": "ip"},
+        {"dg_name": "ProxyPassVS", "vs_uid": "urn:vs:api", "host_name": "api.local", "rule": "ProxyPass", "vip": "ip"},
+    ]
+    client.process_data_group_proxypass_batch(virtuals, factory)
+
+    assert data_group_calls.call_count == 1
+    assert factory.relations == [
+        ("urn:f5:pool://Tenant/app_pool", "urn:host:virtual:server:backend2"),
+        ("urn:vs:app", "urn:f5:pool://Tenant/app_pool"),
+        ("urn:f5:pool://Common/admin_pool", "urn:host:virtual:server:backend2"),
+        ("urn:vs:app", "urn:f5:pool://Common/admin_pool"),
+    ], "The api pool does not exist, so the api virtual is not related"
+    assert factory.get_component("urn:f5:pool://Tenant/app_pool").labels == ["rule:ProxyPass"]
+    assert factory.component_checks == 6, "Known components are only checked once per batch"
+
+
+@requests_mock.Mocker(kw="m")
+def test_rules_and_data_groups_are_fetched_on_demand_by_full_path(m: requests_mock.Mocker = None):
+    client = setup_client(m, fetch_rules_on_demand=True)
+    rule_url = f"{F5_URL}mgmt/tm/ltm/rule"
+    rule_list = {
+        "items": [
+            {"name": "app_ReverseProxy", "fullPath": "/Tenant/app_ReverseProxy", "generation": 1},
+            {"name": "api_ReverseProxy", "fullPath": "/Common/api_ReverseProxy", "generation": 1},
+            {"name": "unused_rule", "fullPath": "/Common/unused_rule", "generation": 1},
+        ]
+    }
+    rules = m.register_uri("GET", rule_url, json=rule_list)
+    app_rule = m.register_uri(
+        "GET",
+        f"{rule_url}/~Tenant~app_ReverseProxy",
+        json={"name": "app_ReverseProxy", "generation": 1, "apiAnonymous": "pool /Tenant/app_pool"},
+    )
+    api_rule = m.register_uri(
+        "GET",
+        f"{rule_url}/~Common~api_ReverseProxy",
+        json={"name": "api_ReverseProxy", "generation": 1, "apiAnonymous": "pool /Common/api_pool"},
+    )
+    virtuals = {"items": [{"name": "vs", "rules": ["/Common/api_ReverseProxy"]}]}
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/virtual", json=virtuals)
+    dg_url = f"{F5_URL}mgmt/tm/ltm/data-group/internal"
+    m.register_uri("GET", dg_url, json={"items": [{"name": "ProxyPassVS", "fullPath": "/Tenant/ProxyPassVS"}]})
+    m.register_uri(
+        "GET",
+        f"{dg_url}/~Tenant~ProxyPassVS",
+        json={"name": "ProxyPassVS", "partition": "Tenant", "records": [{"name": "app.local/", "data": "a b"}]},
+    )
+
+    client.start_run()
+    client.get_ltm_object("virtual")
+    assert client.get_rule("app_ReverseProxy") == "pool /Tenant/app_pool"
+    assert client.get_rule("~Common~api_ReverseProxy") == "pool /Common/api_pool"
+    assert client.get_data_group("ProxyPassVS") == ("Tenant", {"app.local/": "a b"})
+    assert all(r.qs == {"$select": ["name,fullpath,generation"]} for r in rules.request_history)
+    assert app_rule.call_count == 1
+    assert api_rule.call_count == 1, "The rules of the virtual servers are fetched in one batch"
+
+    rule_list["items"][1]["generation"] = 2
+    client.start_run()
+    client.get_rules(["/Tenant/app_ReverseProxy", "/Common/api_ReverseProxy"])
+    assert app_rule.call_count == 1, "Unchanged rules are cached across runs"
+    assert api_rule.call_count == 2
+
+
+@requests_mock.Mocker(kw="m")
+def test_run_stats_per_endpoint_and_query(m: requests_mock.Mocker = None):
+    client = setup_client(m, prefetch=False)
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool", json=response("pool"))
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool/stats", json=response("pool_stats"))
+
+    client.start_run()
+    client.get_ltm_object("pool", expand_subcollections=True)
+    client.get_ltm_object("pool", expand_subcollections=True)
+    client.get_ltm_object_stats("pool")
+    client.end_run()
+
+    assert client.run_stats.endpoints["ltm/pool"].requests == 1
+    assert client.run_stats.endpoints["ltm/pool"].bytes > 0
+    assert client.run_stats.queries["ltm/pool?expandSubcollections=true"].calls == 2
+    assert client.run_stats.queries["ltm/pool/stats"].processing_seconds > 0
+    metrics = client.run_stats.metrics(["instance:f5"])
+    assert ("f5.check.request.count", 1.0, ["instance:f5", "endpoint:ltm/pool/stats"]) in metrics
+    assert {name for name, _, _ in metrics} == {
+        "f5.check.request.count",
+        "f5.check.request.latency",
+        "f5.check.request.bytes",
+        "f5.check.request.retries",
+        "f5.check.request.decode_time",
+        "f5.check.query.fetch_time",
+        "f5.check.query.processing_time",
+    }
+
+
+@requests_mock.Mocker(kw="m")
+def test_stats_metrics_are_mapped_for_all_records_at_once(m: requests_mock.Mocker = None):
+    metrics = {"activeMemberCnt": "f5.pool.activeMemberCnt", "status.availabilityState": "f5.pool.state"}
+    expected = [("f5.pool.activeMemberCnt", 1, "urn:f5:pool:/Common/WebServers_Pool")]
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool/stats", json=response("pool_stats"))
+    for compact_stats in [False, True]:
+        client = setup_client(m, compact_stats=compact_stats, prefetch=False)
+        client.start_run()
+        factory = RecordingFactory([])
+        stats = client.get_ltm_object_stats("pool")
+        assert client.add_stats_metrics(factory, stats, "urn:f5:pool:/{partition}/{name}", metrics) == 1
+        assert factory.metrics == expected, "Only stats with a value are sent as metric"
+
+
+@requests_mock.Mocker(kw="m")
+def test_rates_of_cumulative_counters_across_runs(m: requests_mock.Mocker = None):
+    client = setup_client(m, compact_stats=True, prefetch=False)
+    pool_stats = response("pool_stats")
+    counter = next(iter(pool_stats["entries"].values()))["nestedStats"]["entries"]["serverside.totConns"]
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool/stats", json=lambda request, context: pool_stats)
+
+    def run_metrics():
+        client.start_run()
+        factory = RecordingFactory([])
+        client.add_stats_metrics(
+            factory,
+            client.get_ltm_object_stats("pool"),
+            "urn:f5:pool:/{tmName}",
+            {},
+            rates={"serverside.totConns": "f5.pool.connections.rate"},
+            deltas={"serverside.totConns": "f5.pool.connections"},
+        )
+        return {name: value for name, value, _ in factory.metrics}
+
+    assert run_metrics() == {}, "The first sample has no rate"
+    counter["value"] += 30
+    metrics = run_metrics()
+    assert metrics["f5.pool.connections"] == 30
+    assert metrics["f5.pool.connections.rate"] > 30
+    counter["value"] = 5
+    assert run_metrics() == {}, "A counter reset has no rate"
+    counter["value"] = 10
+    assert run_metrics()["f5.pool.connections"] == 5
+
+
+@requests_mock.Mocker(kw="m")
+def test_interface_and_virtual_server_rates_of_the_templates(m: requests_mock.Mocker = None):
+    client = setup_client(m, ["module_dir://sts_f5_impl.templates"], compact_stats=True, prefetch=False)
+    interface_stats, virtual_stats = response("interface_stats"), response("virtual_stats")
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/net/interface/stats", json=lambda request, context: interface_stats)
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/virtual/stats", json=lambda request, context: virtual_stats)
+    templates = {}
+    for file_name in ["050_f5_virtual_servers.yaml", "060_f5_interfaces.yaml"]:
+        with open(f"src/sts_f5_impl/templates/{file_name}") as f:
+            etl = yaml.safe_load(f)["etl"]
+        for template in etl["template"]["metrics"]:
+            templates[template["name"]] = template["code"]
+
+    def run_metrics():
+        client.start_run()
+        factory = RecordingFactory([])
+        for name, stats in [
+            ("f5_interface_metrics_template", client.get_net_object_stats("interface")),
+            ("f5_virtual_server_metrics_template", client.get_ltm_object_stats("virtual")),
+        ]:
+            exec(templates[name], {"f5": client, "factory": factory, "item": stats})
+        return {(name, uid): value for name, value, uid in factory.metrics}
+
+    assert ("f5.interface.counters.bitsIn.rate", "urn:f5:interface:1.1") not in run_metrics()
+    for stats in [interface_stats, virtual_stats]:
+        for entry in stats["entries"].values():
+            for key, stat in entry["nestedStats"]["entries"].items():
+                if key.startswith(("counters.", "clientside.")):
+                    stat["value"] += 100
+    metrics = run_metrics()
+    assert metrics[("f5.interface.counters.bitsIn.rate", "urn:f5:interface:1.1")] > 0
+    assert metrics[("f5.interface.counters.pktsOut.rate", "urn:f5:interface:1.1")] > 0
+    assert metrics[("f5.virtual.clientside.bitsOut.rate", "urn:f5:virtual:server:AppServer_80")] > 0
+    assert ("f5.virtual.clientside.curConns", "urn:f5:virtual:server:AppServer_80") in metrics
+
+
+def test_generation_cache_evicts_the_least_recently_used_objects():
+    cache = GenerationCache(2)
+    cache.put("/Common/rule1", 1, "rule1")
+    cache.put("/Common/rule2", 1, "rule2")
+    assert cache.get("/Common/rule1", 1) == "rule1"
+    cache.put("/Common/rule3", 1, "rule3")
+    assert cache.get("/Common/rule2", 1) is None, "The least recently used object is evicted"
+    assert cache.get("/Common/rule1", 1) == "rule1"
+
+    cache.put("/Common/rule3", 2, "rule3 modified")
+    cache.put("/Common/rule4", 1, "rule4")
+    assert cache.get("/Common/rule1", 1) is None, "Putting an object again makes it the most recently used"
+    assert cache.get("/Common/rule3", 1) is None, "An object of another generation is not returned"
+    assert cache.get("/Common/rule3", 2) == "rule3 modified"
+    assert len(cache) == 2
+
+
+def test_topology_is_collected_at_its_own_interval():
+    schedule = QuerySchedule(600)
+    assert schedule.topology_due(1000)
+    schedule.topology_collected(1000)
+    assert not schedule.topology_due(1015)
+    assert schedule.topology_due(1600)
+
+    refs = schedule.telemetry_refs(["module_dir://sts_f5_impl.templates"])
+    assert schedule.telemetry_refs(["module_dir://sts_f5_impl.templates"]) == refs, "Unchanged templates are reused"
+    scanner = TemplateScanner(refs)
+    assert [n.split("_", 1)[1] for n in map(os.path.basename, scanner.template_files())] == [
+        "010_default.yaml",
+        "030_f5_nodes.yaml",
+        "040_f5_pools.yaml",
+        "045_f5_pool_members.yaml",
+        "050_f5_virtual_servers.yaml",
+        "060_f5_interfaces.yaml",
+    ]
+    assert [repr(ref) for ref in scanner.collections()] == [
+        "ltm/node/stats",
+        "ltm/pool/stats",
+        "ltm/pool/stats?expandSubcollections=true",
+        "ltm/virtual/stats",
+        "net/interface/stats",
+    ]
+    schedule.close()
+
+
+def test_telemetry_template_copies_keep_the_collection_calls(tmp_path):
+    template = tmp_path / "050_virtuals.yaml"
+    template.write_text(
+        "etl:\n"
+        "  queries:\n"
+        "    - name: f5_virtual_metrics\n"
+        "      query: \"[f5.get_ltm_object_stats('virtual')]\"\n"
+        "      template_refs:\n"
+        "        - f5_virtual_metrics_template\n"
+        "  template:\n"
+        "    metrics:\n"
+        "      - name: f5_virtual_metrics_template\n"
+        "        code: |\n"
+        "          f5.add_stats_metrics(factory, item, 'urn:f5:virtual:server:{name}', {\n"
+        "            'clientside.curConns': 'f5.virtual.clientside.curConns',\n"
+        "          })\n"
+    )
+    schedule = QuerySchedule(600)
+    scanner = TemplateScanner(schedule.telemetry_refs([str(tmp_path)]))
+    assert [repr(ref) for ref in scanner.collections()] == ["ltm/virtual/stats"]
+    assert "clientside.curConns" in scanner.stat_keys()[CollectionRef("ltm", "virtual", True)]
+    schedule.close()
+
+
+def test_template_module_must_be_a_regular_package(tmp_path, monkeypatch):
+    (tmp_path / "f5_namespace_templates").mkdir()
+    monkeypatch.syspath_prepend(str(tmp_path))
+    with pytest.raises(Exception, match="namespace package"):
+        TemplateScanner(["module_dir://f5_namespace_templates"]).template_files()
+
+
+def test_template_scan_is_cached_until_a_template_changes(tmp_path):
+    template = tmp_path / "030_nodes.yaml"
+    template.write_text("etl:\n  queries:\n    - name: f5_hosts\n      query: \"f5.get_ltm_object('node')['items']\"\n")
+    scanner = TemplateScanner([str(tmp_path)])
+    assert [repr(ref) for ref in scanner.collections()] == ["ltm/node"]
+    scanner.collections().clear()
+    assert [repr(ref) for ref in TemplateScanner([str(tmp_path)]).collections()] == ["ltm/node"]
+
+    template.write_text("etl:\n  queries:\n    - name: f5_pools\n      query: \"f5.get_ltm_object('pool')['items']\"\n")
+    os.utime(template, ns=(0, template.stat().st_mtime_ns + 1000))
+    assert [repr(ref) for ref in scanner.collections()] == ["ltm/pool"]
+
+
+def test_delta_topology_sends_changed_elements_and_a_periodic_snapshot():
+    delta = TopologyDelta(3600)
+
+    def run(now, components):
+        delta.begin(now)
+        for uid, data in components.items():
+            delta.add("component", uid, (uid, "f5-pool", data), {})
+            delta.add("relation", (uid, "urn:node", "uses"), (uid, "urn:node", "uses", {}), {})
+        calls, removed = delta.finish()
+        return delta.full, [(kind, args[0]) for kind, args, _ in calls], removed
+
+    assert run(0, {"urn:a": {"x": 1}, "urn:b": {"x": 1}})[0], "The first run is a full snapshot"
+    assert run(120, {"urn:a": {"x": 1}, "urn:b": {"x": 1}}) == (False, [], [])
+    assert run(240, {"urn:a": {"x": 2}, "urn:c": {"x": 1}}) == (
+        False,
+        [("component", "urn:a"), ("component", "urn:c"), ("relation", "urn:c")],
+        ["urn:b"],
+    )
+    full, calls, removed = run(3600, {"urn:a": {"x": 2}, "urn:c": {"x": 1}})
+    assert full and len(calls) == 4 and removed == []
+
+    delta.begin(3700)
+    delta.add("component", "urn:a", ("urn:a", "f5-pool", {"x": 2}), {})
+    assert len(delta.discard()) == 1
+    delta.begin(3800)
+    assert delta.full, "A failed run is followed by a full snapshot"
+
+
+@requests_mock.Mocker(kw="m")
+def test_throttle_backs_off_and_skips_non_critical_collections_when_overloaded(m: requests_mock.Mocker = None):
+    client = setup_client(
+        m, adaptive_throttling=True, max_concurrent_requests=8, non_critical_collections=["net/interface/stats"]
+    )
+    throttle = client._throttle
+    interface_stats = m.register_uri("GET", f"{F5_URL}mgmt/tm/net/interface/stats", json=response("interface_stats"))
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool/stats", json=response("pool_stats"))
+
+    client.start_run()
+    assert len(client.get_net_object_stats("interface")) == 4
+    throttle.record("ltm/pool", 0.1, False)
+    assert throttle.limit == 8
+    throttle.record("ltm/pool", 1.0, False)
+    assert throttle.limit == 4 and throttle.delay > 0, "A slow response halves the concurrency"
+    throttle.record("ltm/pool", 0.1, False)
+    assert throttle.limit == 4.25 and throttle.delay == 0
+
+    for _ in range(20):
+        throttle.record("ltm/pool", 0.0, True)
+    assert throttle.limit == 1 and throttle.overloaded
+    client.start_run()
+    assert client.get_net_object_stats("interface") == []
+    assert interface_stats.call_count == 1
+    assert len(client.get_ltm_object_stats("pool")) == 1
+
+
+def test_partitions_are_split_over_shards():
+    partitions = ["Common"] + [f"Tenant_{i}" for i in range(50)]
+    shards = [PartitionFilter([], [], shard, 3, common_shard=2) for shard in [1, 2, 3]]
+    for partition in partitions:
+        assert sum(shard.includes(partition) for shard in shards) == 1
+    assert [shard.includes("Common") for shard in shards] == [False, True, False]
+    assert shards[1].includes(None), "Objects without a partition are collected with /Common"
+    assert all(len([p for p in partitions if shard.includes(p)]) > 5 for shard in shards)
+
+
+@requests_mock.Mocker(kw="m")
+def test_only_the_partitions_of_the_instance_are_collected(m: requests_mock.Mocker = None):
+    def instance(**partitions):
+        return InstanceInfo(
+            {
+                "instance_url": "tenants",
+                "f5": {"url": F5_URL, "username": "admin", "password": "admin"},
+                "etl": {"refs": []},
+                **partitions,
+            }
+        )
+
+    pool_items = [{"name": f"pool_{p}", "partition": p} for p in ["Common", "Tenant_A", "Tenant_B"]]
+    pool_stats = response("pool_stats")
+    link, stats = next(iter(pool_stats["entries"].items()))
+    pool_stats["entries"] = {link.replace("~Common~", f"~{p}~"): stats for p in ["Common", "Tenant_A"]}
+    m.register_uri("POST", f"{F5_URL}mgmt/shared/authn/login", json=response("authn_login"))
+    pools = m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool", json={"items": pool_items})
+    m.register_uri("GET", f"{F5_URL}mgmt/tm/ltm/pool/stats", json=pool_stats)
+
+    client = F5Client.begin_run(instance(partitions=["/Tenant_A"]), logger)
+    assert [pool["name"] for pool in client.get_ltm_object("pool")["items"]] == ["pool_Tenant_A"]
+    assert pools.last_request.qs["$filter"] == ["partition eq tenant_a"]
+    assert [(s["partition"], s["name"]) for s in client.get_ltm_object_stats("pool")] == [
+        ("Tenant_A", "WebServers_Pool")
+    ]
+
+    shard = PartitionFilter.get_shard("Tenant_A", 2)
+    client = F5Client.begin_run(
+        instance(
+            exclude_partitions=["Tenant_B"],
+            partition_shard=shard,
+            partition_shards=2,
+            common_partition_shard=shard % 2 + 1,
+        ),
+        logger,
+    )
+    assert [pool["name"] for pool in client.iter_ltm_object("pool")] == ["pool_Tenant_A"]
+    assert "$filter" not in pools.last_request.qs, "Shards are selected from the response"